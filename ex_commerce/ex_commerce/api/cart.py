@@ -3,6 +3,8 @@ from frappe import _
 from frappe.utils import get_request_session
 import json
 
+from ex_commerce.ex_commerce.services.pricing import get_item_price
+
 
 # CSRF validation is now properly handled through guest session establishment
 # No need to skip CSRF validation - guest users get proper CSRF tokens
@@ -84,11 +86,7 @@ def add_to_cart(item_code, qty=1):
 	frappe.logger().info(f"ADD_TO_CART: Item found - {item}")
 	
 	# Get price
-	price = frappe.db.get_value(
-		"Item Price",
-		{"item_code": item_code, "selling": 1},
-		"price_list_rate"
-	) or 0
+	price = get_item_price(item_code)
 	
 	qty = max(1, int(qty) if qty else 1)
 	
@@ -0,0 +1,35 @@
+"""
+Streaming chat API
+"""
+
+import frappe
+from frappe.rate_limiter import rate_limit
+
+from ex_commerce.ex_commerce.services import chat_stream
+from ex_commerce.ex_commerce.services.sse import sse_response, text_stream_response
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+@rate_limit(limit=20, seconds=60)
+def stream_reply(message: str, customer: str | None = None, message_id: str | None = None, format="sse"):
+	"""
+	Reply to a chat message as the provider generates it.
+
+	`format="sse"` sends `message`, `token`, `done` / `error` server-sent
+	events; `format="text"` sends only the reply text, chunked. Pass
+	`customer` (readable by the session user) to continue their conversation.
+	"""
+	if customer:
+		frappe.has_permission("Customer", "read", doc=customer, throw=True)
+
+	events = chat_stream.start_reply(message, customer=customer or None, message_id=message_id)
+	if format == "text":
+		return text_stream_response(data["text"] for event, data in events if event == "token")
+	return sse_response(events)
+
+
+@frappe.whitelist()
+def get_stream_metrics():
+	"""Time-to-first-token percentiles over recent streamed replies"""
+	frappe.only_for("System Manager")
+	return {"ttft": chat_stream.get_ttft_stats()}
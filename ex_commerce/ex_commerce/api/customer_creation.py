@@ -1,12 +1,26 @@
 import frappe
 from frappe import _
 
+# Checkout is Ghana-first; local numbers ("055...") are assumed to be +233
+DEFAULT_COUNTRY_CODE = "233"
+# National significant number length, without the trunk "0"
+LOCAL_NUMBER_DIGITS = 9
+
+CUSTOMER_LOCK_PREFIX = "ex_commerce:customer_lock:"
+CUSTOMER_CACHE_PREFIX = "ex_commerce:customer_by_phone:"
+CUSTOMER_CACHE_TTL = 6 * 60 * 60
+
 
 @frappe.whitelist(allow_guest=True)
 def create_customer_with_details(customer_data):
 	"""
 	Create a complete customer record with contact and address.
 	
+	Idempotent per phone number: if a Customer already exists for the
+	normalized phone it is returned (with "existing": True) instead of
+	creating a duplicate. Concurrent calls for the same phone are serialized
+	with a Redis lock so they converge on one record.
+
 	Args:
 		customer_data (dict): {
 			"customer_name": "John Doe",
@@ -35,6 +49,158 @@ def create_customer_with_details(customer_data):
 		import json
 		customer_data = json.loads(customer_data)
 	
+	phone = normalize_phone(customer_data.get("phone"))
+	if not phone:
+		return _create_customer_records(customer_data)
+
+	customer_data["phone"] = phone
+
+	# Fast path: a previous checkout already resolved this phone number
+	existing = _get_cached_customer(phone)
+	if existing:
+		return _existing_customer_response(existing)
+
+	# Serialize concurrent checkouts for the same phone so double-submits and
+	# parallel tabs converge on a single Customer instead of racing to insert
+	cache = frappe.cache()
+	lock = cache.lock(cache.make_key(f"{CUSTOMER_LOCK_PREFIX}{phone}"), timeout=30, blocking_timeout=15)
+	if not lock.acquire():
+		return {
+			"success": False,
+			"error": "Customer creation already in progress for this phone number",
+			"message": "Failed to create customer. Please try again."
+		}
+
+	try:
+		existing = find_customer_by_phone(phone)
+		if existing:
+			_cache_customer(phone, existing.name)
+			return _existing_customer_response(existing)
+
+		result = _create_customer_records(customer_data)
+		if result.get("success"):
+			_cache_customer(phone, result["customer"]["name"])
+		return result
+	finally:
+		try:
+			lock.release()
+		except Exception:
+			# Lock expired while we were still working - nothing left to release
+			pass
+
+
+def normalize_phone(phone):
+	"""
+	Normalize a phone number to a canonical `+<country><number>` form.
+
+	"+233 55 729 7891", "00233557297891", "233557297891", "0557297891" and
+	"557297891" all become "+233557297891". Only `0...` and 9-digit numbers
+	are taken as local (DEFAULT_COUNTRY_CODE); any other number without a
+	`+`/`00` prefix is returned as given rather than guessed at.
+	"""
+	if not phone:
+		return ""
+
+	phone = str(phone).strip()
+	digits = "".join(ch for ch in phone if ch.isdigit())
+	if not digits:
+		return ""
+
+	if phone.startswith("+"):
+		return f"+{digits}"
+	if digits.startswith("00"):
+		return f"+{digits[2:]}"
+	if digits.startswith("0"):
+		return f"+{DEFAULT_COUNTRY_CODE}{digits[1:]}"
+	if len(digits) == LOCAL_NUMBER_DIGITS:
+		return f"+{DEFAULT_COUNTRY_CODE}{digits}"
+	if digits.startswith(DEFAULT_COUNTRY_CODE) and len(digits) == len(DEFAULT_COUNTRY_CODE) + LOCAL_NUMBER_DIGITS:
+		return f"+{digits}"
+	return phone
+
+
+def find_customer_by_phone(phone):
+	"""
+	Find an existing Customer by phone in one round trip.
+
+	Checks Customer.mobile_no, linked Contacts and linked Addresses in a single
+	UNION query, matching both the normalized number and its local `0...` form
+	so records created before normalization are still found.
+	"""
+	phone = normalize_phone(phone)
+	if not phone:
+		return None
+
+	candidates = [phone]
+	if phone.startswith(f"+{DEFAULT_COUNTRY_CODE}"):
+		candidates.append("0" + phone[len(DEFAULT_COUNTRY_CODE) + 1:])
+	candidates = tuple(candidates)
+
+	rows = frappe.db.sql("""
+		SELECT name, customer_name, email_id, mobile_no, 1 AS priority
+		FROM `tabCustomer`
+		WHERE mobile_no IN %(phones)s
+		UNION ALL
+		SELECT c.name, c.customer_name, c.email_id, c.mobile_no, 2 AS priority
+		FROM `tabCustomer` c
+		INNER JOIN `tabDynamic Link` dl ON dl.link_doctype = 'Customer' AND dl.link_name = c.name AND dl.parenttype = 'Contact'
+		INNER JOIN `tabContact` co ON co.name = dl.parent
+		WHERE co.mobile_no IN %(phones)s OR co.phone IN %(phones)s
+		UNION ALL
+		SELECT c.name, c.customer_name, c.email_id, c.mobile_no, 3 AS priority
+		FROM `tabCustomer` c
+		INNER JOIN `tabDynamic Link` dl ON dl.link_doctype = 'Customer' AND dl.link_name = c.name AND dl.parenttype = 'Address'
+		INNER JOIN `tabAddress` a ON a.name = dl.parent
+		WHERE a.phone IN %(phones)s
+		ORDER BY priority
+		LIMIT 1
+	""", {"phones": candidates}, as_dict=True)
+
+	return rows[0] if rows else None
+
+
+def _get_cached_customer(phone):
+	"""Return the Customer previously resolved for this phone, if it still exists"""
+	customer_name = frappe.cache().get_value(f"{CUSTOMER_CACHE_PREFIX}{phone}")
+	if not customer_name:
+		return None
+
+	customer = frappe.db.get_value(
+		"Customer",
+		customer_name,
+		["name", "customer_name", "email_id", "mobile_no"],
+		as_dict=True
+	)
+	if not customer:
+		frappe.cache().delete_value(f"{CUSTOMER_CACHE_PREFIX}{phone}")
+	return customer
+
+
+def _cache_customer(phone, customer_name):
+	frappe.cache().set_value(
+		f"{CUSTOMER_CACHE_PREFIX}{phone}",
+		customer_name,
+		expires_in_sec=CUSTOMER_CACHE_TTL
+	)
+
+
+def _existing_customer_response(customer):
+	return {
+		"success": True,
+		"found": True,
+		"existing": True,
+		"customer": {
+			"name": customer.name,
+			"customer_name": customer.customer_name,
+			"mobile_no": customer.mobile_no,
+			"email_id": customer.email_id
+		},
+		"message": "Customer already exists for this phone number"
+	}
+
+
+def _create_customer_records(customer_data):
+	"""Insert Customer, Contact and Shipping Address for checkout data"""
 	try:
 		# Step 1: Create Customer
 		customer = frappe.get_doc({
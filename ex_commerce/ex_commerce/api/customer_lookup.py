@@ -195,7 +195,8 @@ def debug_contact_lookup(phone_number):
 def create_customer_from_checkout(name=None, email=None, phone=None, address=None, city=None, state=None, zip=None):
     """
     Create customer from checkout form data.
-    This is a wrapper around create_customer_with_details for backward compatibility.
+    This is a wrapper around create_customer_with_details for backward compatibility,
+    so it inherits its get-or-create behaviour keyed on the normalized phone.
     """
     from ex_commerce.ex_commerce.api.customer_creation import create_customer_with_details
     
@@ -0,0 +1,44 @@
+"""
+AI Message Log read API
+"""
+
+import frappe
+
+from ex_commerce.ex_commerce.api.products import _coerce_int
+from ex_commerce.ex_commerce.services.message_log import get_customer_messages
+
+
+@frappe.whitelist()
+def get_messages(customer, before=None, before_name=None, limit=50):
+	"""
+	Chat history for a customer, newest first.
+
+	Pass `next_cursor` from the previous response as `before`/`before_name`
+	to fetch the next page.
+	"""
+	frappe.has_permission("AI Message Log", "read", throw=True)
+
+	limit = _coerce_int(limit, 50, 1, 200)
+	messages = get_customer_messages(customer, before=before, before_name=before_name, limit=limit)
+
+	next_cursor = None
+	if len(messages) == limit:
+		next_cursor = {"before": str(messages[-1].created_at), "before_name": messages[-1].name}
+
+	return {
+		"messages": messages,
+		"next_cursor": next_cursor,
+	}
+
+
+@frappe.whitelist()
+def search_logs(doctype="AI Message Log", customer=None, from_date=None, to_date=None, limit=100):
+	"""Read AI Message Log / AI Feedback Log rows, including months already archived"""
+	from ex_commerce.ex_commerce.services.log_archive import query_logs
+
+	frappe.has_permission(doctype, "read", throw=True)
+
+	limit = _coerce_int(limit, 100, 1, 1000)
+	return {
+		"rows": query_logs(doctype, customer=customer, from_date=from_date, to_date=to_date, limit=limit),
+	}
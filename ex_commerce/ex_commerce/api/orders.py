@@ -1,11 +1,19 @@
 import frappe
 from frappe import _
+from frappe.rate_limiter import rate_limit
 from frappe.utils import nowdate, add_days
 
 
 # CSRF validation is now properly handled through guest session establishment
 # No need to skip CSRF validation - guest users get proper CSRF tokens
 
+# Long-poll tuning for wait_for_order_status. Each poll holds a web worker,
+# so polls are short and rate limited per IP (at most two in flight).
+MAX_LONG_POLL_SECONDS = 10
+LONG_POLL_RATE_LIMIT = 12
+LONG_POLL_INTERVAL_SECONDS = 0.5
+LONG_POLL_DB_CHECK_SECONDS = 5
+
 
 def get_guest_cart_id():
 	"""Generate a unique cart ID for guest users based on session."""
@@ -278,3 +286,57 @@ def get_order_status(order_id):
 	except:
 		frappe.throw("Order not found")
 
+
+@frappe.whitelist(allow_guest=True)
+@rate_limit(limit=LONG_POLL_RATE_LIMIT, seconds=60)
+def wait_for_order_status(order_id, last_status=None, timeout=MAX_LONG_POLL_SECONDS):
+	"""Long-poll fallback for the realtime order status feed.
+
+	Returns as soon as the order's status differs from `last_status`, or with
+	`changed: False` after `timeout` seconds (at most MAX_LONG_POLL_SECONDS).
+	Waiting only reads the Redis snapshot; the database is re-checked every
+	few seconds to catch status updates that bypass document events (e.g.
+	`db_set`). The re-check only refreshes the snapshot: realtime events and
+	webhooks come from document events alone.
+	"""
+	import time
+
+	from ex_commerce.ex_commerce.services.order_events import (
+		get_status_snapshot,
+		refresh_status_snapshot,
+	)
+
+	if not order_id:
+		frappe.throw("Order ID is required")
+
+	try:
+		timeout = max(0, min(float(timeout), MAX_LONG_POLL_SECONDS))
+	except (TypeError, ValueError):
+		timeout = MAX_LONG_POLL_SECONDS
+
+	deadline = time.monotonic() + timeout
+	next_db_check = time.monotonic()
+
+	while True:
+		now = time.monotonic()
+		if now >= next_db_check:
+			status = frappe.db.get_value("Sales Order", order_id, "status")
+			if status is None:
+				frappe.throw("Order not found")
+			refresh_status_snapshot("Sales Order", order_id, status)
+			next_db_check = now + LONG_POLL_DB_CHECK_SECONDS
+
+		snapshot = get_status_snapshot("Sales Order", order_id) or {}
+		if snapshot.get("status") and snapshot.get("status") != last_status:
+			return {
+				"order_id": order_id,
+				"status": snapshot.get("status"),
+				"changed": True,
+				"seq": snapshot.get("seq"),
+				"changed_at": snapshot.get("changed_at"),
+			}
+
+		if now >= deadline:
+			return {"order_id": order_id, "status": last_status, "changed": False}
+
+		time.sleep(LONG_POLL_INTERVAL_SECONDS)
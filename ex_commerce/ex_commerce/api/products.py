@@ -1,4 +1,9 @@
 import frappe
+from frappe.rate_limiter import rate_limit
+
+from ex_commerce.ex_commerce.services import hybrid_search, product_qa
+from ex_commerce.ex_commerce.services.pricing import get_item_price, get_item_prices
+from ex_commerce.ex_commerce.services.sse import sse_response
 
 
 def _coerce_int(value, default, min_v, max_v):
@@ -31,13 +36,18 @@ def get_products(limit=20, offset=0, search=None, category=None):
 		conditions.append("item_group = %(category)s")
 		params["category"] = category
 
+	ranked_codes = None
 	if search and isinstance(search, str):
 		q = search.strip()
 		if q:
 			# Guard excessive length
 			q = q[:64]
-			conditions.append("(item_name like %(q)s or item_code like %(q)s)")
+			# Lexical (SKU, name) and knowledge base matches, fused and ranked, plus
+			# plain substring matches (partial codes), which are listed after them
+			ranked_codes = hybrid_search.search_item_codes(q)
+			conditions.append("(item_name like %(q)s or item_code like %(q)s or item_code in %(codes)s)")
 			params["q"] = f"%{q}%"
+			params["codes"] = tuple(ranked_codes) or ("",)
 
 	where_sql = " and ".join(conditions)
 
@@ -64,23 +74,13 @@ def get_products(limit=20, offset=0, search=None, category=None):
 		as_dict=True,
 	)
 
+	if ranked_codes is not None:
+		rank = {code: i for i, code in enumerate(ranked_codes)}
+		items.sort(key=lambda i: rank.get(i.item_code, len(rank)))
+
 	item_codes = [i.item_code for i in items if i.get("item_code")]
 
-	prices = {}
-	if item_codes:
-		price_rows = frappe.db.sql(
-			"""
-			select item_code, price_list_rate as price
-			from `tabItem Price`
-			where item_code in %(codes)s and selling = 1
-			order by creation desc
-		""",
-			{"codes": tuple(item_codes)},
-			as_dict=True,
-		)
-		for row in price_rows:
-			# keep first seen (latest by creation due to order)
-			prices.setdefault(row.item_code, row.price)
+	prices = get_item_prices(item_codes)
 
 	# Stock not relevant for order-based system
 	# All items are available for ordering
@@ -113,20 +113,7 @@ def get_products(limit=20, offset=0, search=None, category=None):
 		# Final set of templates to summarize (those already listed as templates or appearing via variants)
 		all_template_codes = set(template_codes) | set(t for t in templates_from_variants if t)
 
-		variant_prices = {}
-		if variant_codes:
-			v_price_rows = frappe.db.sql(
-				"""
-				select item_code, price_list_rate as price
-				from `tabItem Price`
-				where item_code in %(codes)s and selling = 1
-				order by creation desc
-				""",
-				{"codes": tuple(variant_codes)},
-				as_dict=True,
-			)
-			for r in v_price_rows:
-				variant_prices.setdefault(r.item_code, r.price)
+		variant_prices = get_item_prices(variant_codes)
 
 		# Aggregate per template
 		for v in variant_rows:
@@ -252,13 +239,7 @@ def get_product(item_code: str):
 	if not row:
 		frappe.throw("Product not found")
 
-	price = frappe.db.get_value(
-		"Item Price",
-		{"item_code": item_code, "selling": 1},
-		"price_list_rate",
-	) or 0
-
-	price_f = float(price) or 0.0
+	price_f = get_item_price(item_code)
 
 	response_product = {
 		"name": row.name,
@@ -290,20 +271,7 @@ def get_product(item_code: str):
 
 		if variant_rows:
 			v_codes = tuple(v.item_code for v in variant_rows)
-			v_prices = {}
-			if v_codes:
-				price_rows = frappe.db.sql(
-					"""
-					select item_code, price_list_rate as price
-					from `tabItem Price`
-					where item_code in %(codes)s and selling = 1
-					order by creation desc
-					""",
-					{"codes": v_codes},
-					as_dict=True,
-				)
-				for pr in price_rows:
-					v_prices.setdefault(pr.item_code, pr.price)
+			v_prices = get_item_prices(v_codes)
 
 			for v in variant_rows:
 				vp = float(v_prices.get(v.item_code) or 0) or 0.0
@@ -326,3 +294,23 @@ def get_product(item_code: str):
 	}
 
 
+@frappe.whitelist(allow_guest=True, methods=["GET", "POST"])
+@rate_limit(limit=30, seconds=60)
+def ask_product(question: str, item_code: str | None = None, stream=0):
+	"""Public (guest-allowed) product question answering over the knowledge base.
+
+	Answers from the best matching Product Knowledge Base excerpts plus live
+	prices. With `stream=1` the answer is sent as server-sent events
+	(`context`, `token`..., `done`) instead of one JSON response.
+	"""
+	if not question or not question.strip():
+		frappe.throw("Question is required")
+	if item_code and len(item_code) > 64:
+		frappe.throw("Invalid item_code")
+
+	context = product_qa.prepare_answer(question, item_code=item_code or None)
+
+	if frappe.utils.cint(stream):
+		return sse_response(product_qa.stream_answer(context))
+
+	return {"success": True, **product_qa.answer(context)}
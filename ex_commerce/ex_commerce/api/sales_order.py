@@ -4,7 +4,15 @@ ERPNext Sales Order Integration for Ex Commerce
 
 import frappe
 from frappe import _
-from frappe.utils import now_datetime
+from frappe.utils import get_datetime, now_datetime
+
+from ex_commerce.ex_commerce.services import sales_order_mapping
+from ex_commerce.ex_commerce.services.sales_order_mapping import (
+    create_erpnext_sales_order as create_sales_order_from_ex_order,
+)
+
+# Upper bound for one get_erpnext_sales_order_statuses call
+MAX_STATUS_BATCH = 500
 
 
 @frappe.whitelist()
@@ -31,51 +39,7 @@ def create_erpnext_sales_order(ex_commerce_order_name):
             }
         
         # Create ERPNext Sales Order
-        so = frappe.new_doc("Sales Order")
-        so.customer = ex_order.customer
-        so.customer_name = ex_order.customer_name
-        so.transaction_date = ex_order.transaction_date
-        so.delivery_date = ex_order.delivery_date
-        so.company = ex_order.company
-        so.currency = ex_order.currency
-        so.selling_price_list = ex_order.selling_price_list
-        so.order_type = ex_order.order_type
-        so.po_no = ex_order.po_no
-        so.po_date = ex_order.po_date
-        
-        # Set addresses
-        if ex_order.guest_billing_address:
-            so.customer_address = get_customer_address(ex_order.customer, "Billing")
-        if ex_order.guest_shipping_address:
-            so.shipping_address_name = get_customer_address(ex_order.customer, "Shipping")
-        
-        # Copy items
-        for item in ex_order.items:
-            so.append("items", {
-                "item_code": item.item_code,
-                "item_name": item.item_name,
-                "qty": item.qty,
-                "rate": item.rate,
-                "amount": item.amount,
-                "warehouse": item.warehouse or ex_order.set_warehouse
-            })
-        
-        # Copy taxes
-        if ex_order.taxes:
-            for tax in ex_order.taxes:
-                so.append("taxes", {
-                    "charge_type": tax.charge_type,
-                    "account_head": tax.account_head,
-                    "description": tax.description,
-                    "rate": tax.rate,
-                    "tax_amount": tax.tax_amount
-                })
-        
-        so.insert()
-        so.submit()
-        
-        # Link back to Ex Commerce Sales Order
-        frappe.db.set_value("Ex Commerce Sales Order", ex_order.name, "erpnext_sales_order", so.name)
+        so = create_sales_order_from_ex_order(ex_order)
         
         return {
             "success": True,
@@ -91,19 +55,69 @@ def create_erpnext_sales_order(ex_commerce_order_name):
         }
 
 
+@frappe.whitelist()
+def queue_erpnext_sales_order_sync(ex_commerce_order_name):
+    """
+    Queue ERPNext Sales Order creation for an Ex Commerce Sales Order.
+    The Sales Order is built and submitted by a background worker; poll
+    get_erpnext_sales_order_status for the outcome.
+    """
+    from ex_commerce.ex_commerce.services.sales_order_sync import enqueue_sync
+
+    try:
+        order = frappe.db.get_value(
+            "Ex Commerce Sales Order",
+            ex_commerce_order_name,
+            ["name", "customer", "erpnext_sales_order", "erpnext_sync_status"],
+            as_dict=True
+        )
+
+        if not order:
+            return {
+                "success": False,
+                "error": f"Ex Commerce Sales Order {ex_commerce_order_name} not found"
+            }
+
+        if not order.customer:
+            return {
+                "success": False,
+                "error": "Customer must be assigned before creating ERPNext Sales Order"
+            }
+
+        if order.erpnext_sales_order:
+            return {
+                "success": True,
+                "sales_order": order.erpnext_sales_order,
+                "sync_status": "Synced",
+                "message": "ERPNext Sales Order already exists"
+            }
+
+        if order.erpnext_sync_status in ("Queued", "Syncing"):
+            return {
+                "success": True,
+                "sync_status": order.erpnext_sync_status,
+                "message": "ERPNext Sales Order sync already in progress"
+            }
+
+        enqueue_sync(order.name, reset_attempts=True)
+
+        return {
+            "success": True,
+            "sync_status": "Queued",
+            "message": "ERPNext Sales Order sync queued"
+        }
+
+    except Exception as e:
+        frappe.log_error(f"Error queueing ERPNext Sales Order sync: {e!s}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
 def get_customer_address(customer, address_type):
     """Get customer address by type"""
-    addresses = frappe.get_all(
-        "Address",
-        filters={
-            "link_doctype": "Customer",
-            "link_name": customer,
-            "address_type": address_type
-        },
-        fields=["name"],
-        limit=1
-    )
-    return addresses[0].name if addresses else None
+    return sales_order_mapping.get_customer_address(customer, address_type)
 
 
 @frappe.whitelist()
@@ -112,20 +126,73 @@ def get_erpnext_sales_order_status(ex_commerce_order_name):
     Get status of linked ERPNext Sales Order
     """
     try:
-        ex_order = frappe.get_doc("Ex Commerce Sales Order", ex_commerce_order_name)
+        statuses = fetch_erpnext_sales_order_statuses([ex_commerce_order_name])
+        order = statuses.get(ex_commerce_order_name)
+        
+        if not order:
+            return {
+                "success": False,
+                "error": f"Ex Commerce Sales Order {ex_commerce_order_name} not found"
+            }
         
-        if not ex_order.erpnext_sales_order:
+        if not order["erpnext_sales_order"]:
             return {
                 "success": False,
+                "sync_status": order["sync_status"],
+                "sync_error": order["sync_error"],
                 "message": "No ERPNext Sales Order linked"
             }
         
-        so_status = frappe.db.get_value("Sales Order", ex_order.erpnext_sales_order, "status")
+        return {
+            "success": True,
+            "sales_order": order["erpnext_sales_order"],
+            "status": order["status"],
+            "sync_status": order["sync_status"]
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+@frappe.whitelist()
+def get_erpnext_sales_order_statuses(order_names, since=None):
+    """
+    Get linked ERPNext Sales Order status for many Ex Commerce Sales Orders at once.
+    
+    Args:
+        order_names (list | str): Ex Commerce Sales Order names (JSON list accepted)
+        since (str): optional timestamp; only orders changed after it are returned
+    
+    Returns:
+        dict: {
+            "success": True,
+            "orders": {name: {"erpnext_sales_order", "status", "modified", ...}},
+            "server_time": "..."  # pass back as `since` on the next poll
+        }
+    """
+    try:
+        frappe.has_permission("Ex Commerce Sales Order", "read", throw=True)
+        
+        if isinstance(order_names, str):
+            order_names = frappe.parse_json(order_names)
+        
+        order_names = [name for name in (order_names or []) if name]
+        if len(order_names) > MAX_STATUS_BATCH:
+            return {
+                "success": False,
+                "error": f"At most {MAX_STATUS_BATCH} orders can be queried at once"
+            }
+        
+        server_time = now_datetime()
+        statuses = fetch_erpnext_sales_order_statuses(order_names, since=since)
         
         return {
             "success": True,
-            "sales_order": ex_order.erpnext_sales_order,
-            "status": so_status
+            "orders": statuses,
+            "server_time": str(server_time)
         }
         
     except Exception as e:
@@ -135,3 +202,45 @@ def get_erpnext_sales_order_status(ex_commerce_order_name):
         }
 
 
+def fetch_erpnext_sales_order_statuses(order_names, since=None):
+    """Resolve link, ERPNext status and sync state for orders with a single joined query"""
+    if not order_names:
+        return {}
+    
+    conditions = ["eso.name in %(names)s"]
+    params = {"names": tuple(order_names)}
+    
+    if since:
+        # Sync state is written without bumping modified; erpnext_sync_updated_at tracks it
+        conditions.append(
+            "(eso.modified > %(since)s or eso.erpnext_sync_updated_at > %(since)s or so.modified > %(since)s)"
+        )
+        params["since"] = get_datetime(since)
+    
+    rows = frappe.db.sql(f"""
+        select
+            eso.name,
+            eso.erpnext_sales_order,
+            so.status,
+            eso.erpnext_sync_status as sync_status,
+            eso.erpnext_sync_error as sync_error,
+            greatest(
+                eso.modified,
+                coalesce(eso.erpnext_sync_updated_at, eso.modified),
+                coalesce(so.modified, eso.modified)
+            ) as modified
+        from `tabEx Commerce Sales Order` eso
+        left join `tabSales Order` so on so.name = eso.erpnext_sales_order
+        where {" and ".join(conditions)}
+    """, params, as_dict=True)
+    
+    return {
+        row.name: {
+            "erpnext_sales_order": row.erpnext_sales_order,
+            "status": row.status,
+            "sync_status": row.sync_status,
+            "sync_error": row.sync_error,
+            "modified": row.modified
+        }
+        for row in rows
+    }
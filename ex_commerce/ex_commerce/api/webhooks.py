@@ -0,0 +1,60 @@
+"""
+Inbound channel webhook endpoint
+
+Providers post to
+`/api/method/ex_commerce.ex_commerce.api.webhooks.receive?webhook=<Webhook Name>`.
+The request is verified and acknowledged immediately; mapping and message
+logging run in a background job (see services/webhook_ingest.py) so slow
+processing never makes the provider time out and retry. Deliveries are rate
+limited per source IP and bodies over MAX_BODY_BYTES are refused unread.
+"""
+
+import frappe
+from frappe.rate_limiter import rate_limit
+from werkzeug.wrappers import Response
+
+from ex_commerce.ex_commerce.services.webhook_ingest import enqueue_inbound, get_compiled_mapping
+
+MAX_BODY_BYTES = 1024 * 1024
+WEBHOOK_RATE_LIMIT = 600
+
+
+@frappe.whitelist(allow_guest=True, methods=["GET", "POST"])
+@rate_limit(limit=WEBHOOK_RATE_LIMIT, seconds=60)
+def receive(webhook=None, **kwargs):
+	mapping = get_compiled_mapping(webhook) if webhook else None
+	if not mapping:
+		frappe.local.response["http_status_code"] = 404
+		return {"success": False, "error": "Unknown webhook"}
+
+	if frappe.request.method == "GET":
+		return _verify_subscription(mapping)
+
+	if (frappe.request.content_length or 0) > MAX_BODY_BYTES:
+		frappe.local.response["http_status_code"] = 413
+		return {"success": False, "error": "Payload too large"}
+
+	body = frappe.request.get_data(cache=True)
+	if len(body) > MAX_BODY_BYTES:
+		frappe.local.response["http_status_code"] = 413
+		return {"success": False, "error": "Payload too large"}
+	if not mapping.verify_signature(body, frappe.get_request_header(mapping.signature_header)):
+		frappe.local.response["http_status_code"] = 401
+		return {"success": False, "error": "Invalid signature"}
+
+	enqueue_inbound(mapping, body)
+	return {"success": True}
+
+
+def _verify_subscription(mapping):
+	"""WhatsApp Cloud API subscription handshake: echo hub.challenge as plain text"""
+	args = frappe.request.args
+	if (
+		args.get("hub.mode") == "subscribe"
+		and mapping.verify_token
+		and args.get("hub.verify_token") == mapping.verify_token
+	):
+		return Response(args.get("hub.challenge", ""), mimetype="text/plain")
+
+	frappe.local.response["http_status_code"] = 403
+	return {"success": False, "error": "Verification failed"}
@@ -1,9 +1,59 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services import context_cache
+
 
 class TestAIContextMemory(FrappeTestCase):
-	pass
+	def customer(self):
+		"""A customer name with no logged messages and no cached window"""
+		customer = f"_Test Context {frappe.generate_hash(length=8)}"
+		self.addCleanup(context_cache.invalidate, customer)
+		return customer
+
+	def record(self, customer, *contents):
+		for i, content in enumerate(contents):
+			context_cache.record_message(
+				{
+					"name": frappe.generate_hash(length=10),
+					"customer": customer,
+					"direction": "Outgoing" if i % 2 else "Incoming",
+					"content": content,
+					"created_at": "2026-01-01 10:00:00",
+				}
+			)
+
+	@patch.object(context_cache, "MAX_TURNS", 3)
+	def test_window_keeps_newest_turns_and_summarizes_the_rest(self):
+		customer = self.customer()
+		self.record(customer, "first question", "first answer", "second question", "second answer", "third")
+
+		context = context_cache.get_context(customer)
+		self.assertEqual(
+			[t["content"] for t in context["turns"]], ["second question", "second answer", "third"]
+		)
+		self.assertEqual([t["role"] for t in context["turns"]], ["user", "assistant", "user"])
+		self.assertEqual(context["summary"], "user: first question\nassistant: first answer")
+
+	def test_token_budget_keeps_newest_turns_that_fit(self):
+		customer = self.customer()
+		self.record(customer, "a" * 400, "b" * 40, "c" * 40)
+
+		context = context_cache.get_context(customer, token_budget=25)
+		self.assertEqual([t["content"][0] for t in context["turns"]], ["b", "c"])
+		self.assertEqual(context["tokens"], 20)
+
+	@patch.object(context_cache, "MAX_CACHED_CONTEXTS", 2)
+	def test_least_recently_used_windows_are_evicted(self):
+		coldest, warm, newest = self.customer(), self.customer(), self.customer()
+		for customer in (coldest, warm, newest):
+			self.record(customer, f"hello from {customer}")
+
+		self.assertFalse(context_cache._is_cached(context_cache._keys(coldest)[1]))
+		self.assertTrue(context_cache._is_cached(context_cache._keys(warm)[1]))
+		self.assertTrue(context_cache._is_cached(context_cache._keys(newest)[1]))
@@ -1,9 +1,19 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.variant_selector import record_feedback
+
 
 class AIFeedbackLog(Document):
-	pass
+	def on_submit(self):
+		if self.response_variant and self.rating:
+			record_feedback(self.response_variant, self.rating == "Positive")
+
+
+def on_doctype_update():
+	frappe.db.add_index("AI Feedback Log", ["customer", "created_at"])
+	# Retention archival scans by age
+	frappe.db.add_index("AI Feedback Log", ["created_at"])
@@ -1,9 +1,16 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class AIMessageLog(Document):
 	pass
+
+
+def on_doctype_update():
+	# Per-customer history is always read newest-first by created_at
+	frappe.db.add_index("AI Message Log", ["customer", "created_at"])
+	# Retention archival scans by age
+	frappe.db.add_index("AI Message Log", ["created_at"])
@@ -1,9 +1,243 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import gc
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from ex_commerce.ex_commerce.services import chat_guard, chat_stream, log_archive, message_log
+from ex_commerce.ex_commerce.services.ai_client import ProviderError
+from ex_commerce.ex_commerce.services.chat_stream import build_messages
+
+TEST_CUSTOMER = "_Test Message Log Customer"
+
+
+class FakeDeltas:
+	"""A provider stream that records whether it was closed"""
+
+	def __init__(self, *parts):
+		self.parts = parts
+		self.closed = False
+
+	def __iter__(self):
+		return iter(self.parts)
+
+	def close(self):
+		self.closed = True
 
 
 class TestAIMessageLog(FrappeTestCase):
-	pass
+	def test_stream_prompt_puts_new_message_after_history(self):
+		context = {
+			"summary": "user: asked about delivery",
+			"turns": [
+				{"role": "user", "content": "Hi"},
+				{"role": "assistant", "content": "Hello, how can I help?"},
+			],
+		}
+		messages = build_messages("Where is my order?", context)
+
+		self.assertEqual(messages[0]["role"], "system")
+		self.assertIn("asked about delivery", messages[1]["content"])
+		self.assertEqual([m["role"] for m in messages[2:]], ["user", "assistant", "user"])
+		self.assertEqual(messages[-1]["content"], "Where is my order?")
+
+	def delete_test_messages(self):
+		frappe.db.delete("AI Message Log", {"customer": TEST_CUSTOMER})
+		frappe.db.commit()
+
+	@patch("frappe.enqueue")
+	def test_log_message_buffers_and_flush_writes(self, enqueue):
+		self.addCleanup(self.delete_test_messages)
+		with (
+			patch.object(message_log, "flush") as inline_flush,
+			patch.object(message_log, "FLUSH_BATCH_SIZE", 2),
+		):
+			names = [
+				message_log.log_message(f"_test-msg-{i}", f"hello {i}", customer=TEST_CUSTOMER)
+				for i in range(3)
+			]
+
+		# Never flushed inline; a flush job is queued instead
+		inline_flush.assert_not_called()
+		self.assertTrue(enqueue.called)
+		self.assertEqual(
+			{call.kwargs["job_id"] for call in enqueue.call_args_list}, {message_log.FLUSH_JOB_ID}
+		)
+		self.assertFalse(frappe.db.exists("AI Message Log", {"name": ("in", names)}))
+
+		self.assertGreaterEqual(message_log.flush(), 3)
+		rows = frappe.get_all(
+			"AI Message Log", filters={"name": ("in", names)}, fields=["message_id", "content", "customer"]
+		)
+		self.assertEqual(
+			sorted(row.message_id for row in rows), ["_test-msg-0", "_test-msg-1", "_test-msg-2"]
+		)
+		self.assertEqual(message_log.flush(), 0)
+
+	def test_customer_messages_page_by_created_at_and_name(self):
+		base = now_datetime()
+		rows = [
+			message_log.build_row(f"_test-page-{i}", f"message {i}", customer=TEST_CUSTOMER) for i in range(5)
+		]
+		# Two pairs share a timestamp, so pages must break ties on name
+		for row, minutes in zip(rows, (0, -1, -1, -2, -2), strict=True):
+			row["created_at"] = str(add_to_date(base, minutes=minutes))
+		message_log._insert_rows(rows)
+
+		seen = []
+		before = before_name = None
+		while True:
+			page = message_log.get_customer_messages(
+				TEST_CUSTOMER, before=before, before_name=before_name, limit=2
+			)
+			if not page:
+				break
+			seen.extend(row.name for row in page)
+			before, before_name = page[-1].created_at, page[-1].name
+
+		expected = sorted(rows, key=lambda row: (row["created_at"], row["name"]), reverse=True)
+		self.assertEqual(seen, [row["name"] for row in expected])
+
+	def use_temp_archive_dir(self):
+		archive_dir = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+		patcher = patch.object(log_archive, "get_archive_dir", return_value=archive_dir)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		return archive_dir
+
+	def insert_messages(self, created_ats):
+		rows = [
+			message_log.build_row(f"_test-archive-{i}", f"message {i}", customer=TEST_CUSTOMER)
+			for i in range(len(created_ats))
+		]
+		for row, created_at in zip(rows, created_ats, strict=True):
+			row["created_at"] = created_at
+		message_log._insert_rows(rows)
+		return [row["name"] for row in rows]
+
+	def test_archive_writes_months_then_deletes_rows(self):
+		archive_dir = self.use_temp_archive_dir()
+		self.addCleanup(self.delete_test_messages)
+		old = self.insert_messages(["2001-01-05 10:00:00", "2001-01-20 10:00:00", "2001-02-03 10:00:00"])
+		recent = self.insert_messages([str(now_datetime())])
+
+		archived = log_archive.archive_doctype(
+			"AI Message Log", cutoff=get_datetime("2001-06-01"), batch_size=2
+		)
+
+		self.assertEqual(archived, 3)
+		self.assertEqual(sorted(os.listdir(archive_dir)), ["2001-01.jsonl.gz", "2001-02.jsonl.gz"])
+		self.assertFalse(frappe.db.exists("AI Message Log", {"name": ("in", old)}))
+		self.assertTrue(frappe.db.exists("AI Message Log", recent[0]))
+		archived_names = [row.name for row in log_archive.read_archive("AI Message Log", "2001-01")]
+		self.assertEqual(archived_names, old[:2])
+
+	def test_query_logs_merges_live_and_archived_rows(self):
+		self.use_temp_archive_dir()
+		self.addCleanup(self.delete_test_messages)
+		live = self.insert_messages([str(now_datetime())])
+		old = self.insert_messages(["2001-01-05 10:00:00", "2001-02-03 10:00:00"])
+		log_archive.archive_doctype("AI Message Log", cutoff=get_datetime("2001-06-01"))
+
+		# A crash between archive write and delete leaves a row in both places
+		leftover = frappe.get_all("AI Message Log", filters={"name": live[0]}, fields=["*"])
+		log_archive._write_month("AI Message Log", "2001-02", leftover)
+
+		rows = log_archive.query_logs("AI Message Log", customer=TEST_CUSTOMER, from_date="2000-12-01")
+		self.assertEqual([row.name for row in rows], [live[0], old[1], old[0]])
+
+		# The range only opens archives for the months it overlaps
+		rows = log_archive.query_logs(
+			"AI Message Log", customer=TEST_CUSTOMER, from_date="2001-01-01", to_date="2001-01-31"
+		)
+		self.assertEqual([row.name for row in rows], [old[0]])
+
+	@patch.object(chat_stream, "log_message", return_value="LOG-1")
+	@patch.object(chat_stream, "get_client")
+	def test_stream_start_failure_releases_message_id(self, get_client, log_message):
+		self.run_reply_logging_inline()
+		channel = f"_Test Channel {frappe.generate_hash(length=8)}"
+		self.addCleanup(chat_guard.forget, channel, ["web-1"])
+
+		get_client.return_value.stream_complete.side_effect = ProviderError("down")
+		with self.assertRaises(frappe.ValidationError):
+			chat_stream.start_reply("Hi", channel=channel, message_id="web-1")
+		log_message.assert_not_called()
+
+		# Not logged, so the retry is accepted, and only then is it a duplicate
+		get_client.return_value.stream_complete.side_effect = None
+		get_client.return_value.stream_complete.return_value = MagicMock()
+		chat_stream.start_reply("Hi", channel=channel, message_id="web-1")
+		log_message.assert_called_once()
+		with self.assertRaises(frappe.ValidationError):
+			chat_stream.start_reply("Hi", channel=channel, message_id="web-1")
+
+	def run_reply_logging_inline(self):
+		"""Run the reply-logging thread in the test, without re-initialising the site"""
+
+		def thread(target, args, daemon):
+			target(*args)
+			return MagicMock()
+
+		patchers = [patch.object(frappe, name) for name in ("init", "connect", "set_user", "destroy")]
+		patchers.append(patch.object(frappe.db, "commit"))
+		patchers.append(patch.object(chat_stream.threading, "Thread", side_effect=thread))
+		for patcher in patchers:
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		return chat_stream.threading.Thread
+
+	@patch.object(chat_stream, "record_ttft")
+	@patch.object(chat_stream, "log_message")
+	def test_stream_events_then_logs_reply(self, log_message, record_ttft):
+		self.run_reply_logging_inline()
+		deltas = FakeDeltas("Hel", "lo")
+		reply = frappe._dict(
+			site=frappe.local.site,
+			sites_path=frappe.local.sites_path,
+			user="Guest",
+			customer=None,
+			channel="Web",
+			response_to="LOG-1",
+		)
+
+		events = list(chat_stream._events(deltas, reply, time.monotonic(), MagicMock()))
+		self.assertEqual([event for event, _ in events], ["message", "token", "token", "done"])
+		self.assertEqual(events[0][1], {"message_log": "LOG-1"})
+		self.assertEqual([data["text"] for event, data in events if event == "token"], ["Hel", "lo"])
+		ttft_ms = events[-1][1]["ttft_ms"]
+		self.assertIsNotNone(ttft_ms)
+		self.assertTrue(deltas.closed)
+
+		log_message.assert_called_once()
+		self.assertEqual(log_message.call_args.args[1], "Hello")
+		self.assertEqual(log_message.call_args.kwargs["direction"], "Outgoing")
+		self.assertEqual(log_message.call_args.kwargs["response_to"], "LOG-1")
+		record_ttft.assert_called_once_with(ttft_ms)
+
+	@patch.object(chat_stream, "log_message", return_value="LOG-2")
+	@patch.object(chat_stream, "get_client")
+	def test_stream_dropped_before_reading_is_closed(self, get_client, log_message):
+		thread = self.run_reply_logging_inline()
+		channel = f"_Test Channel {frappe.generate_hash(length=8)}"
+		self.addCleanup(chat_guard.forget, channel, ["web-2"])
+		deltas = get_client.return_value.stream_complete.return_value = FakeDeltas("never sent")
+
+		# The client went away before the first event was read
+		events = chat_stream.start_reply("Hi", channel=channel, message_id="web-2")
+		del events
+		gc.collect()
+
+		self.assertTrue(deltas.closed)
+		thread.assert_called_once()
+		# Only the incoming message: there is no reply text to log
+		log_message.assert_called_once()
@@ -1,9 +1,30 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
+from frappe import _
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.model_registry import invalidate, invalidate_local
+
 
 class AIModelRegistry(Document):
-	pass
+	def validate(self):
+		defaults = {}
+		for row in [self, *self.models]:
+			if row.model_name and row.active and row.default_model:
+				capability = row.capability or "Chat"
+				if capability in defaults:
+					frappe.throw(
+						_("{0} and {1} are both marked as the default {2} model").format(
+							defaults[capability], row.model_name, capability
+						)
+					)
+				defaults[capability] = row.model_name
+
+	def on_update(self):
+		# This request sees its own changes now; other workers only after commit,
+		# so they cannot re-resolve and cache the old rows
+		invalidate_local()
+		frappe.db.after_commit.add(invalidate)
+		frappe.db.after_rollback.add(invalidate_local)
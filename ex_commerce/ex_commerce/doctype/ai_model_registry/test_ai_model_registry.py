@@ -1,9 +1,60 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import os
+import tempfile
+
+import frappe
+import numpy as np
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services.model_registry import get_local_model, get_model, get_models
+
 
 class TestAIModelRegistry(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.weights_path = os.path.join(tempfile.mkdtemp(), "tiny.npy")
+		np.save(self.weights_path, np.arange(12, dtype=np.float32).reshape(3, 4))
+
+		self.registry = frappe.get_single("AI Model Registry")
+		self.registry.update(
+			{
+				"model_name": "tiny-local",
+				"model_type": "Lightweight LLM",
+				"capability": "Chat",
+				"model_path": self.weights_path,
+				"default_model": 0,
+				"active": 1,
+			}
+		)
+		self.registry.set(
+			"models",
+			[
+				{"model_name": "backup-chat", "capability": "Chat", "active": 1, "priority": 5},
+				{"model_name": "main-chat", "capability": "Chat", "default_model": 1, "active": 1},
+				{"model_name": "retired-chat", "capability": "Chat", "active": 0},
+			],
+		)
+		self.registry.save()
+
+	def test_default_first_then_priority(self):
+		self.assertEqual(
+			[m.model_name for m in get_models("Chat")], ["main-chat", "tiny-local", "backup-chat"]
+		)
+		self.assertEqual(get_model("Chat", model_type="Lightweight LLM").model_name, "tiny-local")
+
+	def test_save_invalidates_resolution(self):
+		self.assertEqual(get_model("Chat").model_name, "main-chat")
+		self.registry.models[1].active = 0
+		self.registry.save()
+		self.assertEqual(get_model("Chat").model_name, "tiny-local")
+
+	def test_two_defaults_rejected(self):
+		self.registry.default_model = 1
+		self.assertRaises(frappe.ValidationError, self.registry.save)
+
+	def test_local_weights_are_memory_mapped_and_shared(self):
+		loaded = get_local_model("tiny-local")
+		self.assertIsInstance(loaded.weights, np.memmap)
+		self.assertEqual(loaded.weights.shape, (3, 4))
+		self.assertIs(get_local_model("tiny-local"), loaded)
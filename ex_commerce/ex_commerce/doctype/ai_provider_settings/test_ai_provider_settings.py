@@ -1,9 +1,78 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services.ai_client import AIClient, ProviderError
+from ex_commerce.ex_commerce.services.mock_provider import EMBEDDING_DIMENSIONS, start_mock_provider
+
 
 class TestAIProviderSettings(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.server, cls.base_url = start_mock_provider()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.server.shutdown()
+		cls.server.server_close()
+		super().tearDownClass()
+
+	def setUp(self):
+		registry = frappe.get_single("AI Model Registry")
+		registry.update(
+			{
+				"model_name": "fail-primary-chat",
+				"model_type": "3rd Party API",
+				"capability": "Chat",
+				"default_model": 1,
+				"active": 1,
+			}
+		)
+		registry.set(
+			"models",
+			[
+				{"model_name": "mock-chat", "capability": "Chat", "active": 1, "priority": 1},
+				{
+					"model_name": "mock-embed",
+					"capability": "Embedding",
+					"default_model": 1,
+					"active": 1,
+					"batch_size": 2,
+				},
+			],
+		)
+		registry.save()
+		frappe.cache().delete_keys("ex_commerce:ai_cache:")
+		self.server.requests.clear()
+		self.client = AIClient(self.base_url)
+
+	def test_completion_falls_back_and_caches(self):
+		messages = [{"role": "user", "content": "Is the blender in stock?"}]
+		first = self.client.complete(messages)
+		self.assertEqual(first["model"], "mock-chat")
+		self.assertEqual(first["content"], "Echo: Is the blender in stock?")
+		self.assertFalse(first["cached"])
+
+		second = self.client.complete(messages)
+		self.assertTrue(second["cached"])
+		# primary (503) + fallback; the cached call sends nothing
+		self.assertEqual(len(self.server.requests), 2)
+
+	def test_embeddings_are_batched_and_cached(self):
+		vectors, model = self.client.embed(["one", "two", "three"])
+		self.assertEqual(model, "mock-embed")
+		self.assertEqual(vectors.shape, (3, EMBEDDING_DIMENSIONS))
+		self.assertEqual(len(self.server.requests), 2)
+
+		again, _ = self.client.embed(["three", "four"])
+		self.assertEqual(again[0].tolist(), vectors[2].tolist())
+		self.assertEqual(self.server.requests[-1][1]["input"], ["four"])
+
+	def test_unknown_provider_fails(self):
+		with self.assertRaises(ProviderError):
+			AIClient("http://127.0.0.1:9", timeout=1).complete(
+				[{"role": "user", "content": "hi"}], use_cache=False
+			)
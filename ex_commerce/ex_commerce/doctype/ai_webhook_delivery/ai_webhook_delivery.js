@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Nana Kwame Amagyei and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("AI Webhook Delivery", {
+// 	refresh(frm) {
+
+// 	},
+// });
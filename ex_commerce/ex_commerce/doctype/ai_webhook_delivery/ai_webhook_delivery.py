@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Nana Kwame Amagyei and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class AIWebhookDelivery(Document):
+	pass
+
+
+def on_doctype_update():
+	# Retry sweep
+	frappe.db.add_index("AI Webhook Delivery", ["status", "next_attempt_at"])
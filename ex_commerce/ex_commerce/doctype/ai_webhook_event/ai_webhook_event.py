@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.webhook_dispatcher import clear_subscribers_cache
+
 
 class AIWebhookEvent(Document):
-	pass
+	def on_submit(self):
+		clear_subscribers_cache(self.event_name)
+
+	def on_cancel(self):
+		clear_subscribers_cache(self.event_name)
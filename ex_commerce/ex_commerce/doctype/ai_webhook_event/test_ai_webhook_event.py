@@ -1,9 +1,73 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services import webhook_dispatcher
+from ex_commerce.ex_commerce.services.webhook_dispatcher import Delivery, run_deliveries
+
+
+class StubHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_POST(self):
+		server = self.server
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		with server.lock:
+			server.received.append((self.path, self.headers.get("X-Token"), body))
+			status = server.statuses.pop(0) if server.statuses else 200
+		self.send_response(status)
+		self.send_header("Content-Length", "2")
+		self.end_headers()
+		self.wfile.write(b"ok")
+
+	def log_message(self, *args):
+		pass
+
 
 class TestAIWebhookEvent(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+		self.server.lock = threading.Lock()
+		self.server.received = []
+		self.server.statuses = []
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def delivery(self, path, body):
+		return Delivery(
+			url=f"{self.url}{path}",
+			method="POST",
+			headers={"X-Token": "secret", "Content-Type": "application/json"},
+			body=json.dumps(body),
+			timeout=5,
+		)
+
+	def test_fan_out(self):
+		deliveries = run_deliveries([self.delivery(f"/hook/{i}", {"i": i}) for i in range(40)], concurrency=8)
+		self.assertTrue(all(d.ok and d.attempts == 1 for d in deliveries))
+		self.assertEqual(len(self.server.received), 40)
+		self.assertEqual({token for _, token, _ in self.server.received}, {"secret"})
+
+	@patch.object(webhook_dispatcher, "INLINE_BACKOFF_SECONDS", 0.01)
+	def test_retries_transient_errors(self):
+		self.server.statuses = [503, 502]
+		(delivery,) = run_deliveries([self.delivery("/hook", {"order": "ECSO-1"})])
+		self.assertTrue(delivery.ok)
+		self.assertEqual(delivery.attempts, 3)
+
+	def test_client_error_is_not_retried(self):
+		self.server.statuses = [400]
+		(delivery,) = run_deliveries([self.delivery("/hook", {})])
+		self.assertFalse(delivery.ok)
+		self.assertFalse(delivery.retryable)
+		self.assertEqual(delivery.attempts, 1)
@@ -1,9 +1,11 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.chat_templates import clear_compiled
+
 
 class ChatTemplate(Document):
-	pass
+	def on_update(self):
+		clear_compiled()
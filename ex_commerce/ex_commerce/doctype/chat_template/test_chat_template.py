@@ -1,9 +1,40 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services.chat_templates import html_to_template_source, render_batch
+
 
 class TestChatTemplate(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.template = frappe.get_single("Chat Template")
+		self.template.update(
+			{
+				"template_name": "Order Update",
+				"template_category": "Order",
+				"template_content": "<p>Hi {{ customer_name }},</p><p>Order {{ order_id }} is &quot;{{ status }}&quot;.</p>",
+				"active": 1,
+			}
+		)
+		self.template.save()
+
+	def test_rich_text_is_flattened(self):
+		self.assertEqual(
+			html_to_template_source(self.template.template_content),
+			'Hi {{ customer_name }},\nOrder {{ order_id }} is "{{ status }}".',
+		)
+
+	def test_render_batch(self):
+		messages = render_batch(
+			[{"customer_name": "Ama", "order_id": "ECSO-1", "status": "Shipped"}] * 3, "Order Update"
+		)
+		self.assertEqual(len(messages), 3)
+		self.assertEqual(messages[0], 'Hi Ama,\nOrder ECSO-1 is "Shipped".')
+
+	def test_save_recompiles(self):
+		render_batch([{}], "Order Update")
+		self.template.template_content = "<p>Bye {{ customer_name }}</p>"
+		self.template.save()
+		self.assertEqual(render_batch([{"customer_name": "Kofi"}], "Order Update"), ["Bye Kofi"])
@@ -1,9 +1,24 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class EmbeddingIndex(Document):
-	pass
+	def get_vector(self):
+		"""Return this row's (normalized) vector from the binary vector store"""
+		from ex_commerce.ex_commerce.services.vector_store import get_store
+
+		if self.vector_offset is None or not self.model_name:
+			return None
+		return get_store(self.model_name).get([self.vector_offset])[0]
+
+	def on_trash(self):
+		"""Tombstone the stored vector once the delete commits, so searches stop returning it"""
+		from ex_commerce.ex_commerce.services.vector_store import get_store
+
+		if self.vector_offset is not None and self.model_name:
+			store, offsets = get_store(self.model_name), [self.vector_offset]
+			# A rolled-back delete keeps the row, so its vector must stay searchable
+			frappe.db.after_commit.add(lambda: store.delete(offsets))
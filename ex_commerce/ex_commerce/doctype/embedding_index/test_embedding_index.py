@@ -1,9 +1,166 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+import frappe
+import numpy as np
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services import ann_index, hybrid_search, vector_store
+
 
 class TestEmbeddingIndex(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.store_dir = tempfile.mkdtemp()
+		patcher = patch.object(vector_store, "get_store_dir", return_value=self.store_dir)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(shutil.rmtree, self.store_dir, ignore_errors=True)
+
+	def test_append_and_search(self):
+		rng = np.random.default_rng(7)
+		vectors = rng.normal(size=(50, 16)).astype(np.float32)
+		store = vector_store.VectorStore("test-model")
+
+		offsets = store.append(vectors)
+		self.assertEqual(offsets, list(range(50)))
+		self.assertEqual(len(store), 50)
+
+		top, scores = store.search(vectors[17], k=3)
+		self.assertEqual(int(top[0]), 17)
+		self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+
+		# Appends land after existing rows
+		self.assertEqual(store.append(vectors[:2]), [50, 51])
+
+	def test_deleted_rows_are_skipped(self):
+		vectors = np.eye(4, dtype=np.float32)
+		store = vector_store.VectorStore("test-model", dtype="float16")
+		store.append(vectors)
+		store.delete([2])
+
+		top, _ = store.search(vectors[2], k=4)
+		self.assertNotIn(2, top.tolist())
+		self.assertEqual(len(top), 3)
+
+	def test_quantized_search_reranks_at_full_precision(self):
+		rng = np.random.default_rng(3)
+		vectors = rng.normal(size=(500, 64)).astype(np.float32)
+		store = vector_store.VectorStore("test-model")
+		store.append(vectors)
+
+		codes, scales = store.quantized()
+		self.assertEqual(codes.dtype, np.int8)
+		self.assertEqual(codes.shape, (500, 64))
+		self.assertGreaterEqual(store.memory_usage()["reduction"], 3.5)
+
+		query = vectors[42] + rng.normal(scale=0.1, size=64).astype(np.float32)
+		exact, exact_scores = store.exact_search(query, k=5)
+		top, scores = store.search(query, k=5)
+		self.assertEqual(top.tolist(), exact.tolist())
+		np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+	def test_compact_drops_tombstoned_rows(self):
+		vectors = np.eye(6, dtype=np.float32)
+		store = vector_store.VectorStore("test-model")
+		store.append(vectors)
+		store.delete([1, 4])
+
+		with store.lock():
+			self.assertEqual(store.compact([0, 2, 3, 5]), 4)
+
+		self.assertEqual(len(store), 4)
+		self.assertFalse(np.asarray(store.deleted_mask()).any())
+		top, _ = store.search(vectors[5], k=1)
+		self.assertEqual(int(top[0]), 3)
+
+	def test_rolled_back_embeddings_are_tombstoned(self):
+		vectors = np.eye(3, dtype=np.float32)
+		vector_store.add_embeddings("test-rollback", vectors, source_documents=["KB-1"] * 3)
+		frappe.db.rollback()
+
+		store = vector_store.VectorStore("test-rollback")
+		self.assertEqual(len(store), 3)
+		self.assertTrue(np.asarray(store.deleted_mask()).all())
+
+	def test_deleted_rows_tombstone_their_vector_on_commit(self):
+		names = vector_store.add_embeddings("test-trash", np.eye(2, dtype=np.float32))
+		frappe.delete_doc("Embedding Index", names[0], ignore_permissions=True)
+
+		store = vector_store.VectorStore("test-trash")
+		self.assertFalse(np.asarray(store.deleted_mask()).any())
+		frappe.db.after_commit.run()
+		self.assertEqual(np.asarray(store.deleted_mask()).tolist(), [1, 0])
+
+	def test_store_lock_is_reentrant(self):
+		store = vector_store.VectorStore("test-model")
+		store.append(np.eye(3, dtype=np.float32))
+		with store.lock(timeout=1):
+			store.delete([1])
+		self.assertEqual(np.asarray(store.deleted_mask()).tolist(), [0, 1, 0])
+
+	def test_compaction_drops_untracked_vectors_after_grace(self):
+		store = vector_store.VectorStore("test-untracked")
+		store.append(np.eye(4, dtype=np.float32))
+
+		# First sighting: may be an uncommitted insert, so it is only recorded
+		result = ann_index.compact_store("test-untracked")
+		self.assertEqual((result["untracked_dropped"], result["rows_after"]), (0, 4))
+		self.assertEqual(set(store.read_untracked()), {0, 1, 2, 3})
+
+		expired = time.time() - ann_index.UNTRACKED_GRACE_HOURS * 3600 - 1
+		store.write_untracked({offset: expired for offset in (1, 3)} | {0: expired + 3600, 2: expired + 3600})
+		result = ann_index.compact_store("test-untracked")
+
+		# Expired rows are tombstoned, but 0 and 2 may still be pending inserts,
+		# so nothing is renumbered yet
+		self.assertEqual((result["untracked_dropped"], result["rows_after"]), (2, 4))
+		self.assertEqual(np.asarray(store.deleted_mask()).tolist(), [0, 1, 0, 1])
+		self.assertEqual(set(store.read_untracked()), {0, 2})
+
+		store.write_untracked({0: expired, 2: expired})
+		result = ann_index.compact_store("test-untracked")
+		self.assertEqual((result["untracked_dropped"], result["rows_after"]), (2, 0))
+		self.assertEqual(store.read_untracked(), {})
+
+	def test_lexical_index_ranks_exact_sku_first(self):
+		def item(code, name, description="", variant_of=None):
+			return frappe._dict(
+				item_code=code,
+				variant_of=variant_of,
+				item_name=name,
+				brand="Sun",
+				item_group="Energy",
+				description=description,
+			)
+
+		rows = [
+			item("SKU-100", "Solar Panel 100W", "<p>Monocrystalline panel</p>"),
+			item("SKU-100-B", "Solar Panel 100W Black", variant_of="SKU-100"),
+			item("INV-2", "Inverter 2kW", "Pure sine wave inverter for solar panels"),
+		]
+		index = hybrid_search.LexicalIndex(rows)
+
+		# Variants rank as their template
+		self.assertEqual(index.search("sku-100-b")[0][0], "SKU-100")
+		self.assertEqual(index.search("sine wave inverter")[0][0], "INV-2")
+		self.assertEqual(index.search("unrelated"), [])
+
+	def test_reciprocal_rank_fusion_rewards_agreement(self):
+		fused = hybrid_search.reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]])
+		self.assertEqual([key for key, _ in fused], ["a", "c", "b"])
+
+	@patch.object(hybrid_search, "vector_search", return_value=[])
+	def test_storefront_search_is_not_capped_at_candidates(self, vector_search):
+		rows = [
+			frappe._dict(item_code=f"_TEST-ZQX-{i}", variant_of=None, item_name=f"Zqxshirt {i}")
+			for i in range(hybrid_search.CANDIDATES * 2)
+		]
+		with patch.object(hybrid_search, "get_lexical_index", return_value=hybrid_search.LexicalIndex(rows)):
+			codes = hybrid_search.search_item_codes(f"zqxshirt {frappe.generate_hash(length=6)}")
+
+		self.assertEqual(set(codes), {row.item_code for row in rows})
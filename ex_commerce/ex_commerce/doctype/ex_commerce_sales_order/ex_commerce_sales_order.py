@@ -4,12 +4,23 @@
 import frappe
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.sales_order_mapping import (
+	create_erpnext_sales_order,
+	get_customer_address,
+)
+
 
 class ExCommerceSalesOrder(Document):
 	def validate(self):
 		"""Validate and perform customer lookup"""
 		self.check_existing_customer()
 	
+	def on_submit(self):
+		"""Hand ERPNext Sales Order creation to the background sync worker"""
+		if self.customer and not self.erpnext_sales_order:
+			from ex_commerce.ex_commerce.services.sales_order_sync import enqueue_sync
+			enqueue_sync(self.name)
+	
 	def check_existing_customer(self):
 		"""Check if customer exists by phone number and log result"""
 		if not self.guest_phone:
@@ -218,52 +229,7 @@ class ExCommerceSalesOrder(Document):
 				return {"success": True, "sales_order": self.erpnext_sales_order}
 			
 			# Create ERPNext Sales Order
-			so = frappe.new_doc("Sales Order")
-			so.customer = self.customer
-			so.customer_name = self.customer_name
-			so.transaction_date = self.transaction_date
-			so.delivery_date = self.delivery_date
-			so.company = self.company
-			so.currency = self.currency
-			so.selling_price_list = self.selling_price_list
-			so.order_type = self.order_type
-			so.po_no = self.po_no
-			so.po_date = self.po_date
-			
-			# Set addresses
-			if self.guest_billing_address:
-				so.customer_address = self.get_customer_address("Billing")
-			if self.guest_shipping_address:
-				so.shipping_address_name = self.get_customer_address("Shipping")
-			
-			# Copy items
-			for item in self.items:
-				so.append("items", {
-					"item_code": item.item_code,
-					"item_name": item.item_name,
-					"qty": item.qty,
-					"rate": item.rate,
-					"amount": item.amount,
-					"warehouse": item.warehouse or self.set_warehouse
-				})
-			
-			# Copy taxes
-			if self.taxes:
-				for tax in self.taxes:
-					so.append("taxes", {
-						"charge_type": tax.charge_type,
-						"account_head": tax.account_head,
-						"description": tax.description,
-						"rate": tax.rate,
-						"tax_amount": tax.tax_amount
-					})
-			
-			so.insert()
-			so.submit()
-			
-			# Link back to Ex Commerce Sales Order
-			self.erpnext_sales_order = so.name
-			self.save()
+			so = create_erpnext_sales_order(self)
 			
 			frappe.msgprint(f"ERPNext Sales Order '{so.name}' created and submitted successfully")
 			return {"success": True, "sales_order": so.name}
@@ -272,6 +238,18 @@ class ExCommerceSalesOrder(Document):
 			frappe.msgprint(f"Error creating ERPNext Sales Order: {str(e)}", alert=True)
 			return {"success": False, "error": str(e)}
 	
+	@frappe.whitelist()
+	def queue_erpnext_sales_order_sync(self):
+		"""JavaScript Action: Queue ERPNext Sales Order creation in the background"""
+		from ex_commerce.ex_commerce.api.sales_order import queue_erpnext_sales_order_sync
+		
+		result = queue_erpnext_sales_order_sync(self.name)
+		if result.get("success"):
+			frappe.msgprint(result.get("message"))
+		else:
+			frappe.msgprint(f"Error queueing ERPNext Sales Order: {result.get('error')}", alert=True)
+		return result
+	
 	def get_default_customer_group(self):
 		"""Get default customer group"""
 		try:
@@ -342,17 +320,7 @@ class ExCommerceSalesOrder(Document):
 	
 	def get_customer_address(self, address_type):
 		"""Get customer address by type"""
-		addresses = frappe.get_all(
-			"Address",
-			filters={
-				"link_doctype": "Customer",
-				"link_name": self.customer,
-				"address_type": address_type
-			},
-			fields=["name"],
-			limit=1
-		)
-		return addresses[0].name if addresses else None
+		return get_customer_address(self.customer, address_type)
 	
 	def create_customer_contact(self, customer_name):
 		"""Create contact for customer to ensure data consistency"""
@@ -1,9 +1,380 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import random
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from ex_commerce.ex_commerce.api import customer_creation, orders
+from ex_commerce.ex_commerce.api.customer_creation import find_customer_by_phone, normalize_phone
+from ex_commerce.ex_commerce.api.sales_order import (
+	MAX_STATUS_BATCH,
+	fetch_erpnext_sales_order_statuses,
+	get_erpnext_sales_order_statuses,
+)
+from ex_commerce.ex_commerce.services import order_events, sales_order_sync
+from ex_commerce.ex_commerce.services.sales_order_mapping import HEADER_FIELDS, build_erpnext_sales_order
+
+DOCTYPE = "Ex Commerce Sales Order"
 
 
 class TestExcommerceSalesOrder(FrappeTestCase):
-	pass
+	def make_order(self, name, **values):
+		"""Submitted order row written directly; sync_order commits, so it is removed explicitly"""
+		order = frappe.new_doc(DOCTYPE)
+		order.update(
+			{
+				"name": name,
+				"docstatus": 1,
+				"customer": "_Test Customer",
+				"transaction_date": frappe.utils.today(),
+				"erpnext_sync_status": "Queued",
+				"erpnext_sync_attempts": 0,
+				**values,
+			}
+		)
+		order.db_insert()
+		self.addCleanup(self.delete_order, name)
+		return name
+
+	def delete_order(self, name):
+		frappe.db.delete(DOCTYPE, {"name": name})
+		frappe.db.commit()
+
+	def sync_state(self, name):
+		return frappe.db.get_value(
+			DOCTYPE,
+			name,
+			["erpnext_sync_status", "erpnext_sync_attempts", "erpnext_sync_next_retry", "erpnext_sync_error"],
+			as_dict=True,
+		)
+
+	@patch.object(sales_order_sync, "create_erpnext_sales_order", side_effect=Exception("Item missing"))
+	def test_failed_sync_backs_off_exponentially_then_gives_up(self, create):
+		name = self.make_order("_Test ECSO Sync Backoff")
+
+		for attempt in range(1, sales_order_sync.MAX_SYNC_ATTEMPTS + 1):
+			before = now_datetime()
+			sales_order_sync.sync_order(name)
+			state = self.sync_state(name)
+
+			self.assertEqual(state.erpnext_sync_status, "Failed")
+			self.assertEqual(state.erpnext_sync_attempts, attempt)
+			self.assertIn("Item missing", state.erpnext_sync_error)
+			if attempt < sales_order_sync.MAX_SYNC_ATTEMPTS:
+				delay = (state.erpnext_sync_next_retry - before).total_seconds()
+				expected = sales_order_sync.BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)
+				self.assertAlmostEqual(delay, expected, delta=5)
+			else:
+				self.assertIsNone(state.erpnext_sync_next_retry)
+
+		self.assertEqual(create.call_count, sales_order_sync.MAX_SYNC_ATTEMPTS)
+
+	@patch.object(sales_order_sync, "create_erpnext_sales_order")
+	def test_successful_sync_clears_retry_state(self, create):
+		name = self.make_order("_Test ECSO Sync Ok", erpnext_sync_error="old error")
+		sales_order_sync.sync_order(name)
+
+		state = self.sync_state(name)
+		self.assertEqual(state.erpnext_sync_status, "Synced")
+		self.assertEqual(state.erpnext_sync_attempts, 1)
+		self.assertIsNone(state.erpnext_sync_next_retry)
+		self.assertIsNone(state.erpnext_sync_error)
+		create.assert_called_once()
+
+	@patch.object(sales_order_sync, "create_erpnext_sales_order")
+	def test_live_syncing_lease_is_not_taken_over(self, create):
+		lease = add_to_date(now_datetime(), minutes=10)
+		name = self.make_order(
+			"_Test ECSO Sync Lease",
+			erpnext_sync_status="Syncing",
+			erpnext_sync_attempts=1,
+			erpnext_sync_next_retry=lease,
+		)
+		sales_order_sync.sync_order(name)
+
+		create.assert_not_called()
+		self.assertEqual(self.sync_state(name).erpnext_sync_attempts, 1)
+
+	@patch("frappe.enqueue")
+	def test_sync_all_pending_picks_only_due_orders(self, enqueue):
+		past = add_to_date(now_datetime(), minutes=-1)
+		future = add_to_date(now_datetime(), minutes=10)
+		due = {
+			self.make_order("_Test ECSO Pending Queued"),
+			self.make_order(
+				"_Test ECSO Pending Retry",
+				erpnext_sync_status="Failed",
+				erpnext_sync_attempts=1,
+				erpnext_sync_next_retry=past,
+			),
+			self.make_order(
+				"_Test ECSO Pending Stale",
+				erpnext_sync_status="Syncing",
+				erpnext_sync_attempts=1,
+				erpnext_sync_next_retry=past,
+			),
+		}
+		not_due = {
+			self.make_order(
+				"_Test ECSO Pending Later",
+				erpnext_sync_status="Failed",
+				erpnext_sync_attempts=1,
+				erpnext_sync_next_retry=future,
+			),
+			self.make_order(
+				"_Test ECSO Pending Exhausted",
+				erpnext_sync_status="Failed",
+				erpnext_sync_attempts=sales_order_sync.MAX_SYNC_ATTEMPTS,
+			),
+			self.make_order(
+				"_Test ECSO Pending Leased",
+				erpnext_sync_status="Syncing",
+				erpnext_sync_attempts=1,
+				erpnext_sync_next_retry=future,
+			),
+			self.make_order("_Test ECSO Pending Synced", erpnext_sync_status="Synced"),
+			self.make_order("_Test ECSO Pending Draft", docstatus=0),
+		}
+
+		pending = set(sales_order_sync.sync_all_pending())
+
+		self.assertTrue(due <= pending)
+		self.assertFalse(not_due & pending)
+		enqueued = {call.kwargs["order_name"] for call in enqueue.call_args_list}
+		self.assertTrue(due <= enqueued)
+
+	def test_build_erpnext_sales_order_copies_header_items_and_taxes(self):
+		order = frappe.new_doc(DOCTYPE)
+		order.update(
+			{
+				"customer": "_Test Customer",
+				"customer_name": "Test Customer",
+				"transaction_date": "2026-01-05",
+				"delivery_date": "2026-01-10",
+				"company": "_Test Company",
+				"currency": "INR",
+				"selling_price_list": "Standard Selling",
+				"order_type": "Shopping Cart",
+				"po_no": "PO-1",
+				"set_warehouse": "Stores - _TC",
+			}
+		)
+		order.append(
+			"items", {"item_code": "_Test Item", "item_name": "Item", "qty": 2, "rate": 50, "amount": 100}
+		)
+		order.append(
+			"items",
+			{
+				"item_code": "_Test Item 2",
+				"qty": 1,
+				"rate": 20,
+				"amount": 20,
+				"warehouse": "Finished Goods - _TC",
+			},
+		)
+		order.append(
+			"taxes",
+			{"charge_type": "On Net Total", "account_head": "VAT - _TC", "description": "VAT", "rate": 10},
+		)
+
+		so = build_erpnext_sales_order(order)
+
+		self.assertTrue(so.is_new())
+		for fieldname in HEADER_FIELDS:
+			self.assertEqual(so.get(fieldname), order.get(fieldname), fieldname)
+		self.assertEqual(
+			[(row.item_code, row.qty, row.rate, row.warehouse) for row in so.items],
+			[("_Test Item", 2, 50, "Stores - _TC"), ("_Test Item 2", 1, 20, "Finished Goods - _TC")],
+		)
+		self.assertEqual([(tax.account_head, tax.rate) for tax in so.taxes], [("VAT - _TC", 10)])
+		# No guest addresses: no address lookup, none set
+		self.assertFalse(so.customer_address)
+		self.assertFalse(so.shipping_address_name)
+
+	def test_sync_state_changes_keep_modified(self):
+		name = self.make_order("_Test ECSO Sync Modified")
+		modified = frappe.db.get_value(DOCTYPE, name, "modified")
+
+		with patch("frappe.enqueue"):
+			sales_order_sync.enqueue_sync(name, reset_attempts=True)
+
+		self.assertEqual(frappe.db.get_value(DOCTYPE, name, "modified"), modified)
+		self.assertIsNotNone(frappe.db.get_value(DOCTYPE, name, "erpnext_sync_updated_at"))
+
+	def test_statuses_since_follow_sync_updates(self):
+		old = add_to_date(now_datetime(), hours=-2)
+		since = add_to_date(now_datetime(), hours=-1)
+		changed = self.make_order(
+			"_Test ECSO Status Changed",
+			creation=old,
+			modified=old,
+			erpnext_sync_status="Failed",
+			erpnext_sync_error="Item missing",
+			erpnext_sync_updated_at=now_datetime(),
+		)
+		unchanged = self.make_order(
+			"_Test ECSO Status Unchanged", creation=old, modified=old, erpnext_sync_updated_at=old
+		)
+
+		everything = fetch_erpnext_sales_order_statuses([changed, unchanged, "_Test ECSO Missing"])
+		self.assertEqual(set(everything), {changed, unchanged})
+		self.assertEqual(everything[changed]["sync_status"], "Failed")
+		self.assertEqual(everything[changed]["sync_error"], "Item missing")
+		self.assertIsNone(everything[changed]["erpnext_sales_order"])
+
+		recent = get_erpnext_sales_order_statuses(frappe.as_json([changed, unchanged]), since=str(since))
+		self.assertTrue(recent["success"])
+		self.assertEqual(list(recent["orders"]), [changed])
+		self.assertGreater(recent["orders"][changed]["modified"], since)
+
+	def test_statuses_reject_oversized_batches(self):
+		names = [f"ECSO-{i}" for i in range(MAX_STATUS_BATCH + 1)]
+		self.assertFalse(get_erpnext_sales_order_statuses(names)["success"])
+
+
+class TestCheckoutCustomer(FrappeTestCase):
+	def setUp(self):
+		# A Ghana mobile number no other test record uses
+		self.local = f"059{random.randint(1_000_000, 9_999_999)}"
+		self.phone = normalize_phone(self.local)
+
+	def make_record(self, doctype, name, link_to=None, **values):
+		"""Row written directly, with a Dynamic Link to `link_to` for Contact and Address"""
+		doc = frappe.get_doc({"doctype": doctype, "name": name, **values})
+		if link_to:
+			doc.append("links", {"link_doctype": "Customer", "link_name": link_to})
+		doc.db_insert()
+		for row in doc.get_all_children():
+			row.db_insert()
+		self.addCleanup(frappe.db.delete, doctype, {"name": name})
+		self.addCleanup(frappe.db.delete, "Dynamic Link", {"parent": name})
+		return name
+
+	def test_normalize_phone_formats(self):
+		for raw in ("+233 55 729 7891", "00233557297891", "233557297891", "0557297891", "557297891"):
+			self.assertEqual(normalize_phone(raw), "+233557297891", raw)
+		self.assertEqual(normalize_phone("+44 20 7946 0958"), "+442079460958")
+		# Neither local nor prefixed: kept as given, not turned into a Ghana number
+		self.assertEqual(normalize_phone("2079460958"), "2079460958")
+		for raw in (None, "", "n/a"):
+			self.assertEqual(normalize_phone(raw), "")
+
+	def test_find_customer_by_customer_mobile(self):
+		customer = self.make_record(
+			"Customer", "_Test Phone Customer", customer_name="Phone", mobile_no=self.phone
+		)
+		self.assertEqual(find_customer_by_phone(self.local).name, customer)
+
+	def test_find_customer_by_legacy_contact_number(self):
+		customer = self.make_record("Customer", "_Test Contact Customer", customer_name="Contact")
+		self.make_record(
+			"Contact", "_Test Phone Contact", link_to=customer, first_name="Contact", mobile_no=self.local
+		)
+		self.assertEqual(find_customer_by_phone(self.phone).name, customer)
+
+	def test_find_customer_by_address_phone(self):
+		customer = self.make_record("Customer", "_Test Address Customer", customer_name="Address")
+		self.make_record(
+			"Address", "_Test Phone Address", link_to=customer, address_line1="1 Main St", phone=self.phone
+		)
+		self.assertEqual(find_customer_by_phone(self.local).name, customer)
+
+	@patch.object(customer_creation, "_create_customer_records")
+	def test_existing_customer_is_returned_not_recreated(self, create_records):
+		customer = self.make_record(
+			"Customer", "_Test Existing Customer", customer_name="Existing", mobile_no=self.local
+		)
+		self.addCleanup(frappe.cache().delete_value, f"{customer_creation.CUSTOMER_CACHE_PREFIX}{self.phone}")
+
+		result = customer_creation.create_customer_with_details(
+			{"customer_name": "Existing", "phone": self.local}
+		)
+		self.assertTrue(result["existing"])
+		self.assertEqual(result["customer"]["name"], customer)
+
+		# The second checkout is answered from the phone cache
+		with patch.object(customer_creation, "find_customer_by_phone") as find:
+			again = customer_creation.create_customer_with_details(
+				frappe.as_json({"customer_name": "Existing", "phone": self.phone})
+			)
+		find.assert_not_called()
+		self.assertEqual(again["customer"]["name"], customer)
+		create_records.assert_not_called()
+
+
+class TestOrderStatusFeed(FrappeTestCase):
+	def setUp(self):
+		self.order = f"_Test SO {frappe.generate_hash(length=8)}"
+		for doctype in ("Sales Order", "Ex Commerce Sales Order"):
+			self.addCleanup(frappe.cache().delete_value, order_events.get_cache_key(doctype, self.order))
+
+	def test_refresh_updates_snapshot_without_publishing(self):
+		self.assertIsNone(order_events.get_status_snapshot("Sales Order", self.order))
+
+		with patch("frappe.publish_realtime") as publish:
+			first = order_events.refresh_status_snapshot("Sales Order", self.order, "To Deliver")
+			same = order_events.refresh_status_snapshot("Sales Order", self.order, "To Deliver")
+			changed = order_events.refresh_status_snapshot("Sales Order", self.order, "Completed")
+
+		self.assertEqual((first["status"], first["seq"]), ("To Deliver", 1))
+		self.assertEqual(same, first)
+		self.assertEqual((changed["status"], changed["seq"]), ("Completed", 2))
+		self.assertEqual(order_events.get_status_snapshot("Sales Order", self.order), changed)
+		self.assertNotIn("published_status", changed)
+		publish.assert_not_called()
+
+	@patch("frappe.get_all", return_value=[])
+	@patch.object(order_events, "dispatch_event")
+	@patch("frappe.publish_realtime")
+	def test_document_events_publish_only_status_changes(self, publish, dispatch, get_all):
+		doc = frappe._dict(name=self.order, status="To Deliver")
+		# A status seeded by the long-poll is not a published one
+		order_events.refresh_status_snapshot("Sales Order", self.order, "To Deliver")
+
+		order_events.on_sales_order_change(doc)
+		order_events.on_sales_order_change(doc)
+		self.assertEqual(publish.call_count, 1)
+		self.assertEqual(dispatch.call_count, 1)
+
+		doc.status = "Completed"
+		order_events.on_sales_order_change(doc)
+		self.assertEqual(publish.call_count, 2)
+		snapshot = dispatch.call_args.args[1]
+		self.assertEqual((snapshot["status"], snapshot["seq"]), ("Completed", 3))
+
+	# Undecorated: the rate limit needs a request IP
+	def wait(self, last_status, timeout):
+		return orders.wait_for_order_status.__wrapped__(self.order, last_status=last_status, timeout=timeout)
+
+	@patch("time.sleep")
+	@patch("frappe.db.get_value", return_value="To Deliver")
+	def test_long_poll_returns_at_once_when_status_differs(self, get_value, sleep):
+		result = self.wait("Draft", timeout=5)
+
+		self.assertTrue(result["changed"])
+		self.assertEqual(result["status"], "To Deliver")
+		sleep.assert_not_called()
+
+	@patch("frappe.db.get_value", return_value="To Deliver")
+	def test_long_poll_times_out_without_a_change(self, get_value):
+		with patch("time.sleep") as sleep:
+			result = self.wait("To Deliver", timeout=0)
+		self.assertEqual(result, {"order_id": self.order, "status": "To Deliver", "changed": False})
+		sleep.assert_not_called()
+
+	@patch("frappe.db.get_value", return_value="To Deliver")
+	def test_long_poll_wakes_on_snapshot_change(self, get_value):
+		def status_changes(seconds):
+			order_events.refresh_status_snapshot("Sales Order", self.order, "Completed")
+
+		with patch("time.sleep", side_effect=status_changes) as sleep:
+			result = self.wait("To Deliver", timeout=5)
+
+		self.assertEqual((result["status"], result["changed"]), ("Completed", True))
+		sleep.assert_called_once_with(orders.LONG_POLL_INTERVAL_SECONDS)
+		# Only the first pass reads the database; waiting reads Redis
+		get_value.assert_called_once()
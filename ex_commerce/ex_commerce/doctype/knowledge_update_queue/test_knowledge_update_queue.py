@@ -1,9 +1,93 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from ex_commerce.ex_commerce.services import knowledge_pipeline
 
 
 class TestKnowledgeUpdateQueue(FrappeTestCase):
-	pass
+	def setUp(self):
+		# The pipeline commits between steps; keep everything inside the test transaction
+		patcher = patch.object(frappe.db, "commit")
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def make_row(self, status, minutes=0, attempts=0):
+		"""A queue row whose `not_before` is `minutes` from now"""
+		doc = frappe.get_doc(
+			{
+				"doctype": "Knowledge Update Queue",
+				"task_description": "Re-index _Test",
+				"status": status,
+				"attempts": attempts,
+				"priority": "High",
+				"created_at": add_to_date(now_datetime(), days=-1),
+				"not_before": add_to_date(now_datetime(), minutes=minutes),
+			}
+		)
+		doc.db_insert()
+		return doc.name
+
+	def claim(self):
+		return {row.name: row for row in knowledge_pipeline.claim_pending_updates(limit=1000)}
+
+	def test_stale_in_progress_rows_are_claimed_again(self):
+		stale = self.make_row("In Progress", minutes=-1, attempts=1)
+		leased = self.make_row("In Progress", minutes=10, attempts=1)
+
+		claimed = self.claim()
+		self.assertIn(stale, claimed)
+		self.assertNotIn(leased, claimed)
+		self.assertEqual(claimed[stale].attempts, 2)
+
+		row = frappe.db.get_value("Knowledge Update Queue", stale, ["status", "not_before"], as_dict=True)
+		self.assertEqual(row.status, "In Progress")
+		self.assertGreater(
+			get_datetime(row.not_before),
+			add_to_date(now_datetime(), minutes=knowledge_pipeline.STALE_UPDATE_MINUTES - 1),
+		)
+
+	def test_failed_rows_retry_with_backoff_until_max_attempts(self):
+		name = self.make_row("Failed", minutes=-1)
+		knowledge_pipeline.record_failure(name, 2, "boom")
+
+		row = frappe.db.get_value(
+			"Knowledge Update Queue", name, ["status", "not_before", "error"], as_dict=True
+		)
+		self.assertEqual((row.status, row.error), ("Failed", "boom"))
+		self.assertGreater(
+			get_datetime(row.not_before),
+			add_to_date(now_datetime(), seconds=2 * knowledge_pipeline.BACKOFF_BASE_SECONDS - 5),
+		)
+		self.assertNotIn(name, self.claim())
+
+		due = self.make_row("Failed", minutes=-1, attempts=1)
+		exhausted = self.make_row("Failed", minutes=-1, attempts=knowledge_pipeline.MAX_UPDATE_ATTEMPTS)
+		claimed = self.claim()
+		self.assertIn(due, claimed)
+		self.assertNotIn(exhausted, claimed)
+
+		knowledge_pipeline.record_failure(exhausted, knowledge_pipeline.MAX_UPDATE_ATTEMPTS, "boom")
+		self.assertIsNone(frappe.db.get_value("Knowledge Update Queue", exhausted, "not_before"))
+
+	@patch.object(knowledge_pipeline, "get_embedder")
+	@patch.object(knowledge_pipeline, "index_knowledge_document", side_effect=ValueError("bad pdf"))
+	def test_failed_update_is_recorded_for_retry(self, index_knowledge_document, get_embedder):
+		name = self.make_row("Pending", minutes=-1)
+		frappe.db.set_value(
+			"Knowledge Update Queue", name, "knowledge_document", "_Test KB", update_modified=False
+		)
+
+		with patch.object(frappe.db, "rollback"), patch.object(frappe, "log_error"):
+			knowledge_pipeline.process_pending_updates(max_batches=1)
+
+		row = frappe.db.get_value(
+			"Knowledge Update Queue", name, ["status", "attempts", "not_before", "error"], as_dict=True
+		)
+		self.assertEqual((row.status, row.attempts, row.error), ("Failed", 1, "bad pdf"))
+		self.assertGreater(get_datetime(row.not_before), now_datetime())
@@ -1,9 +1,33 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
+from frappe.utils import now_datetime
 
 
 class ProductKnowledgeBase(Document):
-	pass
+	def validate(self):
+		from ex_commerce.ex_commerce.services.knowledge_pipeline import update_fingerprints
+
+		self.updated_at = now_datetime()
+		self.flags.content_changed = update_fingerprints(self)
+
+	def on_update(self):
+		"""Queue re-embedding of whatever chunks changed, if the indexed content changed at all"""
+		from ex_commerce.ex_commerce.services.answer_cache import invalidate_knowledge_document
+		from ex_commerce.ex_commerce.services.knowledge_pipeline import enqueue_knowledge_update
+
+		if self.flags.content_changed:
+			enqueue_knowledge_update(self.name)
+
+		previous = self.get_doc_before_save()
+		invalidate_knowledge_document(self.name, (self.item, previous and previous.item))
+
+	def on_trash(self):
+		"""Remove this document's chunks from the vector index"""
+		from ex_commerce.ex_commerce.services.ann_index import remove_source_document
+		from ex_commerce.ex_commerce.services.answer_cache import invalidate_knowledge_document
+
+		remove_source_document(self.name)
+		invalidate_knowledge_document(self.name, (self.item,))
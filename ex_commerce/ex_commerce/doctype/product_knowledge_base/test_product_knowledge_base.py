@@ -1,9 +1,118 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import os
+
+import frappe
+import numpy as np
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services import answer_cache
+from ex_commerce.ex_commerce.services.answer_cache import nearest
+from ex_commerce.ex_commerce.services.embeddings import HashingEmbedder
+from ex_commerce.ex_commerce.services.knowledge_pipeline import (
+	fingerprint_attachment,
+	hash_chunk,
+	split_into_chunks,
+)
+from ex_commerce.ex_commerce.services.product_qa import extractive_answer, normalize_question
+
 
 class TestProductKnowledgeBase(FrappeTestCase):
-	pass
+	def test_split_into_chunks_respects_size(self):
+		text = "\n\n".join(f"Paragraph {i}. " + "word " * 60 for i in range(10))
+		chunks = split_into_chunks(text, size=400, overlap=50)
+
+		self.assertGreater(len(chunks), 1)
+		self.assertTrue(all(len(chunk) <= 400 for chunk in chunks))
+		self.assertIn("Paragraph 0.", chunks[0])
+
+	def test_chunk_hash_ignores_whitespace_and_case(self):
+		self.assertEqual(hash_chunk("Solar  Panel\nwarranty"), hash_chunk("solar panel warranty"))
+
+	def test_hashing_embedder_is_deterministic(self):
+		embedder = HashingEmbedder(dim=64)
+		first = embedder.embed(["solar panel warranty", "delivery time"])
+		second = HashingEmbedder(dim=64).embed(["solar panel warranty", "delivery time"])
+
+		self.assertEqual(first.shape, (2, 64))
+		np.testing.assert_array_equal(first, second)
+
+	def test_normalize_question_shares_cache_keys(self):
+		self.assertEqual(
+			normalize_question("  What is the WARRANTY\non this panel?? "),
+			normalize_question("what is the warranty on this panel"),
+		)
+
+	def test_extractive_answer_quotes_live_price(self):
+		chunks = [{"chunk_text": "Comes with a 10 year warranty.", "product_name": "Panel", "item": "PNL"}]
+		products = [{"item_code": "PNL", "item_name": "Panel", "price": 250.0, "formatted_price": "250.00"}]
+		text = extractive_answer(chunks, products)
+
+		self.assertIn("10 year warranty", text)
+		self.assertIn("250.00", text)
+
+	def test_attachment_fingerprint_rehashes_only_when_stat_changes(self):
+		path = frappe.get_site_path("private", "files", "_test_kb_fingerprint.txt")
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, "w") as f:
+			f.write("Warranty: 10 years")
+		self.addCleanup(os.remove, path)
+
+		file_url = "/private/files/_test_kb_fingerprint.txt"
+		content_hash, size, mtime = fingerprint_attachment(file_url)
+
+		# Same size and mtime: the stored hash is trusted without reading the file
+		stored = frappe._dict(content_hash="stored-hash", file_size=size, file_mtime=mtime)
+		self.assertEqual(fingerprint_attachment(file_url, stored)[0], "stored-hash")
+
+		os.utime(path, (mtime + 10, mtime + 10))
+		self.assertEqual(fingerprint_attachment(file_url, stored)[0], content_hash)
+
+	def test_answer_cache_matches_only_similar_questions(self):
+		embedder = HashingEmbedder(dim=256)
+		cached = embedder.embed(["is the solar panel in stock", "delivery time to accra"])
+		reworded = embedder.embed(["is the solar panel in stock now"])[0]
+		unrelated = embedder.embed(["return policy for batteries"])[0]
+
+		self.assertEqual(nearest(cached.astype(np.float16), reworded, threshold=0.7), [0])
+		self.assertEqual(nearest(cached.astype(np.float16), unrelated, threshold=0.7), [])
+
+	def open_slot(self, vector, **scope):
+		"""Answer cache slot under a throwaway model name, removed after the test"""
+		slot = answer_cache.open_slot(self.model_name, vector, **scope)
+		self.addCleanup(slot.cache.delete, slot.list_key)
+		return slot
+
+	def cache_answer(self, vector, answer, **scope):
+		slot = self.open_slot(vector, **scope)
+		answer_cache.snapshot(slot, [], [])
+		answer_cache.store(slot, "question", answer, [], [])
+
+	def test_answer_cache_misses_after_item_price_change(self):
+		self.model_name = f"_test-{frappe.generate_hash(length=8)}"
+		item_code = f"_Test QA Item {frappe.generate_hash(length=8)}"
+		vector = HashingEmbedder(dim=64).embed(["price of the panel"])[0]
+		self.cache_answer(vector, "It costs 250.00", item_code=item_code)
+
+		self.assertEqual(
+			answer_cache.lookup(self.open_slot(vector, item_code=item_code))["answer"], "It costs 250.00"
+		)
+		answer_cache.invalidate_item_price(frappe._dict(item_code=item_code), "after_insert")
+		self.assertIsNone(answer_cache.lookup(self.open_slot(vector, item_code=item_code)))
+
+	def test_answer_cache_keeps_catalog_questions_apart_by_item(self):
+		self.model_name = f"_test-{frappe.generate_hash(length=8)}"
+		# Same wording, so only the scope item tells the questions apart
+		vector = HashingEmbedder(dim=64).embed(["price of the 100w panel"])[0]
+		self.cache_answer(vector, "It costs 250.00", lexical_item="_Test PNL-100")
+
+		self.assertIsNone(answer_cache.lookup(self.open_slot(vector, lexical_item="_Test PNL-200")))
+		self.assertIsNone(answer_cache.lookup(self.open_slot(vector)))
+		self.assertEqual(
+			answer_cache.lookup(self.open_slot(vector, lexical_item="_Test PNL-100"))["answer"],
+			"It costs 250.00",
+		)
+		# The scope item is one of the entry's versions
+		answer_cache.invalidate_item_price(frappe._dict(item_code="_Test PNL-100"), "after_insert")
+		self.assertIsNone(answer_cache.lookup(self.open_slot(vector, lexical_item="_Test PNL-100")))
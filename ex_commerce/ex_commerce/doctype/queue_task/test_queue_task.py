@@ -1,9 +1,103 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import MagicMock, patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from ex_commerce.ex_commerce.services import task_scheduler
 
 
 class TestQueueTask(FrappeTestCase):
-	pass
+	def setUp(self):
+		# A task type of its own, so rows left by other tests never count towards the limit
+		self.task_type = f"_Test {frappe.generate_hash(length=8)}"
+		# The scheduler commits between steps; keep everything inside the test transaction
+		patcher = patch.object(frappe.db, "commit")
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def make_task(self, status="Pending", priority="Medium", **values):
+		task = frappe.get_doc(
+			{
+				"doctype": "Queue Task",
+				"task_name": "_Test Task",
+				"task_type": self.task_type,
+				"priority": priority,
+				"status": status,
+				"max_attempts": 3,
+				**values,
+			}
+		)
+		task.db_insert()
+		return task.name
+
+	def get_task(self, name):
+		return frappe.db.get_value(
+			"Queue Task", name, ["status", "attempts", "next_attempt_at", "error"], as_dict=True
+		)
+
+	def test_claim_honours_concurrency_across_workers(self):
+		self.make_task("Processing", attempts=1, started_at=now_datetime())
+		low = self.make_task(priority="Low")
+		high = self.make_task(priority="High")
+		medium = self.make_task()
+		self.make_task(next_attempt_at=add_to_date(now_datetime(), minutes=5), priority="High")
+
+		claimed = task_scheduler.claim_tasks(self.task_type, concurrency=3)
+		self.assertEqual(claimed, [high, medium])
+		self.assertEqual(self.get_task(high).status, "Processing")
+		self.assertEqual(self.get_task(high).attempts, 1)
+
+		# The type is at its limit until a running task finishes
+		self.assertEqual(task_scheduler.claim_tasks(self.task_type, concurrency=3), [])
+		self.assertEqual(self.get_task(low).status, "Pending")
+
+	def test_claim_survives_an_expired_lock(self):
+		lock = MagicMock()
+		lock.acquire.return_value = True
+		lock.release.side_effect = Exception("Cannot release an unlocked lock")
+		name = self.make_task()
+
+		with patch.object(frappe.cache(), "lock", return_value=lock):
+			self.assertEqual(task_scheduler.claim_tasks(self.task_type, concurrency=1), [name])
+
+	def test_failures_back_off_then_dead_letter(self):
+		def handler(task):
+			raise ValueError("handler failed")
+
+		name = self.make_task("Processing", attempts=2, started_at=now_datetime())
+		with (
+			patch.object(task_scheduler, "get_handler", return_value=handler),
+			patch.object(frappe.db, "rollback"),
+			patch.object(frappe, "log_error"),
+		):
+			task_scheduler.execute_task(name)
+			task = self.get_task(name)
+			self.assertEqual((task.status, task.error), ("Pending", "handler failed"))
+			delay = task_scheduler.BACKOFF_BASE_SECONDS * 2
+			self.assertGreater(
+				get_datetime(task.next_attempt_at), add_to_date(now_datetime(), seconds=delay - 5)
+			)
+
+			frappe.db.set_value("Queue Task", name, {"status": "Processing", "attempts": 3})
+			task_scheduler.execute_task(name)
+
+		task = self.get_task(name)
+		self.assertEqual(task.status, "Dead Letter")
+		self.assertIsNone(task.next_attempt_at)
+
+	def test_stale_processing_tasks_are_requeued(self):
+		stale = add_to_date(now_datetime(), minutes=-task_scheduler.TASK_TIMEOUT_MINUTES - 1)
+		retry = self.make_task("Processing", attempts=1, started_at=stale)
+		exhausted = self.make_task("Processing", attempts=3, started_at=stale)
+		running = self.make_task("Processing", attempts=1, started_at=now_datetime())
+
+		task_scheduler.requeue_stale_tasks()
+
+		self.assertEqual(self.get_task(retry).status, "Pending")
+		self.assertEqual(self.get_task(retry).error, "Worker timed out")
+		self.assertEqual(self.get_task(exhausted).status, "Dead Letter")
+		self.assertEqual(self.get_task(running).status, "Processing")
@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.variant_selector import clear_tables
+
 
 class ResponseVariant(Document):
-	pass
+	def on_update(self):
+		clear_tables(self.context_reference)
+
+	def on_trash(self):
+		clear_tables(self.context_reference)
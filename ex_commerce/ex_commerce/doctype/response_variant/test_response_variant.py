@@ -1,9 +1,62 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import random
+from collections import Counter
+from unittest.mock import patch
+
+import frappe
+import numpy as np
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services import variant_selector
+
+CONTEXT = "_Test Variant Context"
+
 
 class TestResponseVariant(FrappeTestCase):
-	pass
+	def setUp(self):
+		variant_selector.clear_tables()
+		self.addCleanup(variant_selector.clear_tables)
+
+	def test_alias_table_reproduces_weights(self):
+		weights = [0.5, 0.3, 0.15, 0.05]
+		prob, alias = variant_selector.build_alias_table(weights)
+
+		# Column i is picked with 1/n and keeps i with prob[i], else hands over to alias[i]
+		n = len(weights)
+		implied = [prob[i] / n for i in range(n)]
+		for i in range(n):
+			implied[alias[i]] += (1 - prob[i]) / n
+		for expected, actual in zip(weights, implied, strict=True):
+			self.assertAlmostEqual(actual, expected)
+
+	def test_picks_follow_table_weights(self):
+		variants = [frappe._dict(name=name) for name in ("a", "b", "c")]
+		with patch.object(variant_selector, "thompson_weights", return_value=[0.6, 0.3, 0.1]):
+			table = variant_selector.VariantTable(variants)
+
+		rng = random.Random(7)
+		picks = Counter(table.pick(rng).name for _ in range(50_000))
+		for name, expected in zip("abc", (0.6, 0.3, 0.1), strict=True):
+			self.assertAlmostEqual(picks[name] / 50_000, expected, delta=0.01)
+
+	def test_thompson_weights_favour_the_likely_best_arm(self):
+		rng = np.random.default_rng(0)
+		weights = variant_selector.thompson_weights([40, 10], [10, 40], rng=rng)
+		self.assertAlmostEqual(sum(weights), 1.0)
+		self.assertGreater(weights[0], 0.95)
+
+		even = variant_selector.thompson_weights([20, 20], [20, 20], rng=rng)
+		self.assertAlmostEqual(even[0], 0.5, delta=0.05)
+
+	def test_thompson_weights_keep_exploration_floor(self):
+		weights = variant_selector.thompson_weights([0, 1000], [1000, 0], rng=np.random.default_rng(0))
+		self.assertAlmostEqual(weights[0], variant_selector.EXPLORATION_FLOOR / 2)
+		self.assertAlmostEqual(weights[1], 1 - variant_selector.EXPLORATION_FLOOR / 2)
+
+	@patch("frappe.get_all", return_value=[])
+	def test_context_without_variants_is_cached(self, get_all):
+		self.assertIsNone(variant_selector.pick_variant(CONTEXT))
+		self.assertIsNone(variant_selector.pick_variant(CONTEXT))
+		get_all.assert_called_once()
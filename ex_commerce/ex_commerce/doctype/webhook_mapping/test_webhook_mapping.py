@@ -1,9 +1,191 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and Contributors
 # See license.txt
 
-# import frappe
+import hashlib
+import hmac
+import json
+from unittest.mock import MagicMock, patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from ex_commerce.ex_commerce.services import chat_guard, webhook_ingest
+from ex_commerce.ex_commerce.services.chat_guard import coalesce
+from ex_commerce.ex_commerce.services.webhook_ingest import CompiledMapping, Mapper, MappingRuleError
+
+WHATSAPP_RULES = """
+@records entry[*].changes[*].value.messages[*]
+message_id = id
+content = text.body | ""
+phone = from
+business_number = $.entry[0].changes[0].value.metadata.display_phone_number
+"""
+
+
+def make_mapping(**values):
+	return frappe.get_doc(
+		{
+			"doctype": "Webhook Mapping",
+			"webhook_name": "_Test Webhook",
+			"mapping_rules": WHATSAPP_RULES,
+			"active": 1,
+			**values,
+		}
+	)
+
+
+def whatsapp_payload(*messages):
+	return json.dumps(
+		{
+			"entry": [
+				{
+					"changes": [
+						{
+							"value": {
+								"metadata": {"display_phone_number": "233200000000"},
+								"messages": [
+									{"id": message_id, "from": phone, "text": {"body": text}}
+									for message_id, phone, text in messages
+								],
+							}
+						}
+					]
+				}
+			]
+		}
+	)
+
 
 class TestWebhookMapping(FrappeTestCase):
-	pass
+	def test_maps_each_record(self):
+		payload = {
+			"entry": [
+				{
+					"changes": [
+						{
+							"value": {
+								"metadata": {"display_phone_number": "233200000000"},
+								"messages": [
+									{"id": "wamid.1", "from": "233241111111", "text": {"body": "Hi"}},
+									{"id": "wamid.2", "from": "233242222222", "type": "image"},
+								],
+							}
+						}
+					]
+				}
+			]
+		}
+		self.assertEqual(
+			Mapper(WHATSAPP_RULES)(payload),
+			[
+				{
+					"message_id": "wamid.1",
+					"content": "Hi",
+					"phone": "233241111111",
+					"business_number": "233200000000",
+				},
+				{
+					"message_id": "wamid.2",
+					"content": "",
+					"phone": "233242222222",
+					"business_number": "233200000000",
+				},
+			],
+		)
+
+	def test_invalid_rules(self):
+		for rules in ("", "content = messages[*].text", "content == body", "content = a..b"):
+			with self.assertRaises(MappingRuleError):
+				Mapper(rules)
+
+	def test_burst_coalesces_into_one_turn(self):
+		turn = coalesce(
+			[
+				{"message_id": "wamid.1", "content": "Hi", "customer": "CUST-1"},
+				{"message_id": "wamid.2", "content": "", "customer": "CUST-1"},
+				{"message_id": "wamid.3", "content": "where is my order", "customer": "CUST-1"},
+			]
+		)
+		self.assertEqual(turn["message_id"], "wamid.1")
+		self.assertEqual(turn["content"], "Hi\nwhere is my order")
+		self.assertEqual(turn["coalesced_message_ids"], ["wamid.1", "wamid.2", "wamid.3"])
+		self.assertIsNone(coalesce([]))
+
+	def test_active_mapping_requires_secret(self):
+		with self.assertRaises(frappe.ValidationError):
+			make_mapping().validate()
+		make_mapping(active=0).validate()
+		make_mapping(secret="s3cret").validate()
+
+	def test_signature_check_fails_closed(self):
+		body = b'{"entry": []}'
+		signature = "sha256=" + hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+
+		mapping = CompiledMapping(make_mapping(secret="s3cret"))
+		self.assertTrue(mapping.verify_signature(body, signature))
+		self.assertFalse(mapping.verify_signature(body + b" ", signature))
+		self.assertFalse(mapping.verify_signature(body, None))
+
+		unsigned = CompiledMapping(make_mapping(active=0))
+		self.assertFalse(unsigned.verify_signature(body, signature))
+
+	def unique_channel(self):
+		return f"_Test Channel {frappe.generate_hash(length=8)}"
+
+	def test_dedupe_drops_redeliveries_until_forgotten(self):
+		channel = self.unique_channel()
+		self.addCleanup(chat_guard.forget, channel, ["wamid.1", "wamid.2"])
+
+		self.assertFalse(chat_guard.is_duplicate(channel, "wamid.1"))
+		self.assertTrue(chat_guard.is_duplicate(channel, "wamid.1"))
+		self.assertFalse(chat_guard.is_duplicate(channel, "wamid.2"))
+		self.assertFalse(chat_guard.is_duplicate(channel, None))
+
+		chat_guard.forget(channel, "wamid.1")
+		self.assertFalse(chat_guard.is_duplicate(channel, "wamid.1"))
+
+	def test_first_message_owns_the_burst(self):
+		sender = f"_Test Sender {frappe.generate_hash(length=8)}"
+
+		self.assertTrue(chat_guard.add_to_burst(sender, {"message_id": "wamid.1", "content": "Hi"}))
+		self.assertFalse(chat_guard.add_to_burst(sender, {"message_id": "wamid.2", "content": "there"}))
+		records = chat_guard.collect_burst(sender, quiet=0, max_wait=0)
+		self.assertEqual([r["message_id"] for r in records], ["wamid.1", "wamid.2"])
+
+		# Collecting closes the burst, so the next message opens a new one
+		self.assertTrue(chat_guard.add_to_burst(sender, {"message_id": "wamid.3", "content": "?"}))
+		self.assertEqual(len(chat_guard.collect_burst(sender, quiet=0, max_wait=0)), 1)
+
+	def process(self, channel, body, log_message):
+		mapping = CompiledMapping(make_mapping(secret="s3cret", channel=channel))
+		collect_burst = chat_guard.collect_burst
+		with (
+			patch.object(webhook_ingest, "get_compiled_mapping", return_value=mapping),
+			patch.object(webhook_ingest, "find_customer_by_phone", return_value=None),
+			patch.object(webhook_ingest, "log_message", log_message),
+			patch.object(chat_guard, "collect_burst", lambda sender: collect_burst(sender, 0, 0)),
+		):
+			return webhook_ingest.process_inbound("_Test Webhook", body)
+
+	def test_inbound_redelivery_is_logged_once(self):
+		channel = self.unique_channel()
+		message_id = f"wamid.{frappe.generate_hash(length=8)}"
+		self.addCleanup(chat_guard.forget, channel, [message_id])
+		body = whatsapp_payload((message_id, f"2332{frappe.generate_hash(length=8)}", "Hi"))
+
+		log_message = MagicMock(return_value="LOG-1")
+		turns = self.process(channel, body, log_message)
+		self.assertEqual([turn["message_log"] for turn in turns], ["LOG-1"])
+		self.assertEqual(self.process(channel, body, log_message), [])
+		log_message.assert_called_once()
+
+	def test_inbound_failure_forgets_unlogged_ids(self):
+		channel = self.unique_channel()
+		message_id = f"wamid.{frappe.generate_hash(length=8)}"
+		self.addCleanup(chat_guard.forget, channel, [message_id])
+		body = whatsapp_payload((message_id, f"2332{frappe.generate_hash(length=8)}", "Hi"))
+
+		log_message = MagicMock(side_effect=frappe.ValidationError("Redis down"))
+		with self.assertRaises(frappe.ValidationError):
+			self.process(channel, body, log_message)
+		self.assertFalse(chat_guard.is_duplicate(channel, message_id))
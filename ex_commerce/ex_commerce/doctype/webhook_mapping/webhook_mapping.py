@@ -1,9 +1,30 @@
 # Copyright (c) 2025, Nana Kwame Amagyei and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
+from frappe import _
 from frappe.model.document import Document
 
+from ex_commerce.ex_commerce.services.webhook_ingest import Mapper, MappingRuleError, clear_mapping_cache
+
 
 class WebhookMapping(Document):
-	pass
+	def validate(self):
+		if self.active and not self.secret:
+			frappe.throw(
+				_("A Secret is required for an active webhook, unsigned deliveries are rejected"),
+				title=_("Missing Secret"),
+			)
+		try:
+			Mapper(self.mapping_rules)
+		except MappingRuleError as e:
+			frappe.throw(_("Invalid mapping rules: {0}").format(e), title=_("Mapping Rules"))
+
+	def on_update(self):
+		previous = self.get_doc_before_save()
+		if previous and previous.webhook_name != self.webhook_name:
+			clear_mapping_cache(previous.webhook_name)
+		clear_mapping_cache(self.webhook_name)
+
+	def on_trash(self):
+		clear_mapping_cache(self.webhook_name)
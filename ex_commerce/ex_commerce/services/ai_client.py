@@ -0,0 +1,247 @@
+"""
+AI provider client
+
+Talks to the OpenAI-compatible provider in AI Provider Settings
+(`/chat/completions`, `/embeddings`) for the models in AI Model Registry:
+
+- one keep-alive `requests` session per provider base URL per process
+- a Redis token bucket per model from its `requests_per_minute`
+- embedding input split into the model's batch size, after dropping texts
+  whose vectors are already cached
+- completions and embeddings cached in Redis by a hash of model + input
+- completions fall back through the active Chat models in registry order
+  when a model fails or is rate limited
+- `stream_complete` yields completion text as the provider streams it
+
+Embedding fallback only happens when no model is named: vectors from
+different models live in different spaces, so the knowledge base always
+embeds with a fixed model.
+
+`services/mock_provider.py` serves the same API locally for offline use and
+tests.
+"""
+
+import hashlib
+import json
+import threading
+
+import frappe
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from ex_commerce.ex_commerce.services.model_registry import get_models
+from ex_commerce.ex_commerce.services.rate_limit import TokenBucket
+
+PROVIDER_DOCTYPE = "AI Provider Settings"
+CACHE_PREFIX = "ex_commerce:ai_cache:"
+COMPLETION_CACHE_TTL = 24 * 60 * 60
+EMBEDDING_CACHE_TTL = 30 * 24 * 60 * 60
+REQUEST_TIMEOUT_SECONDS = 30
+POOL_SIZE = 16
+RATE_LIMIT_MAX_WAIT_SECONDS = 2
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class ProviderError(Exception):
+	pass
+
+
+class RateLimited(ProviderError):
+	pass
+
+
+def get_session(base_url):
+	"""Shared keep-alive session for a provider (thread-safe)"""
+	session = _sessions.get(base_url)
+	if session is None:
+		with _sessions_lock:
+			session = _sessions.get(base_url)
+			if session is None:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+				session.mount("http://", adapter)
+				session.mount("https://", adapter)
+				_sessions[base_url] = session
+	return session
+
+
+def content_hash(*parts):
+	return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class AIClient:
+	def __init__(self, base_url, api_key=None, timeout=REQUEST_TIMEOUT_SECONDS):
+		self.base_url = base_url.rstrip("/")
+		self.timeout = timeout
+		self.headers = {"Content-Type": "application/json"}
+		if api_key:
+			self.headers["Authorization"] = f"Bearer {api_key}"
+
+	def _candidates(self, capability, model=None):
+		models = get_models(capability)
+		if model is not None:
+			name = model if isinstance(model, str) else model.model_name
+			models = [m for m in models if m.model_name == name] or [frappe._dict(model_name=name)]
+		if not models:
+			raise ProviderError(f"No active {capability} model in AI Model Registry")
+		return models
+
+	def _request(self, path, payload, model, stream=False):
+		if model.get("requests_per_minute"):
+			bucket = TokenBucket.per_minute(f"model:{model.model_name}", model.requests_per_minute)
+			if not bucket.take(max_wait=RATE_LIMIT_MAX_WAIT_SECONDS):
+				raise RateLimited(f"Rate limit reached for {model.model_name}")
+
+		response = get_session(self.base_url).post(
+			f"{self.base_url}{path}", json=payload, headers=self.headers, timeout=self.timeout, stream=stream
+		)
+		if response.status_code == 429:
+			response.close()
+			raise RateLimited(f"{model.model_name}: provider returned 429")
+		try:
+			response.raise_for_status()
+		except requests.HTTPError:
+			response.close()
+			raise
+		return response
+
+	def _post(self, path, payload, model):
+		return self._request(path, payload, model).json()
+
+	def complete(self, messages, model=None, use_cache=True, **params):
+		"""
+		Chat completion. Returns {content, model, usage, cached}; tries the
+		next active Chat model when one fails.
+		"""
+		candidates = self._candidates("Chat", model)
+		keys = {
+			c.model_name: f"{CACHE_PREFIX}chat:{content_hash(c.model_name, messages, params)}"
+			for c in candidates
+		}
+		if use_cache:
+			# Any candidate's cached answer beats calling a model that may be down
+			for candidate in candidates:
+				cached = frappe.cache().get_value(keys[candidate.model_name])
+				if cached:
+					return {**cached, "cached": True}
+
+		errors = []
+		for candidate in candidates:
+			try:
+				data = self._post(
+					"/chat/completions",
+					{"model": candidate.model_name, "messages": messages, **params},
+					candidate,
+				)
+			except (ProviderError, requests.RequestException) as e:
+				errors.append(f"{candidate.model_name}: {e}")
+				continue
+
+			result = {
+				"content": data["choices"][0]["message"]["content"],
+				"model": candidate.model_name,
+				"usage": data.get("usage"),
+			}
+			if use_cache:
+				frappe.cache().set_value(
+					keys[candidate.model_name], result, expires_in_sec=COMPLETION_CACHE_TTL
+				)
+			return {**result, "cached": False}
+
+		raise ProviderError("All chat models failed: " + "; ".join(errors))
+
+	def stream_complete(self, messages, model=None, **params):
+		"""
+		Streaming chat completion. The request is sent (falling back through
+		the Chat models) before this returns, so provider errors raise here;
+		the returned generator of text deltas only reads the open response
+		and needs no Frappe context.
+		"""
+		errors = []
+		for candidate in self._candidates("Chat", model):
+			try:
+				response = self._request(
+					"/chat/completions",
+					{"model": candidate.model_name, "messages": messages, "stream": True, **params},
+					candidate,
+					stream=True,
+				)
+			except (ProviderError, requests.RequestException) as e:
+				errors.append(f"{candidate.model_name}: {e}")
+				continue
+			return _read_stream(response)
+
+		raise ProviderError("All chat models failed: " + "; ".join(errors))
+
+	def embed(self, texts, model=None):
+		"""(float32 array of shape (len(texts), dim), model name used)"""
+		errors = []
+		for candidate in self._candidates("Embedding", model):
+			try:
+				return self._embed_with(candidate, list(texts)), candidate.model_name
+			except (ProviderError, requests.RequestException) as e:
+				errors.append(f"{candidate.model_name}: {e}")
+		raise ProviderError("All embedding models failed: " + "; ".join(errors))
+
+	def _embed_with(self, model, texts):
+		cache = frappe.cache()
+		keys = [
+			cache.make_key(f"{CACHE_PREFIX}embedding:{content_hash(model.model_name, text)}")
+			for text in texts
+		]
+		pipe = cache.pipeline()
+		for key in keys:
+			pipe.get(key)
+		cached = pipe.execute()
+
+		vectors = [np.frombuffer(raw, dtype=np.float32) if raw else None for raw in cached]
+		missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+		batch_size = model.get("batch_size") or len(texts) or 1
+		for start in range(0, len(missing), batch_size):
+			batch = missing[start : start + batch_size]
+			data = self._post(
+				"/embeddings",
+				{"model": model.model_name, "input": [texts[i] for i in batch]},
+				model,
+			)
+			rows = sorted(data["data"], key=lambda d: d["index"])
+			pipe = cache.pipeline()
+			for i, row in zip(batch, rows, strict=True):
+				vectors[i] = np.asarray(row["embedding"], dtype=np.float32)
+				pipe.set(keys[i], vectors[i].tobytes(), ex=EMBEDDING_CACHE_TTL)
+			pipe.execute()
+
+		if not vectors:
+			return np.empty((0, 0), dtype=np.float32)
+		return np.vstack(vectors)
+
+
+def _read_stream(response):
+	with response:
+		yield from iter_stream_deltas(response)
+
+
+def iter_stream_deltas(response):
+	"""Text deltas from an OpenAI-style `text/event-stream` completion"""
+	for line in response.iter_lines(decode_unicode=True):
+		if not line or not line.startswith("data:"):
+			continue
+		data = line[len("data:") :].strip()
+		if data == "[DONE]":
+			return
+		for choice in json.loads(data).get("choices") or []:
+			delta = (choice.get("delta") or {}).get("content")
+			if delta:
+				yield delta
+
+
+def get_client():
+	"""Client for the active AI provider, or None when none is configured"""
+	settings = frappe.get_cached_doc(PROVIDER_DOCTYPE)
+	if not (settings.active and settings.base_url):
+		return None
+	return AIClient(settings.base_url, api_key=settings.get_password("api_key", raise_exception=False))
@@ -0,0 +1,480 @@
+"""
+Approximate nearest-neighbour (IVF-flat) index over the binary vector store
+
+Rows of a model's vector matrix are clustered with spherical k-means into
+`n_lists` inverted lists. A query only scores the rows in the `nprobe` lists
+whose centroids are closest to it, which is what keeps chat retrieval in the
+millisecond range once exact scans get too slow.
+
+The index is persisted next to the vectors as `<model>.ivf.npz` and only
+stores centroids plus one list id per row, so it is cheap to rebuild.
+Rows appended after the last build are assigned to their nearest centroid
+on load (incremental insert); deletions reuse the vector store tombstones.
+Probed rows are scored on their int8 codes and the shortlist is reranked at
+full precision (see vector_store).
+
+`compact_stores` (weekly) drops embeddings whose knowledge document no
+longer exists, rewrites each store without tombstoned rows and retrains the
+index on the new offsets. Vectors without an Embedding Index row (left by a
+process that died before its insert committed or rolled back) are dropped
+once they have been untracked for UNTRACKED_GRACE_HOURS. While any vector
+is untracked for less than that it may still belong to an open transaction,
+whose rows would keep their old offsets, so the store is not rewritten.
+"""
+
+import os
+import time
+
+import frappe
+import numpy as np
+
+from ex_commerce.ex_commerce.services.vector_store import (
+	RERANK_FACTOR,
+	get_model_slug,
+	get_store,
+	normalize,
+	quantized_top_k,
+	resolve_offsets,
+)
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_TRAINING_ROWS = 50_000
+# Below this many rows an exact scan is as fast as probing lists
+MIN_ROWS_FOR_INDEX = 2_000
+# Rebuild once this fraction of rows was added or deleted since the last build
+REBUILD_DRIFT_RATIO = 0.2
+COMPACTION_UPDATE_BATCH = 1000
+COMPACTION_LOCK_SECONDS = 300
+# Vectors with no Embedding Index row for this long belong to no open transaction
+UNTRACKED_GRACE_HOURS = 24
+
+# model slug -> (index file mtime, IVFFlatIndex)
+_index_cache = {}
+
+
+def spherical_kmeans(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+	"""Cluster unit vectors by cosine similarity; returns unit-norm centroids"""
+	rng = np.random.default_rng(seed)
+	n_lists = max(1, min(n_lists, len(vectors)))
+	centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+
+	for _ in range(iterations):
+		assign = np.argmax(vectors @ centroids.T, axis=1)
+		sums = np.zeros_like(centroids)
+		np.add.at(sums, assign, vectors)
+		counts = np.bincount(assign, minlength=n_lists)
+
+		# Re-seed empty lists with random rows so every list stays useful
+		empty = np.flatnonzero(counts == 0)
+		if len(empty):
+			sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+		centroids = normalize(sums)
+
+	return centroids
+
+
+class IVFFlatIndex:
+	"""Inverted-file index over one model's VectorStore"""
+
+	def __init__(self, model_name, centroids=None, assignments=None, deleted_at_build=0):
+		self.model_name = model_name
+		self.store = get_store(model_name)
+		self.centroids = centroids
+		self.assignments = assignments if assignments is not None else np.empty(0, dtype=np.int32)
+		self.deleted_at_build = deleted_at_build
+		self._lists = None
+
+	@property
+	def path(self):
+		return f"{self.store.base_path}.ivf.npz"
+
+	@property
+	def is_trained(self):
+		return self.centroids is not None and len(self.centroids) > 0
+
+	def build(self, n_lists=None):
+		"""Train centroids on the current vectors and assign every row"""
+		matrix = self.store.matrix()
+		n = len(matrix)
+		if not n:
+			self.centroids = None
+			self.assignments = np.empty(0, dtype=np.int32)
+			return self
+
+		n_lists = n_lists or max(1, int(np.sqrt(n)))
+		rng = np.random.default_rng(0)
+		sample = np.arange(n)
+		if n > KMEANS_MAX_TRAINING_ROWS:
+			sample = np.sort(rng.choice(n, KMEANS_MAX_TRAINING_ROWS, replace=False))
+		training = np.asarray(matrix[sample], dtype=np.float32)
+
+		self.centroids = spherical_kmeans(training, n_lists)
+		self.assignments = self._assign(0, n)
+		self.deleted_at_build = int(np.count_nonzero(self.store.deleted_mask()))
+		self._lists = None
+		return self
+
+	def _assign(self, start, stop):
+		"""Nearest-centroid list id for rows [start, stop)"""
+		assignments = np.empty(stop - start, dtype=np.int32)
+		for block_start in range(start, stop, 65536):
+			block_stop = min(block_start + 65536, stop)
+			block = np.asarray(self.store.matrix()[block_start:block_stop], dtype=np.float32)
+			assignments[block_start - start : block_stop - start] = np.argmax(
+				block @ self.centroids.T, axis=1
+			)
+		return assignments
+
+	def sync(self):
+		"""Assign rows appended since the last build/sync (incremental insert)"""
+		if not self.is_trained:
+			return 0
+		n = len(self.store)
+		added = n - len(self.assignments)
+		if added > 0:
+			self.assignments = np.concatenate([self.assignments, self._assign(len(self.assignments), n)])
+			self._lists = None
+		return max(added, 0)
+
+	def _inverted_lists(self):
+		if self._lists is None:
+			order = np.argsort(self.assignments, kind="stable").astype(np.int64)
+			bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+			self._lists = (order, bounds)
+		return self._lists
+
+	def search(self, query, k=10, nprobe=DEFAULT_NPROBE):
+		"""Approximate cosine top-k; returns (row offsets, scores)"""
+		if not self.is_trained:
+			return self.store.search(query, k)
+
+		self.sync()
+		query = normalize(query)[0]
+		nprobe = max(1, min(nprobe, len(self.centroids)))
+		probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+
+		order, bounds = self._inverted_lists()
+		candidates = np.concatenate([order[bounds[c] : bounds[c + 1]] for c in probe])
+		if not len(candidates):
+			return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+		candidates.sort()  # sequential reads from the memmap
+		codes, scales = self.store.quantized()
+		scores = (np.asarray(codes[candidates], dtype=np.float32) @ query) * scales[candidates]
+		scores[np.asarray(self.store.deleted_mask()[candidates], dtype=bool)] = -np.inf
+
+		# Shortlist on the int8 codes, then rerank at full precision
+		shortlist = min(k * RERANK_FACTOR, len(candidates))
+		top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+		top = top[np.isfinite(scores[top])]
+		return self.store.rerank(candidates[top], query, k)
+
+	def needs_rebuild(self):
+		n = len(self.store)
+		if n < MIN_ROWS_FOR_INDEX:
+			return False
+		if not self.is_trained:
+			return True
+
+		deleted = int(np.count_nonzero(self.store.deleted_mask()))
+		drift = (n - len(self.assignments)) + (deleted - self.deleted_at_build)
+		return drift > REBUILD_DRIFT_RATIO * max(len(self.assignments), 1)
+
+	def save(self):
+		if not self.is_trained:
+			return
+		tmp_path = f"{self.path}.tmp.npz"
+		np.savez(
+			tmp_path,
+			centroids=self.centroids,
+			assignments=self.assignments,
+			deleted_at_build=np.array(self.deleted_at_build),
+		)
+		os.replace(tmp_path, self.path)
+
+	@classmethod
+	def load(cls, model_name):
+		index = cls(model_name)
+		if os.path.exists(index.path):
+			with np.load(index.path) as data:
+				index.centroids = data["centroids"]
+				index.assignments = data["assignments"]
+				index.deleted_at_build = int(data["deleted_at_build"])
+		return index
+
+
+def get_index(model_name):
+	"""Return the process-cached index for a model, reloading it after a rebuild"""
+	slug = get_model_slug(model_name)
+	path = IVFFlatIndex(model_name).path
+	mtime = os.path.getmtime(path) if os.path.exists(path) else None
+
+	cached = _index_cache.get(slug)
+	if cached and cached[0] == mtime:
+		return cached[1]
+
+	index = IVFFlatIndex.load(model_name)
+	_index_cache[slug] = (mtime, index)
+	return index
+
+
+def build_index(model_name, n_lists=None):
+	"""Train, persist and cache a fresh index for a model"""
+	index = IVFFlatIndex(model_name).build(n_lists=n_lists)
+	index.save()
+	_index_cache.pop(get_model_slug(model_name), None)
+	return index
+
+
+def search(model_name, query_vector, k=10, nprobe=DEFAULT_NPROBE):
+	"""
+	Top-k knowledge chunks for a query vector.
+
+	Returns [{"name", "source_document", "chunk_text", "score"}], best first. Small stores
+	are scanned exactly; larger ones go through the IVF index.
+	"""
+	index = get_index(model_name)
+	if len(index.store) < MIN_ROWS_FOR_INDEX:
+		offsets, scores = index.store.search(query_vector, k)
+	else:
+		offsets, scores = index.search(query_vector, k, nprobe=nprobe)
+
+	return resolve_offsets(model_name, offsets, scores)
+
+
+def remove_source_document(source_document):
+	"""Drop every embedding of a knowledge document (tombstones its vectors)"""
+	for name in frappe.get_all("Embedding Index", filters={"source_document": source_document}, pluck="name"):
+		frappe.delete_doc("Embedding Index", name, ignore_permissions=True)
+
+
+def remove_orphaned_embeddings(model_name):
+	"""Delete Embedding Index rows (and tombstone vectors) whose knowledge document is gone"""
+	orphans = frappe.db.sql(
+		"""
+		select ei.name, ei.vector_offset
+		from `tabEmbedding Index` ei
+		left join `tabProduct Knowledge Base` kb on kb.name = ei.source_document
+		where ei.model_name = %(model)s and ifnull(ei.source_document, '') != '' and kb.name is null
+		""",
+		{"model": model_name},
+		as_dict=True,
+	)
+	if orphans:
+		get_store(model_name).delete([row.vector_offset for row in orphans])
+		frappe.db.delete("Embedding Index", {"name": ("in", [row.name for row in orphans])})
+	return len(orphans)
+
+
+def compact_store(model_name):
+	"""
+	Drop orphaned embeddings, rewrite the model's vector store without
+	tombstoned rows, renumber Embedding Index offsets and retrain the index.
+
+	The store stays locked throughout, so appends wait instead of landing
+	in a store that is being rewritten. Vectors without an Embedding Index
+	row may belong to an insert that has not committed yet, so they are
+	only tombstoned once they were already untracked UNTRACKED_GRACE_HOURS
+	ago (first-seen times are kept next to the store). Until then the
+	rewrite is deferred: renumbering would move such a vector while its
+	pending row still holds the old offset.
+	"""
+	orphans = remove_orphaned_embeddings(model_name)
+	store = get_store(model_name)
+
+	with store.lock(timeout=COMPACTION_LOCK_SECONDS):
+		rows_before = len(store)
+		deleted = np.array(store.deleted_mask(), dtype=bool)
+		rows = frappe.get_all(
+			"Embedding Index", filters={"model_name": model_name}, fields=["name", "vector_offset"]
+		)
+
+		tracked = np.zeros(rows_before, dtype=bool)
+		for row in rows:
+			if row.vector_offset is not None and 0 <= row.vector_offset < rows_before:
+				tracked[row.vector_offset] = True
+		now = time.time()
+		seen = store.read_untracked()
+		untracked = {
+			int(offset): seen.get(int(offset), now) for offset in np.flatnonzero(~deleted & ~tracked)
+		}
+		expired = [
+			offset
+			for offset, first_seen in untracked.items()
+			if now - first_seen >= UNTRACKED_GRACE_HOURS * 3600
+		]
+		if expired:
+			store.delete(expired)
+			deleted[expired] = True
+			for offset in expired:
+				del untracked[offset]
+
+		result = {
+			"model": model_name,
+			"rows_before": rows_before,
+			"rows_after": rows_before,
+			"orphans": orphans,
+			"untracked_dropped": len(expired),
+			"untracked_pending": len(untracked),
+		}
+		if untracked or not deleted.any():
+			store.write_untracked(untracked)
+			frappe.db.commit()
+			return result
+
+		keep = np.flatnonzero(~deleted)
+		new_offsets = np.cumsum(~deleted) - 1
+
+		live, dangling = [], []
+		for row in rows:
+			offset = row.vector_offset
+			if offset is None or not 0 <= offset < rows_before or deleted[offset]:
+				dangling.append(row.name)
+			else:
+				live.append((row.name, int(new_offsets[offset])))
+		# Rows pointing at tombstoned or missing vectors could never be returned
+		if dangling:
+			frappe.db.delete("Embedding Index", {"name": ("in", dangling)})
+
+		for start in range(0, len(live), COMPACTION_UPDATE_BATCH):
+			batch = live[start : start + COMPACTION_UPDATE_BATCH]
+			frappe.db.sql(
+				f"""
+				update `tabEmbedding Index`
+				set vector_offset = case name {" ".join(["when %s then %s"] * len(batch))} end
+				where name in ({", ".join(["%s"] * len(batch))})
+				""",
+				(*(value for pair in batch for value in pair), *(name for name, _ in batch)),
+			)
+
+		# The index's row assignments are void once offsets move; without the
+		# file, workers fall back to the store's own search until the rebuild
+		index_path = IVFFlatIndex(model_name).path
+		if os.path.exists(index_path):
+			os.remove(index_path)
+		_index_cache.pop(get_model_slug(model_name), None)
+
+		# Offsets are committed right after the rewrite, so readers see new
+		# files with old offsets for one commit at most
+		result["rows_after"] = store.compact(keep)
+		store.write_untracked({})
+		frappe.db.commit()
+
+	if result["rows_after"] >= MIN_ROWS_FOR_INDEX:
+		build_index(model_name)
+	return result
+
+
+def compact_stores():
+	"""Scheduler job: compact every model's vector store"""
+	for model_name in _indexed_models():
+		result = compact_store(model_name)
+		if result["rows_after"] != result["rows_before"]:
+			frappe.logger().info(f"Compacted vector store: {result}")
+
+
+def _indexed_models():
+	return frappe.get_all(
+		"Embedding Index",
+		filters={"model_name": ["is", "set"]},
+		pluck="model_name",
+		distinct=True,
+	)
+
+
+def rebuild_stale_indexes():
+	"""Scheduler job: rebuild indexes that drifted too far from their vectors"""
+	for model_name in _indexed_models():
+		index = get_index(model_name)
+		if index.needs_rebuild():
+			build_index(model_name)
+			frappe.logger().info(f"Rebuilt IVF index for embedding model {model_name}")
+
+
+def benchmark_recall(model_name, k=10, n_queries=100, nprobe=DEFAULT_NPROBE, seed=0):
+	"""
+	Measure recall@k of the IVF index against exact search.
+
+	Queries are stored vectors perturbed with a little noise. Run with
+	`bench execute ex_commerce.ex_commerce.services.ann_index.benchmark_recall --args "['<model>']"`.
+	"""
+	index = get_index(model_name)
+	if not index.is_trained:
+		index = build_index(model_name)
+
+	store = index.store
+	n = len(store)
+	if not n:
+		return {"model": model_name, "rows": 0}
+
+	rng = np.random.default_rng(seed)
+	picks = rng.choice(n, min(n_queries, n), replace=False)
+	queries = store.get(picks)
+	queries = normalize(queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32))
+
+	hits = 0
+	exact_seconds = ann_seconds = 0.0
+	for query in queries:
+		started = time.perf_counter()
+		exact, _ = store.exact_search(query, k)
+		exact_seconds += time.perf_counter() - started
+
+		started = time.perf_counter()
+		approx, _ = index.search(query, k, nprobe=nprobe)
+		ann_seconds += time.perf_counter() - started
+
+		hits += len(np.intersect1d(exact, approx))
+
+	total = len(queries) * min(k, n)
+	return {
+		"model": model_name,
+		"rows": n,
+		"lists": len(index.centroids),
+		"nprobe": nprobe,
+		"k": k,
+		"recall_at_k": hits / total if total else 0.0,
+		"exact_ms_per_query": 1000 * exact_seconds / len(queries),
+		"ann_ms_per_query": 1000 * ann_seconds / len(queries),
+	}
+
+
+def benchmark_quantization(model_name, k=10, n_queries=100, seed=0):
+	"""
+	Measure what int8 quantization costs in recall against exact search,
+	with and without the full-precision rerank, and what it saves per row.
+
+	`bench execute ex_commerce.ex_commerce.services.ann_index.benchmark_quantization --args "['<model>']"`
+	"""
+	store = get_store(model_name)
+	n = len(store)
+	if not n:
+		return {"model": model_name, "rows": 0}
+
+	rng = np.random.default_rng(seed)
+	queries = store.get(rng.choice(n, min(n_queries, n), replace=False))
+	queries = normalize(queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32))
+
+	codes, scales = store.quantized()
+	hits_codes = hits_reranked = 0
+	for query in queries:
+		exact, _ = store.exact_search(query, k)
+		approx, _ = quantized_top_k(codes, scales, query, k, deleted=store.deleted_mask())
+		reranked, _ = store.search(query, k)
+		hits_codes += len(np.intersect1d(exact, approx))
+		hits_reranked += len(np.intersect1d(exact, reranked))
+
+	total = len(queries) * min(k, n)
+	return {
+		"model": model_name,
+		"k": k,
+		"recall_at_k_int8": hits_codes / total,
+		"recall_at_k_reranked": hits_reranked / total,
+		**store.memory_usage(),
+	}
+
+
+def run_queue_task(task):
+	"""Queue Task handler for task_type "Indexing": payload {"model_name": name}"""
+	build_index(task.payload["model_name"])
@@ -0,0 +1,201 @@
+"""
+Semantic answer cache for product questions
+
+Most shopper questions are rewordings of a few ("is X in stock", "how much
+is Y", "delivery time"). Answers from services/product_qa.py are cached with
+the question's embedding, and a new question is served from the cache when
+its embedding is within SIMILARITY_THRESHOLD (cosine) of a cached question
+for the same item scope: the item code asked about, or for catalog-wide
+questions the item the question matches best lexically. Rewordings share an
+entry; "price of the 100W panel" and "price of the 200W panel" embed close
+together but name different items, so they never do.
+
+Each entry records the version of everything its answer depends on:
+
+- `Item:<code>` for the scope item and every item the answer quotes; bumped
+  by Item and Item Price changes and by knowledge documents linked to it
+- `Knowledge Base:<name>` for every excerpt used; bumped on save, delete and
+  after re-indexing
+- `catalog` for catalog-wide questions; bumped by any Item or knowledge
+  document change, since a new or edited product can change which items
+  match (price updates alone do not)
+
+Versions live in one Redis hash and are read when an entry is written and
+again when it is served; an entry whose versions moved is skipped, so
+invalidation never scans the cache. Question vectors are kept as float16
+in a capped Redis list per scope, answers as separate keys, both expiring
+after ENTRY_TTL.
+"""
+
+import json
+
+import frappe
+import numpy as np
+
+CACHE_PREFIX = "ex_commerce:answer_cache:"
+VERSIONS_KEY = "ex_commerce:answer_cache_versions"
+CATALOG_REF = "catalog"
+SIMILARITY_THRESHOLD = 0.92
+# Close matches tried, best first, before giving up on stale entries
+MAX_CANDIDATES = 3
+MAX_ENTRIES_PER_SCOPE = 200
+ENTRY_TTL = 60 * 60
+ID_LENGTH = 16
+
+
+def item_ref(item_code):
+	return f"Item:{item_code}"
+
+
+def knowledge_ref(name):
+	return f"Knowledge Base:{name}"
+
+
+def _versions_key(cache):
+	return cache.make_key(VERSIONS_KEY)
+
+
+def get_versions(refs):
+	"""{ref: version} for the given refs; None for refs never changed"""
+	refs = sorted(set(refs))
+	if not refs:
+		return {}
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.hmget(_versions_key(cache), refs)
+	(values,) = pipe.execute()
+	return {
+		ref: frappe.safe_decode(value) if value else None for ref, value in zip(refs, values, strict=True)
+	}
+
+
+def invalidate_refs(refs):
+	"""Give each ref a new version, so every cached answer that used it is skipped"""
+	refs = {ref for ref in refs if ref}
+	if not refs:
+		return
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.hset(_versions_key(cache), mapping={ref: frappe.generate_hash(length=10) for ref in refs})
+	pipe.execute()
+
+
+def get_refs(item_code, chunks, products):
+	"""Refs an answer depends on: its scope item, quoted items and excerpts"""
+	refs = {item_ref(item_code) if item_code else CATALOG_REF}
+	refs.update(item_ref(product["item_code"]) for product in products)
+	refs.update(item_ref(chunk["item"]) for chunk in chunks if chunk.get("item"))
+	refs.update(knowledge_ref(chunk["source_document"]) for chunk in chunks)
+	return refs
+
+
+def nearest(matrix, vector, threshold=SIMILARITY_THRESHOLD, limit=MAX_CANDIDATES):
+	"""Row indices of `matrix` with cosine similarity >= threshold to `vector`, best first"""
+	if not len(matrix):
+		return []
+	matrix = np.asarray(matrix, dtype=np.float32)
+	vector = np.asarray(vector, dtype=np.float32)
+	norms = np.linalg.norm(matrix, axis=1) * max(float(np.linalg.norm(vector)), 1e-12)
+	similarities = matrix @ vector / np.maximum(norms, 1e-12)
+	order = np.argsort(-similarities)[:limit]
+	return [int(i) for i in order if similarities[i] >= threshold]
+
+
+def open_slot(model_name, vector, item_code=None, lexical_item=None):
+	"""
+	Cache position for a question. Holds the Redis client and final keys, so
+	`store` also works after the request context is gone (streamed answers).
+	Catalog-wide questions (no `item_code`) are scoped by `lexical_item`, the
+	item their wording matches best, if any.
+	"""
+	cache = frappe.cache()
+	scope = f"{CACHE_PREFIX}{model_name}:{item_code or '*:' + (lexical_item or '')}"
+	return frappe._dict(
+		cache=cache,
+		list_key=cache.make_key(f"{scope}:questions"),
+		entry_prefix=cache.make_key(f"{scope}:entry:"),
+		vector=np.asarray(vector, dtype=np.float32),
+		item_code=item_code,
+		lexical_item=None if item_code else lexical_item,
+		versions=None,
+	)
+
+
+def lookup(slot):
+	"""The cached answer for the closest question in the slot's scope, if still current"""
+	pipe = slot.cache.pipeline()
+	pipe.lrange(slot.list_key, 0, -1)
+	(raw,) = pipe.execute()
+	dim = len(slot.vector)
+	rows = [row for row in raw if len(row) == ID_LENGTH + dim * 2]
+	if not rows:
+		return None
+
+	vectors = b"".join(row[ID_LENGTH:] for row in rows)
+	matrix = np.frombuffer(vectors, dtype=np.float16).reshape(len(rows), dim)
+	for index in nearest(matrix, slot.vector):
+		entry_id = frappe.safe_decode(rows[index][:ID_LENGTH])
+		pipe.get(f"{slot.entry_prefix}{entry_id}")
+		(payload,) = pipe.execute()
+		if not payload:
+			continue
+		entry = json.loads(payload)
+		if get_versions(entry["versions"]) == entry["versions"]:
+			return entry
+	return None
+
+
+def snapshot(slot, chunks, products):
+	"""Record the versions an answer is built on; call before generating it"""
+	refs = get_refs(slot.item_code, chunks, products)
+	if slot.lexical_item:
+		refs.add(item_ref(slot.lexical_item))
+	slot.versions = get_versions(refs)
+
+
+def store(slot, question, answer, sources, products):
+	"""Cache an answer under the slot's question; needs `snapshot` first"""
+	if slot.versions is None:
+		return
+	entry_id = frappe.generate_hash(length=ID_LENGTH)
+	payload = json.dumps(
+		{
+			"question": question,
+			"answer": answer,
+			"sources": sources,
+			"products": products,
+			"versions": slot.versions,
+		},
+		default=str,
+	)
+	pipe = slot.cache.pipeline()
+	pipe.set(f"{slot.entry_prefix}{entry_id}", payload, ex=ENTRY_TTL)
+	pipe.lpush(slot.list_key, entry_id.encode() + slot.vector.astype(np.float16).tobytes())
+	pipe.ltrim(slot.list_key, 0, MAX_ENTRIES_PER_SCOPE - 1)
+	pipe.expire(slot.list_key, ENTRY_TTL)
+	pipe.execute()
+
+
+def invalidate_item(doc, method=None, *args):
+	"""Item doc_events hook: answers quoting the item, its template or the catalog"""
+	refs = {item_ref(doc.name), CATALOG_REF}
+	if doc.get("variant_of"):
+		refs.add(item_ref(doc.variant_of))
+	if method == "after_rename" and args:
+		# after_rename(old, new, merge): answers cached under the old code
+		refs.add(item_ref(args[0]))
+	invalidate_refs(refs)
+
+
+def invalidate_item_price(doc, method=None, *args):
+	"""Item Price doc_events hook: answers quoting the priced item"""
+	refs = {item_ref(doc.item_code)}
+	previous = doc.get_doc_before_save() if method == "on_update" else None
+	if previous and previous.item_code != doc.item_code:
+		refs.add(item_ref(previous.item_code))
+	invalidate_refs(refs)
+
+
+def invalidate_knowledge_document(name, item_codes=()):
+	"""Answers using a knowledge document, or about the items it describes"""
+	invalidate_refs({knowledge_ref(name), CATALOG_REF, *(item_ref(code) for code in item_codes if code)})
@@ -0,0 +1,151 @@
+"""
+Inbound chat ingress guard
+
+Runs before a message is logged or handed to the bot:
+
+- dedupe: channel message ids go into a Redis set per channel and day
+  (the previous day's set is checked too, and sets expire after two days),
+  so provider redeliveries are dropped. Callers `forget` ids whose message
+  could not be logged, so a retry is processed instead of dropped
+- rate limit: one token bucket per sender (CUSTOMER_TURNS_PER_MINUTE, with
+  a small burst) paid per bot turn, not per message
+- coalescing: messages from one sender are collected in a Redis list; the
+  first message of a burst makes its job the burst's owner, which waits for
+  COALESCE_SECONDS of quiet (at most MAX_COALESCE_SECONDS) and then takes
+  the whole list as one turn. Messages that arrive while a burst is open
+  cost nothing; a new burst without a token is dropped and counted.
+
+One turn means one AI Message Log row and one retrieval/generation
+downstream, however many messages a flooding customer sends. Streamed web
+chat (services/chat_stream.py) answers each request directly, so it only
+applies the dedupe and the turn bucket.
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils import now_datetime
+
+from ex_commerce.ex_commerce.services.rate_limit import TokenBucket
+
+SEEN_PREFIX = "ex_commerce:chat_seen:"
+BURST_PREFIX = "ex_commerce:chat_burst:"
+DROPPED_KEY = "ex_commerce:chat_dropped"
+SEEN_TTL_SECONDS = 2 * 24 * 60 * 60
+CUSTOMER_TURNS_PER_MINUTE = 6
+CUSTOMER_TURN_BURST = 3
+COALESCE_SECONDS = 2.0
+MAX_COALESCE_SECONDS = 8.0
+POLL_SECONDS = 0.25
+# Lets an abandoned burst (owner job died) expire instead of blocking the sender
+BURST_TTL_SECONDS = 60
+
+
+def _seen_keys(channel):
+	cache = frappe.cache()
+	today = now_datetime().toordinal()
+	return (
+		cache.make_key(f"{SEEN_PREFIX}{channel}:{today}"),
+		cache.make_key(f"{SEEN_PREFIX}{channel}:{today - 1}"),
+	)
+
+
+def is_duplicate(channel, message_id):
+	"""Record `message_id` as seen; True if it already was within the last day or two"""
+	if not message_id:
+		return False
+	today_key, yesterday_key = _seen_keys(channel or "")
+	pipe = frappe.cache().pipeline()
+	pipe.sismember(yesterday_key, message_id)
+	pipe.sadd(today_key, message_id)
+	pipe.expire(today_key, SEEN_TTL_SECONDS)
+	seen_yesterday, added, _ = pipe.execute()
+	return bool(seen_yesterday) or not added
+
+
+def forget(channel, message_ids):
+	"""Undo `is_duplicate` for messages that were not logged, so a redelivery is accepted"""
+	if isinstance(message_ids, str):
+		message_ids = [message_ids]
+	message_ids = [message_id for message_id in message_ids or () if message_id]
+	if not message_ids:
+		return
+	pipe = frappe.cache().pipeline()
+	# Both days: the date may have rolled over since the id was added
+	for key in _seen_keys(channel or ""):
+		pipe.srem(key, *message_ids)
+	pipe.execute()
+
+
+def get_turn_bucket(sender):
+	return TokenBucket.per_minute(f"chat_turn:{sender}", CUSTOMER_TURNS_PER_MINUTE, burst=CUSTOMER_TURN_BURST)
+
+
+def _burst_key(sender):
+	return frappe.cache().make_key(f"{BURST_PREFIX}{sender}")
+
+
+def add_to_burst(sender, record):
+	"""
+	Queue a message in its sender's burst. Returns True when this call opened
+	the burst (the caller must then `collect_burst`), False when the message
+	joined an open burst or was dropped for lack of a turn token.
+	"""
+	key = _burst_key(sender)
+	pipe = frappe.cache().pipeline()
+	pipe.rpush(key, json.dumps({"at": time.time(), "record": record}, default=str))
+	pipe.expire(key, BURST_TTL_SECONDS)
+	length, _ = pipe.execute()
+	if length > 1:
+		return False
+
+	allowed, _ = get_turn_bucket(sender).try_take()
+	if not allowed:
+		dropped_key = frappe.cache().make_key(DROPPED_KEY)
+		pipe.delete(key)
+		pipe.hincrby(dropped_key, sender, 1)
+		pipe.expire(dropped_key, SEEN_TTL_SECONDS)
+		pipe.execute()
+		frappe.logger("ex_commerce.chat_guard").info(f"Rate limited inbound chat from {sender}")
+		return False
+	return True
+
+
+def collect_burst(sender, quiet=COALESCE_SECONDS, max_wait=MAX_COALESCE_SECONDS):
+	"""Owner side: wait for the burst to go quiet, then take all of its records"""
+	key = _burst_key(sender)
+	cache = frappe.cache()
+	deadline = time.monotonic() + max_wait
+	while time.monotonic() < deadline:
+		pipe = cache.pipeline()
+		pipe.lindex(key, -1)
+		(last,) = pipe.execute()
+		if not last or time.time() - json.loads(last)["at"] >= quiet:
+			break
+		time.sleep(POLL_SECONDS)
+
+	pipe = cache.pipeline(transaction=True)
+	pipe.lrange(key, 0, -1)
+	pipe.delete(key)
+	raw, _ = pipe.execute()
+	return [json.loads(item)["record"] for item in raw]
+
+
+def coalesce(records):
+	"""One turn from a burst: contents joined in order, first record's other fields"""
+	if not records:
+		return None
+	turn = dict(records[0])
+	if len(records) > 1:
+		turn["content"] = "\n".join(str(r.get("content") or "") for r in records if r.get("content"))
+		turn["coalesced_message_ids"] = [r.get("message_id") for r in records]
+	return turn
+
+
+def get_dropped_counts():
+	"""{sender: bursts dropped by the rate limit}, kept for two days after the last drop"""
+	pipe = frappe.cache().pipeline()
+	pipe.hgetall(frappe.cache().make_key(DROPPED_KEY))
+	(raw,) = pipe.execute()
+	return {frappe.safe_decode(sender): int(count) for sender, count in raw.items()}
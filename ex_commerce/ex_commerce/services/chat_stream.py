@@ -0,0 +1,194 @@
+"""
+Streaming chat replies
+
+`start_reply` builds the prompt from the customer's cached conversation
+window (services/context_cache.py), opens a streaming completion with the
+AI provider and logs the customer's message, all before the request
+returns, so a provider that is down still fails as a normal API error. The
+message is only logged once the stream is open; on any earlier failure its
+id is released from the dedupe set, so the client can retry it. The
+returned events only forward text deltas as they arrive and need no Frappe
+context.
+
+When the stream ends, or the client goes away, the reply is logged to AI
+Message Log from a background thread, so logging never holds up a token.
+Time to first token (TTFT: request start to the first delta) is sent in the
+final `done` event, written to the `ex_commerce.chat_stream` logger and kept
+in Redis for `get_ttft_stats`.
+"""
+
+import itertools
+import threading
+import time
+
+import frappe
+import numpy as np
+import requests
+
+from ex_commerce.ex_commerce.services import chat_guard
+from ex_commerce.ex_commerce.services.ai_client import ProviderError, get_client
+from ex_commerce.ex_commerce.services.context_cache import get_context
+from ex_commerce.ex_commerce.services.message_log import log_message
+
+DEFAULT_CHANNEL = "Web"
+MAX_MESSAGE_LENGTH = 2000
+TTFT_KEY = "ex_commerce:chat_stream:ttft_ms"
+TTFT_SAMPLES = 1000
+
+SYSTEM_PROMPT = (
+	"You are the shop's customer assistant. Answer briefly and politely. If you do not "
+	"know something about an order or product, say so and offer to connect the customer "
+	"with support."
+)
+
+
+def _elapsed_ms(started):
+	return round((time.monotonic() - started) * 1000, 1)
+
+
+def build_messages(content, context=None):
+	"""Provider messages: system prompt, conversation so far, then the new message"""
+	messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+	if context:
+		if context["summary"]:
+			messages.append(
+				{"role": "system", "content": f"Earlier in this conversation:\n{context['summary']}"}
+			)
+		messages.extend({"role": turn["role"], "content": turn["content"]} for turn in context["turns"])
+	messages.append({"role": "user", "content": content})
+	return messages
+
+
+def start_reply(content, customer=None, channel=DEFAULT_CHANNEL, message_id=None):
+	"""
+	Log an incoming message and open the provider stream for the reply.
+	Returns an iterator of (event, data) pairs: `message`, `token`s, then
+	`done` (or `error` if the provider stream breaks off).
+	"""
+	started = time.monotonic()
+	content = (content or "").strip()[:MAX_MESSAGE_LENGTH]
+	if not content:
+		frappe.throw("Message cannot be empty")
+
+	if chat_guard.is_duplicate(channel, message_id):
+		frappe.throw("This message was already received")
+
+	deltas = None
+	try:
+		if customer and not chat_guard.get_turn_bucket(customer).try_take()[0]:
+			frappe.throw("Too many messages, please wait a moment", frappe.TooManyRequestsError)
+
+		client = get_client()
+		if not client:
+			frappe.throw("AI provider is not configured")
+
+		# Read the window before logging, so the new message is not in it twice
+		context = get_context(customer) if customer else None
+		messages = build_messages(content, context)
+		try:
+			deltas = client.stream_complete(messages)
+		except ProviderError:
+			frappe.log_error(title="Chat stream failed")
+			frappe.throw("The assistant is unavailable right now, please try again shortly")
+
+		incoming = log_message(
+			message_id or frappe.generate_hash(length=16),
+			content,
+			customer=customer,
+			direction="Incoming",
+			channel=channel,
+		)
+	except Exception:
+		# Not logged: a retry with the same id is a new attempt, not a redelivery
+		if deltas is not None:
+			deltas.close()
+		chat_guard.forget(channel, message_id)
+		raise
+
+	reply = frappe._dict(
+		site=frappe.local.site,
+		sites_path=frappe.local.sites_path,
+		user=frappe.session.user,
+		customer=customer,
+		channel=channel,
+		response_to=incoming,
+	)
+	events = _events(deltas, reply, started, frappe.logger("ex_commerce.chat_stream"))
+	# Run up to the first event now: a generator dropped before it starts never
+	# enters its try block, so the stream would stay open and nothing be logged
+	return itertools.chain([next(events)], events)
+
+
+def _events(deltas, reply, started, logger):
+	parts = []
+	ttft_ms = None
+	try:
+		yield "message", {"message_log": reply.response_to}
+		try:
+			for delta in deltas:
+				if ttft_ms is None:
+					ttft_ms = _elapsed_ms(started)
+				parts.append(delta)
+				yield "token", {"text": delta}
+		except (requests.RequestException, ValueError) as e:
+			logger.warning(f"Chat stream for {reply.response_to} broke off: {e}")
+			yield "error", {"message": "The reply was interrupted"}
+			return
+		yield "done", {"ttft_ms": ttft_ms, "total_ms": _elapsed_ms(started)}
+	finally:
+		# Also runs when the client disconnects and the generator is closed
+		deltas.close()
+		total_ms = _elapsed_ms(started)
+		logger.info(f"Chat stream {reply.response_to}: ttft {ttft_ms} ms, total {total_ms} ms")
+		threading.Thread(target=_finish_reply, args=(reply, "".join(parts), ttft_ms), daemon=True).start()
+
+
+def _finish_reply(reply, text, ttft_ms):
+	frappe.init(site=reply.site, sites_path=reply.sites_path)
+	try:
+		frappe.connect()
+		frappe.set_user(reply.user)
+		if text:
+			log_message(
+				frappe.generate_hash(length=16),
+				text,
+				customer=reply.customer,
+				direction="Outgoing",
+				channel=reply.channel,
+				response_to=reply.response_to,
+			)
+		if ttft_ms is not None:
+			record_ttft(ttft_ms)
+		frappe.db.commit()
+	finally:
+		frappe.destroy()
+
+
+def record_ttft(ttft_ms):
+	"""Keep the latest TTFT_SAMPLES time-to-first-token values"""
+	cache = frappe.cache()
+	key = cache.make_key(TTFT_KEY)
+	pipe = cache.pipeline()
+	pipe.lpush(key, ttft_ms)
+	pipe.ltrim(key, 0, TTFT_SAMPLES - 1)
+	pipe.execute()
+
+
+def get_ttft_stats():
+	"""Count and percentiles (ms) over the recorded TTFT samples"""
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.lrange(cache.make_key(TTFT_KEY), 0, -1)
+	(raw,) = pipe.execute()
+	if not raw:
+		return {"samples": 0}
+
+	values = np.asarray([float(value) for value in raw])
+	p50, p90, p99 = np.percentile(values, [50, 90, 99])
+	return {
+		"samples": len(values),
+		"p50_ms": round(float(p50), 1),
+		"p90_ms": round(float(p90), 1),
+		"p99_ms": round(float(p99), 1),
+		"max_ms": round(float(values.max()), 1),
+	}
@@ -0,0 +1,119 @@
+"""
+Compiled Chat Template rendering
+
+Template sources are compiled once per (template name, modified) into Jinja
+template objects held in a per-process cache, so a render is a plain
+`Template.render()` call. Saving the Chat Template changes its `modified`,
+which makes every worker miss and recompile on next use; the saving worker
+also drops its entries straight away.
+
+`template_content` is rich text: it is flattened to plain text (paragraphs
+and line breaks kept, entities such as `&quot;` inside Jinja tags decoded)
+before compiling, since chat channels send text.
+"""
+
+import html
+import re
+from collections import OrderedDict
+
+import frappe
+from frappe.utils import strip_html_tags
+
+DOCTYPE = "Chat Template"
+MAX_COMPILED_TEMPLATES = 256
+
+BLOCK_BREAK_RE = re.compile(r"<br\s*/?>|</p>|</div>|</li>", re.IGNORECASE)
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+ORDER_CONTEXT_FIELDS = (
+	"name",
+	"customer",
+	"customer_name",
+	"guest_name",
+	"transaction_date",
+	"delivery_date",
+	"currency",
+	"grand_total",
+	"rounded_total",
+	"status",
+	"erpnext_sales_order",
+)
+
+_compiled = OrderedDict()
+
+
+def html_to_template_source(content):
+	text = BLOCK_BREAK_RE.sub("\n", content or "")
+	text = html.unescape(strip_html_tags(text)).replace("\xa0", " ")
+	return BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def compile_template(key, content):
+	"""Compiled template for `content`, cached under `key` (LRU-bounded)"""
+	template = _compiled.get(key)
+	if template is not None:
+		_compiled.move_to_end(key)
+		return template
+
+	template = frappe.get_jenv().from_string(html_to_template_source(content))
+	_compiled[key] = template
+	if len(_compiled) > MAX_COMPILED_TEMPLATES:
+		_compiled.popitem(last=False)
+	return template
+
+
+def clear_compiled(template_name=None):
+	"""Drop compiled entries for `template_name`, or all of them"""
+	for key in list(_compiled):
+		if template_name is None or key[0] == template_name:
+			_compiled.pop(key, None)
+
+
+def get_template(template_name=None, category=None):
+	"""
+	The active Chat Template, compiled. `template_name` and `category`, when
+	given, must match the configured template.
+	"""
+	doc = frappe.get_cached_doc(DOCTYPE)
+	if not doc.active or not doc.template_content:
+		frappe.throw(frappe._("No active Chat Template is configured"))
+	if template_name and doc.template_name != template_name:
+		frappe.throw(frappe._("Chat Template {0} is not active").format(template_name))
+	if category and doc.template_category != category:
+		frappe.throw(frappe._("Active Chat Template is not a {0} template").format(category))
+
+	return compile_template((doc.template_name, str(doc.modified)), doc.template_content)
+
+
+def render(context, template_name=None, category=None):
+	return get_template(template_name, category).render(context)
+
+
+def render_batch(contexts, template_name=None, category=None):
+	"""Render one message per context (e.g. a broadcast) with a single compile"""
+	render_one = get_template(template_name, category).render
+	return [render_one(context) for context in contexts]
+
+
+def get_order_contexts(order_names):
+	"""Template contexts for Ex Commerce Sales Orders, fetched in one query"""
+	orders = frappe.get_all(
+		"Ex Commerce Sales Order",
+		filters={"name": ("in", order_names)},
+		fields=list(ORDER_CONTEXT_FIELDS),
+	)
+	by_name = {order.name: order for order in orders}
+	contexts = []
+	for name in order_names:
+		order = by_name.get(name)
+		if order:
+			order.customer_name = order.customer_name or order.guest_name
+			contexts.append({"order": order, "customer_name": order.customer_name})
+	return contexts
+
+
+def render_order_notifications(order_names, template_name=None, category="Order"):
+	"""{order name: message} for the given orders"""
+	contexts = get_order_contexts(order_names)
+	messages = render_batch(contexts, template_name, category)
+	return {context["order"].name: message for context, message in zip(contexts, messages, strict=True)}
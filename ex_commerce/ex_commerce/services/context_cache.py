@@ -0,0 +1,187 @@
+"""
+Per-customer conversation context cache
+
+Each customer's recent chat turns live in a Redis list capped at MAX_TURNS,
+next to a running summary of the turns that fell off the window. Turns are
+appended as messages are logged, so assembling a reply prompt is O(1) Redis
+work and no AI Message Log query. The history is only read from the database
+when a customer's window is not cached (first message, or after eviction).
+
+Windows expire after CONTEXT_TTL_SECONDS without activity, and at most
+MAX_CACHED_CONTEXTS customers are kept; the least recently used are evicted
+first.
+"""
+
+import json
+import time
+
+import frappe
+
+TURNS_KEY = "ex_commerce:chat_context:turns:"
+SUMMARY_KEY = "ex_commerce:chat_context:summary:"
+LRU_KEY = "ex_commerce:chat_context:lru"
+
+MAX_TURNS = 20
+CONTEXT_TTL_SECONDS = 24 * 60 * 60
+MAX_CACHED_CONTEXTS = 50_000
+DEFAULT_TOKEN_BUDGET = 2_000
+SUMMARY_TOKEN_BUDGET = 300
+
+
+def estimate_tokens(text):
+	"""Cheap token estimate (~4 characters per token) used for budgeting"""
+	return max(1, len(text or "") // 4)
+
+
+def _keys(customer):
+	cache = frappe.cache()
+	return cache.make_key(f"{TURNS_KEY}{customer}"), cache.make_key(f"{SUMMARY_KEY}{customer}")
+
+
+def _is_cached(summary_key):
+	# The summary key doubles as the "window loaded" marker; an empty list
+	# of turns is a valid cached state.
+	pipe = frappe.cache().pipeline()
+	pipe.exists(summary_key)
+	(exists,) = pipe.execute()
+	return bool(exists)
+
+
+def _turn_from_message(message):
+	return {
+		"name": message.get("name"),
+		"role": "assistant" if message.get("direction") == "Outgoing" else "user",
+		"content": message.get("content") or "",
+		"created_at": str(message.get("created_at")),
+	}
+
+
+def summarize(summary, turns):
+	"""
+	Fold evicted turns into the running summary, keeping its newest part
+	within SUMMARY_TOKEN_BUDGET. Deterministic and local; a provider-backed
+	summarizer can replace it without changing the cache layout.
+	"""
+	lines = [summary] if summary else []
+	lines.extend(f"{turn['role']}: {' '.join(turn['content'].split())[:200]}" for turn in turns)
+	text = "\n".join(lines)
+	max_chars = SUMMARY_TOKEN_BUDGET * 4
+	if len(text) > max_chars:
+		text = "…" + text[-max_chars:]
+	return text
+
+
+def _load_window(customer, exclude=None):
+	"""Seed a customer's window from AI Message Log (one indexed query)"""
+	from ex_commerce.ex_commerce.services.message_log import get_customer_messages
+
+	messages = get_customer_messages(customer, limit=MAX_TURNS)
+	turns = [_turn_from_message(m) for m in reversed(messages) if m.name != exclude]
+
+	turns_key, summary_key = _keys(customer)
+	pipe = frappe.cache().pipeline()
+	pipe.delete(turns_key)
+	if turns:
+		pipe.rpush(turns_key, *[json.dumps(t) for t in turns])
+	pipe.set(summary_key, json.dumps({"summary": ""}))
+	pipe.expire(turns_key, CONTEXT_TTL_SECONDS)
+	pipe.expire(summary_key, CONTEXT_TTL_SECONDS)
+	pipe.execute()
+
+
+def _touch(customer):
+	"""Record access for LRU eviction and evict the coldest windows over the cap"""
+	cache = frappe.cache()
+	lru_key = cache.make_key(LRU_KEY)
+	pipe = cache.pipeline()
+	pipe.zadd(lru_key, {customer: time.time()})
+	pipe.zcard(lru_key)
+	_, size = pipe.execute()
+
+	overflow = size - MAX_CACHED_CONTEXTS
+	if overflow > 0:
+		pipe.zpopmin(lru_key, overflow)
+		(evicted,) = pipe.execute()
+		for member, _ in evicted:
+			pipe.delete(*_keys(frappe.safe_decode(member)))
+		pipe.execute()
+
+
+def record_message(message):
+	"""Append a logged message (dict with name/customer/direction/content/created_at)"""
+	customer = message.get("customer")
+	if not customer:
+		return
+
+	turns_key, summary_key = _keys(customer)
+	cache = frappe.cache()
+	if not _is_cached(summary_key):
+		_load_window(customer, exclude=message.get("name"))
+
+	pipe = cache.pipeline()
+	pipe.rpush(turns_key, json.dumps(_turn_from_message(message)))
+	pipe.lrange(turns_key, 0, -(MAX_TURNS + 1))
+	pipe.ltrim(turns_key, -MAX_TURNS, -1)
+	pipe.expire(turns_key, CONTEXT_TTL_SECONDS)
+	pipe.expire(summary_key, CONTEXT_TTL_SECONDS)
+	_, overflow, *_ = pipe.execute()
+
+	if overflow:
+		# Two writers folding at once may drop one fold from the summary; the
+		# turns themselves are trimmed atomically above.
+		pipe = cache.pipeline()
+		pipe.get(summary_key)
+		(raw,) = pipe.execute()
+		summary = json.loads(raw)["summary"] if raw else ""
+		summary = summarize(summary, [json.loads(t) for t in overflow])
+		pipe.set(summary_key, json.dumps({"summary": summary}), ex=CONTEXT_TTL_SECONDS)
+		pipe.execute()
+
+	_touch(customer)
+
+
+def get_context(customer, token_budget=DEFAULT_TOKEN_BUDGET):
+	"""
+	Prompt context for a customer: running summary plus the newest turns that
+	fit in `token_budget` (summary counted first), oldest turn first.
+	"""
+	turns_key, summary_key = _keys(customer)
+	if not _is_cached(summary_key):
+		_load_window(customer)
+
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.get(summary_key)
+	pipe.lrange(turns_key, 0, -1)
+	pipe.expire(turns_key, CONTEXT_TTL_SECONDS)
+	pipe.expire(summary_key, CONTEXT_TTL_SECONDS)
+	raw_summary, raw_turns, *_ = pipe.execute()
+	_touch(customer)
+
+	summary = json.loads(raw_summary)["summary"] if raw_summary else ""
+	used = estimate_tokens(summary) if summary else 0
+
+	selected = []
+	for raw in reversed(raw_turns):
+		turn = json.loads(raw)
+		cost = estimate_tokens(turn["content"])
+		if used + cost > token_budget:
+			break
+		selected.append(turn)
+		used += cost
+
+	return {
+		"customer": customer,
+		"summary": summary,
+		"turns": list(reversed(selected)),
+		"tokens": used,
+	}
+
+
+def invalidate(customer):
+	"""Drop a customer's cached window, e.g. after their messages are deleted"""
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.delete(*_keys(customer))
+	pipe.zrem(cache.make_key(LRU_KEY), customer)
+	pipe.execute()
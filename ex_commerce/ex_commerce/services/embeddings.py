@@ -0,0 +1,100 @@
+"""
+Text embedders
+
+`get_embedder()` returns an embedder for the default Embedding model in AI
+Model Registry, served by the provider in AI Provider Settings (see
+services/ai_client.py), or the deterministic local HashingEmbedder when no
+provider or model is active, which is also what tests use.
+
+`embed_query` caches single query vectors in Redis, so repeated searches
+and questions skip the embedder entirely.
+"""
+
+import hashlib
+import re
+from itertools import pairwise
+
+import frappe
+import numpy as np
+
+from ex_commerce.ex_commerce.services.ai_client import get_client
+from ex_commerce.ex_commerce.services.model_registry import get_model
+
+BATCH_SIZE = 64
+QUERY_CACHE_PREFIX = "ex_commerce:query_embedding:"
+QUERY_CACHE_TTL = 24 * 60 * 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+	"""
+	Deterministic bag-of-words embedder using signed feature hashing of
+	word unigrams and bigrams. No network, no model files, stable across
+	processes (unlike Python's salted hash()).
+	"""
+
+	def __init__(self, dim=256):
+		self.dim = dim
+		self.model_name = f"local-hashing-{dim}"
+
+	def _features(self, text):
+		tokens = _TOKEN_RE.findall((text or "").lower())
+		return tokens + [f"{a} {b}" for a, b in pairwise(tokens)]
+
+	def embed(self, texts):
+		vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+		for row, text in enumerate(texts):
+			for feature in self._features(text):
+				digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+				bucket = int.from_bytes(digest[:4], "little") % self.dim
+				sign = 1.0 if digest[4] & 1 else -1.0
+				vectors[row, bucket] += sign
+		return vectors
+
+
+class ProviderEmbedder:
+	"""Embeddings from the AI provider, pinned to one registry model"""
+
+	def __init__(self, client, model):
+		self.client = client
+		self.model = model
+		self.model_name = model.model_name
+
+	def embed(self, texts):
+		vectors, _ = self.client.embed(texts, model=self.model)
+		return vectors
+
+
+def embed_in_batches(embedder, texts, batch_size=BATCH_SIZE):
+	"""Embed texts in provider-sized batches; returns a (len(texts), dim) array"""
+	if not texts:
+		return np.empty((0, 0), dtype=np.float32)
+	batches = [embedder.embed(texts[i : i + batch_size]) for i in range(0, len(texts), batch_size)]
+	return np.vstack(batches)
+
+
+def embed_query(embedder, text):
+	"""float32 vector for one (normalized) query text, cached per embedding model"""
+	cache = frappe.cache()
+	digest = hashlib.sha256(f"{embedder.model_name}\x1f{text}".encode()).hexdigest()
+	key = cache.make_key(f"{QUERY_CACHE_PREFIX}{digest}")
+	pipe = cache.pipeline()
+	pipe.get(key)
+	(raw,) = pipe.execute()
+	if raw:
+		return np.frombuffer(raw, dtype=np.float32)
+
+	vector = np.asarray(embedder.embed([text])[0], dtype=np.float32)
+	pipe.set(key, vector.tobytes(), ex=QUERY_CACHE_TTL)
+	pipe.execute()
+	return vector
+
+
+def get_embedder():
+	"""Embedder for the default Embedding model, falling back to the local HashingEmbedder"""
+	client = get_client()
+	model = get_model("Embedding", model_type="3rd Party API")
+	if not (client and model):
+		return HashingEmbedder()
+	return ProviderEmbedder(client, model)
@@ -0,0 +1,303 @@
+"""
+Hybrid catalog retrieval
+
+`search(query)` ranks catalog items two ways at once and fuses the two
+rankings with reciprocal rank fusion (RRF):
+
+- lexical: BM25 over item code, name, brand, group and description, with
+  an exact item code (SKU) match always ranked first. Good at codes, model
+  numbers and exact names.
+- vector: Product Knowledge Base chunks from the Embedding Index
+  (ann_index.search), grouped by the item they describe. Good at vague
+  natural-language questions.
+
+Both run in worker threads that share the request's Frappe context; only
+the vector side touches the database, so the connection is never used by
+two threads at once. Variants are folded into their template, so a match
+on any variant ranks the template.
+
+The lexical index is built per process and site from Item, and rebuilt when
+an Item changes (Item doc_events bump a version in Redis, checked at most
+every VERSION_CHECK_SECONDS). Fused results are cached in Redis per
+normalized query for RESULT_CACHE_TTL.
+
+Storefront search (api/products.get_products) and the product Q&A bot
+(services/product_qa.py) both use it. Storefront search takes every
+lexical match (up to MAX_STOREFRONT_RESULTS) rather than the top
+CANDIDATES, and api/products also keeps its substring match on item code
+and name, so partial codes still find items.
+"""
+
+import contextvars
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+import numpy as np
+from frappe.utils import strip_html_tags
+
+from ex_commerce.ex_commerce.services import ann_index
+from ex_commerce.ex_commerce.services.ai_client import ProviderError
+from ex_commerce.ex_commerce.services.embeddings import embed_query, get_embedder
+
+KNOWLEDGE_DOCTYPE = "Product Knowledge Base"
+VERSION_KEY = "ex_commerce:lexical_index_version"
+VERSION_CHECK_SECONDS = 5
+RESULT_CACHE_PREFIX = "ex_commerce:hybrid_search:"
+RESULT_CACHE_TTL = 5 * 60
+
+# Candidates taken from each ranking before fusion
+CANDIDATES = 50
+MAX_STOREFRONT_RESULTS = 1000
+# RRF constant: larger values flatten the difference between top ranks
+RRF_K = 60
+MAX_QUERY_LENGTH = 200
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Term repeats per field, i.e. field weights in BM25 term frequency
+FIELD_WEIGHTS = (("item_code", 3), ("item_name", 2), ("brand", 1), ("item_group", 1), ("description", 1))
+
+# Compound tokens keep codes like "sku-100/b" whole; their parts are indexed too
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid_search")
+# site -> {"version", "checked_at", "index"}
+_lexical = {}
+_build_lock = threading.Lock()
+
+
+def normalize_query(query):
+	text = unicodedata.normalize("NFKC", query or "").lower()
+	return " ".join(text.split()).strip("?!. ")[:MAX_QUERY_LENGTH]
+
+
+def tokenize(text):
+	tokens = []
+	for token in _TOKEN_RE.findall((text or "").lower()):
+		tokens.append(token)
+		parts = _PART_RE.findall(token)
+		if len(parts) > 1:
+			tokens.extend(parts)
+	return tokens
+
+
+class LexicalIndex:
+	"""BM25 over catalog items; variants are indexed under their template"""
+
+	def __init__(self, rows):
+		self.codes = []
+		positions = {}
+		term_counts = []
+		self.exact = {}
+
+		for row in rows:
+			code = row.variant_of or row.item_code
+			position = positions.get(code)
+			if position is None:
+				position = positions[code] = len(self.codes)
+				self.codes.append(code)
+				term_counts.append(Counter())
+			self.exact[row.item_code.lower()] = code
+			for fieldname, weight in FIELD_WEIGHTS:
+				value = row.get(fieldname)
+				if fieldname == "description":
+					value = strip_html_tags(value or "")
+				for token in tokenize(value):
+					term_counts[position][token] += weight
+
+		lengths = np.array([sum(c.values()) for c in term_counts], dtype=np.float32)
+		average = float(lengths.mean()) if len(lengths) else 1.0
+		norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(average, 1.0))
+
+		postings = {}
+		for position, counts in enumerate(term_counts):
+			for term, tf in counts.items():
+				postings.setdefault(term, ([], []))
+				postings[term][0].append(position)
+				postings[term][1].append(tf)
+
+		# Precompute each posting's BM25 weight, so a query is only sums
+		n = len(self.codes)
+		self.postings = {}
+		for term, (docs, tfs) in postings.items():
+			docs = np.array(docs, dtype=np.int32)
+			tfs = np.array(tfs, dtype=np.float32)
+			idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+			self.postings[term] = (docs, idf * tfs * (BM25_K1 + 1) / (tfs + norms[docs]))
+
+	def __len__(self):
+		return len(self.codes)
+
+	def search(self, query, k=CANDIDATES):
+		"""[(item_code, score)], best first"""
+		scores = np.zeros(len(self.codes), dtype=np.float32)
+		for term in set(tokenize(query)):
+			posting = self.postings.get(term)
+			if posting is not None:
+				scores[posting[0]] += posting[1]
+
+		exact = self.exact.get(query.strip())
+		results = [(exact, float("inf"))] if exact else []
+
+		matched = np.flatnonzero(scores)
+		if len(matched):
+			top_n = min(k, len(matched))
+			top = matched[np.argpartition(-scores[matched], top_n - 1)[:top_n]]
+			top = top[np.argsort(-scores[top])]
+			results.extend((self.codes[i], float(scores[i])) for i in top if self.codes[i] != exact)
+		return results[:k]
+
+
+def build_lexical_index():
+	rows = frappe.get_all(
+		"Item",
+		filters={"disabled": 0, "is_sales_item": 1},
+		fields=["item_code", "variant_of", "item_name", "brand", "item_group", "description"],
+	)
+	return LexicalIndex(rows)
+
+
+def get_lexical_index():
+	"""Process-cached lexical index for the current site, rebuilt after Item changes"""
+	site = frappe.local.site
+	entry = _lexical.get(site)
+	now = time.monotonic()
+	if entry is None or now - entry["checked_at"] > VERSION_CHECK_SECONDS:
+		version = frappe.cache().get_value(VERSION_KEY)
+		if entry is None or entry["version"] != version:
+			with _build_lock:
+				entry = _lexical.get(site)
+				if entry is None or entry["version"] != version:
+					entry = _lexical[site] = {"version": version, "index": build_lexical_index()}
+		entry["checked_at"] = now
+	return entry["index"]
+
+
+def invalidate_lexical_index(doc=None, method=None, *args):
+	"""Item doc_events hook: rebuild the lexical index in every worker"""
+	frappe.cache().set_value(VERSION_KEY, frappe.generate_hash(length=10))
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+	"""Fuse ranked key lists: score(key) = sum of 1 / (k + rank), ranks from 1"""
+	scores = {}
+	for ranking in rankings:
+		for rank, key in enumerate(ranking, start=1):
+			scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+	return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+def vector_search(normalized, k=CANDIDATES):
+	"""Knowledge chunks for a query, with the (template) item each describes"""
+	embedder = get_embedder()
+	hits = ann_index.search(embedder.model_name, embed_query(embedder, normalized), k)
+	if not hits:
+		return []
+
+	documents = {
+		row.name: row
+		for row in frappe.get_all(
+			KNOWLEDGE_DOCTYPE,
+			filters={"name": ("in", list({hit["source_document"] for hit in hits}))},
+			fields=["name", "product_name", "item"],
+		)
+	}
+	item_codes = list({row.item for row in documents.values() if row.item})
+	templates = {}
+	if item_codes:
+		templates = dict(
+			frappe.get_all(
+				"Item",
+				filters={"item_code": ("in", item_codes)},
+				fields=["item_code", "variant_of"],
+				as_list=True,
+			)
+		)
+
+	chunks = []
+	for hit in hits:
+		document = documents.get(hit["source_document"])
+		if document:
+			chunks.append(
+				{
+					"source_document": hit["source_document"],
+					"product_name": document.product_name,
+					"item": (templates.get(document.item) or document.item) if document.item else None,
+					"chunk_text": hit["chunk_text"],
+					"score": round(hit["score"], 4),
+				}
+			)
+	return chunks
+
+
+def _submit(fn, *args):
+	# Run in a worker thread with the caller's frappe.local (site, db, cache)
+	return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def search(query, k=10, lexical_candidates=CANDIDATES):
+	"""
+	Fused ranking for a query: [{key, item_code, score, lexical_rank,
+	vector_rank, chunks}], best first. `key` is the item code, or the
+	knowledge document for chunks not linked to an item.
+	"""
+	normalized = normalize_query(query)
+	if not normalized:
+		return []
+
+	cache_key = f"{RESULT_CACHE_PREFIX}{hashlib.sha256(f'{normalized}|{k}|{lexical_candidates}'.encode()).hexdigest()}"
+	cached = frappe.cache().get_value(cache_key)
+	if cached is not None:
+		return cached
+
+	# Loaded here: building it queries the database, which the vector thread also uses
+	lexical_index = get_lexical_index()
+	lexical_future = _submit(lexical_index.search, normalized, lexical_candidates)
+	vector_future = _submit(vector_search, normalized, CANDIDATES)
+	lexical = [code for code, _ in lexical_future.result()]
+	try:
+		chunks = vector_future.result()
+	except ProviderError:
+		# Embedding provider down: lexical results alone are still useful
+		frappe.logger("ex_commerce.hybrid_search").exception("Vector retrieval failed")
+		chunks = []
+
+	chunks_by_key = {}
+	for chunk in chunks:
+		chunks_by_key.setdefault(chunk["item"] or chunk["source_document"], []).append(chunk)
+
+	lexical_ranks = {key: rank for rank, key in enumerate(lexical, start=1)}
+	vector_ranks = {key: rank for rank, key in enumerate(chunks_by_key, start=1)}
+	results = [
+		{
+			"key": key,
+			"item_code": key if key in lexical_ranks or chunks_by_key[key][0]["item"] else None,
+			"score": round(score, 6),
+			"lexical_rank": lexical_ranks.get(key),
+			"vector_rank": vector_ranks.get(key),
+			"chunks": chunks_by_key.get(key, []),
+		}
+		for key, score in reciprocal_rank_fusion([lexical, list(chunks_by_key)])[:k]
+	]
+
+	frappe.cache().set_value(cache_key, results, expires_in_sec=RESULT_CACHE_TTL)
+	return results
+
+
+def top_lexical_item(query):
+	"""Best lexical (BM25 or exact SKU) match for a query, or None; no database round trip"""
+	normalized = normalize_query(query)
+	results = get_lexical_index().search(normalized, 1) if normalized else []
+	return results[0][0] if results else None
+
+
+def search_item_codes(query, k=MAX_STOREFRONT_RESULTS):
+	"""Item codes for a storefront search, best first"""
+	return [result["item_code"] for result in search(query, k, lexical_candidates=k) if result["item_code"]]
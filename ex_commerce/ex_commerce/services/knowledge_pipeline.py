@@ -0,0 +1,425 @@
+"""
+Knowledge ingestion pipeline
+
+Product Knowledge Base edits are queued as Knowledge Update Queue rows and
+drained by background workers in priority order. For each document the
+pipeline extracts text from the description and attachments, splits it into
+overlapping chunks, hashes every chunk and only embeds chunks whose hash is
+new; chunks that disappeared are deleted. Editing one product therefore
+never re-embeds the rest of the knowledge base.
+
+Saves that do not change indexed content queue nothing. Each document keeps
+a content fingerprint (name, description and attachment hashes) and each
+attachment row its file hash, size and mtime; `update_fingerprints` reads
+the stored values in one query, re-hashes a file only when its size or mtime
+moved, and re-indexing is queued only if the fingerprint changed. Extracted
+attachment text is cached on disk by file hash, so unchanged attachments are
+not re-extracted. Queued updates are debounced: every save pushes the row's
+`not_before` out by DEBOUNCE_SECONDS (up to MAX_DEBOUNCE_SECONDS after the
+first), so a burst of saves becomes one update.
+
+A claimed row is leased until `not_before` (STALE_UPDATE_MINUTES ahead); a
+row still "In Progress" after that lost its worker and is claimed again.
+Failed updates are retried with exponential backoff until
+MAX_UPDATE_ATTEMPTS, after which the row stays "Failed".
+"""
+
+import hashlib
+import io
+import os
+import re
+
+import frappe
+from frappe.utils import add_to_date, get_datetime, now_datetime, strip_html_tags
+
+from ex_commerce.ex_commerce.services.answer_cache import invalidate_knowledge_document
+from ex_commerce.ex_commerce.services.embeddings import embed_in_batches, get_embedder
+from ex_commerce.ex_commerce.services.vector_store import add_embeddings
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+TEXT_EXTENSIONS = ("txt", "md", "csv", "json", "html", "htm")
+QUEUE_CLAIM_SIZE = 10
+PRIORITY_RANK = {"High": 0, "Medium": 1, "Low": 2}
+DRAIN_JOB_ID = "knowledge_update_queue_drain"
+DEBOUNCE_SECONDS = 30
+MAX_DEBOUNCE_SECONDS = 5 * 60
+MAX_UPDATE_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+# Rows stuck "In Progress" longer than this are assumed to have lost their worker
+STALE_UPDATE_MINUTES = 30
+TEXT_CACHE_DIR = "knowledge_text"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def extract_attachment_text(file_url):
+	"""Best-effort plain text for an attached file; unsupported types give ''"""
+	file_name = frappe.db.get_value("File", {"file_url": file_url}, "name")
+	if not file_name:
+		return ""
+
+	file_doc = frappe.get_doc("File", file_name)
+	extension = (file_doc.file_name or file_url).rsplit(".", 1)[-1].lower()
+
+	if extension == "pdf":
+		from pypdf import PdfReader
+
+		content = file_doc.get_content()
+		if isinstance(content, str):
+			content = content.encode("latin-1", errors="ignore")
+		reader = PdfReader(io.BytesIO(content))
+		return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+	if extension not in TEXT_EXTENSIONS:
+		frappe.logger().info(f"Knowledge pipeline: skipping unsupported attachment {file_url}")
+		return ""
+
+	content = file_doc.get_content()
+	if isinstance(content, bytes):
+		content = content.decode("utf-8", errors="ignore")
+	if extension in ("html", "htm"):
+		content = strip_html_tags(content)
+	return content
+
+
+def get_attachment_text(file_url, content_hash=None):
+	"""Attachment text, extracted once per file content (`content_hash`) and cached on disk"""
+	if not content_hash:
+		return extract_attachment_text(file_url)
+
+	cache_dir = frappe.get_site_path("private", TEXT_CACHE_DIR)
+	path = os.path.join(cache_dir, f"{content_hash}.txt")
+	if os.path.exists(path):
+		with open(path, encoding="utf-8") as f:
+			return f.read()
+
+	text = extract_attachment_text(file_url)
+	os.makedirs(cache_dir, exist_ok=True)
+	with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+		f.write(text)
+	os.replace(f"{path}.tmp", path)
+	return text
+
+
+def _local_file_path(file_url):
+	for prefix, folder in (("/private/files/", ("private", "files")), ("/files/", ("public", "files"))):
+		if file_url.startswith(prefix):
+			return frappe.get_site_path(*folder, file_url[len(prefix) :])
+	return None
+
+
+def _hash_file(path):
+	digest = hashlib.sha1()
+	with open(path, "rb") as f:
+		while block := f.read(HASH_BLOCK_SIZE):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def fingerprint_attachment(file_url, stored=None):
+	"""
+	(content_hash, size, mtime) for an attached file. The file is only read
+	when its size or mtime differ from `stored`; remote URLs hash the URL.
+	"""
+	path = _local_file_path(file_url)
+	if not path or not os.path.exists(path):
+		return hashlib.sha1(file_url.encode()).hexdigest(), 0, 0.0
+
+	stat = os.stat(path)
+	size, mtime = stat.st_size, round(stat.st_mtime, 6)
+	unchanged = stored and stored.file_size == size and abs((stored.file_mtime or 0) - mtime) < 1e-6
+	if unchanged and stored.content_hash:
+		return stored.content_hash, size, mtime
+	return _hash_file(path), size, mtime
+
+
+def get_stored_fingerprints(name):
+	"""(document fingerprint, {attachment url: stored row}) from one query"""
+	rows = frappe.db.sql(
+		"""
+		select kb.content_fingerprint, a.attachment, a.content_hash, a.file_size, a.file_mtime
+		from `tabProduct Knowledge Base` kb
+		left join `tabProduct Knowledge Attachment` a
+			on a.parent = kb.name and a.parenttype = 'Product Knowledge Base'
+		where kb.name = %(name)s
+		""",
+		{"name": name},
+		as_dict=True,
+	)
+	if not rows:
+		return None, {}
+	return rows[0].content_fingerprint, {row.attachment: row for row in rows if row.attachment}
+
+
+def update_fingerprints(doc):
+	"""
+	Refresh a Product Knowledge Base document's fingerprints in place (call
+	from validate). Returns True when its indexed content changed.
+	"""
+	stored_fingerprint, stored_attachments = (None, {}) if doc.is_new() else get_stored_fingerprints(doc.name)
+
+	parts = [doc.product_name or "", doc.description or ""]
+	for attachment in doc.documents or []:
+		if not attachment.attachment:
+			continue
+		attachment.content_hash, attachment.file_size, attachment.file_mtime = fingerprint_attachment(
+			attachment.attachment, stored_attachments.get(attachment.attachment)
+		)
+		parts.append(attachment.content_hash)
+
+	doc.content_fingerprint = hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+	return doc.content_fingerprint != stored_fingerprint
+
+
+def split_into_chunks(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+	"""
+	Split text into ~`size` character chunks on paragraph/sentence boundaries,
+	carrying `overlap` characters of context into the next chunk.
+	"""
+	text = re.sub(r"[ \t]+", " ", text or "").strip()
+	if not text:
+		return []
+
+	pieces = []
+	for paragraph in re.split(r"\n\s*\n", text):
+		paragraph = paragraph.strip()
+		if len(paragraph) <= size:
+			if paragraph:
+				pieces.append(paragraph)
+			continue
+		# Long paragraphs: fall back to sentences, then hard cuts
+		for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+			while len(sentence) > size:
+				pieces.append(sentence[:size])
+				sentence = sentence[size:]
+			if sentence:
+				pieces.append(sentence)
+
+	chunks = []
+	current = ""
+	for piece in pieces:
+		if current and len(current) + len(piece) + 1 > size:
+			chunks.append(current)
+			current = current[-overlap:].lstrip() if overlap else ""
+		current = f"{current} {piece}".strip() if current else piece
+	if current:
+		chunks.append(current)
+	return chunks
+
+
+def hash_chunk(text):
+	return hashlib.sha1(" ".join(text.split()).lower().encode()).hexdigest()
+
+
+def get_document_chunks(doc):
+	"""Ordered, de-duplicated chunks for a Product Knowledge Base document"""
+	texts = [f"{doc.product_name}\n\n{strip_html_tags(doc.description or '')}"]
+	for attachment in doc.documents or []:
+		if attachment.attachment:
+			texts.append(get_attachment_text(attachment.attachment, attachment.content_hash))
+
+	chunks = {}
+	for text in texts:
+		for chunk in split_into_chunks(text):
+			chunks.setdefault(hash_chunk(chunk), chunk)
+	return chunks
+
+
+def index_knowledge_document(name, embedder=None):
+	"""
+	Bring a document's embeddings in line with its current content.
+
+	Returns {"added", "kept", "removed"} chunk counts.
+	"""
+	from ex_commerce.ex_commerce.services.ann_index import remove_source_document
+
+	if not frappe.db.exists("Product Knowledge Base", name):
+		remove_source_document(name)
+		return {"added": 0, "kept": 0, "removed": 0}
+
+	embedder = embedder or get_embedder()
+	doc = frappe.get_doc("Product Knowledge Base", name)
+	chunks = get_document_chunks(doc)
+	order = {chunk_hash: idx for idx, chunk_hash in enumerate(chunks)}
+
+	existing = frappe.get_all(
+		"Embedding Index",
+		filters={"source_document": name},
+		fields=["name", "model_name", "chunk_hash", "chunk_index"],
+	)
+
+	kept = set()
+	removed = 0
+	for row in existing:
+		# Rows from a previous embedding model, or for text that is gone, are dropped
+		if row.model_name != embedder.model_name or row.chunk_hash not in order or row.chunk_hash in kept:
+			frappe.delete_doc("Embedding Index", row.name, ignore_permissions=True)
+			removed += 1
+			continue
+
+		kept.add(row.chunk_hash)
+		if row.chunk_index != order[row.chunk_hash]:
+			frappe.db.set_value("Embedding Index", row.name, "chunk_index", order[row.chunk_hash])
+
+	new_hashes = [chunk_hash for chunk_hash in chunks if chunk_hash not in kept]
+	if new_hashes:
+		vectors = embed_in_batches(embedder, [chunks[h] for h in new_hashes])
+		add_embeddings(
+			embedder.model_name,
+			vectors,
+			source_documents=[name] * len(new_hashes),
+			extra_fields=[
+				{"chunk_hash": h, "chunk_index": order[h], "chunk_text": chunks[h]} for h in new_hashes
+			],
+		)
+
+	if new_hashes or removed:
+		# Cached answers quoted the old excerpts
+		invalidate_knowledge_document(name, (doc.item,))
+	return {"added": len(new_hashes), "kept": len(kept), "removed": removed}
+
+
+def enqueue_knowledge_update(name, priority="Medium"):
+	"""
+	Queue a re-index of one knowledge document (at most one pending row per
+	document). Each call pushes the row's `not_before` out by DEBOUNCE_SECONDS,
+	capped at MAX_DEBOUNCE_SECONDS after the row was created; High priority
+	updates are not debounced.
+	"""
+	pending = frappe.db.get_value(
+		"Knowledge Update Queue",
+		{"knowledge_document": name, "status": "Pending"},
+		["name", "priority", "created_at"],
+		as_dict=True,
+	)
+	if pending and PRIORITY_RANK[priority] >= PRIORITY_RANK.get(pending.priority, 1):
+		priority = pending.priority
+
+	now = now_datetime()
+	not_before = now if priority == "High" else add_to_date(now, seconds=DEBOUNCE_SECONDS)
+	if pending:
+		if pending.created_at:
+			latest = add_to_date(get_datetime(pending.created_at), seconds=MAX_DEBOUNCE_SECONDS)
+			not_before = min(not_before, latest)
+		frappe.db.set_value(
+			"Knowledge Update Queue", pending.name, {"priority": priority, "not_before": not_before}
+		)
+		queue_name = pending.name
+	else:
+		queue_doc = frappe.get_doc(
+			{
+				"doctype": "Knowledge Update Queue",
+				"task_description": f"Re-index {name}",
+				"knowledge_document": name,
+				"priority": priority,
+				"status": "Pending",
+				"created_at": now,
+				"not_before": not_before,
+			}
+		)
+		queue_doc.flags.ignore_permissions = True
+		queue_doc.insert()
+		queue_name = queue_doc.name
+
+	# Debounced rows are picked up by the minutely scheduler once due
+	if priority == "High":
+		frappe.enqueue(
+			"ex_commerce.ex_commerce.services.knowledge_pipeline.process_pending_updates",
+			queue="long",
+			job_id=DRAIN_JOB_ID,
+			deduplicate=True,
+			enqueue_after_commit=True,
+		)
+	return queue_name
+
+
+def claim_pending_updates(limit=QUEUE_CLAIM_SIZE):
+	"""
+	Atomically claim the highest-priority due rows: pending ones, failed ones
+	whose backoff has elapsed, and stale "In Progress" ones. SKIP LOCKED lets
+	several workers drain the queue in parallel without double-processing.
+	"""
+	now = now_datetime()
+	rows = frappe.db.sql(
+		"""
+		select name, knowledge_document, attempts
+		from `tabKnowledge Update Queue`
+		where (
+			(status = 'Pending' and (not_before is null or not_before <= %(now)s))
+			or (
+				status = 'Failed'
+				and attempts < %(max_attempts)s
+				and (not_before is null or not_before <= %(now)s)
+			)
+			or (status = 'In Progress' and (not_before is null or not_before <= %(now)s))
+		)
+		order by field(priority, 'High', 'Medium', 'Low'), created_at
+		limit %(limit)s
+		for update skip locked
+		""",
+		{"limit": limit, "now": now, "max_attempts": MAX_UPDATE_ATTEMPTS},
+		as_dict=True,
+	)
+	if rows:
+		frappe.db.sql(
+			"""update `tabKnowledge Update Queue`
+			set status = 'In Progress', attempts = attempts + 1, not_before = %(lease)s, modified = %(now)s
+			where name in %(names)s""",
+			{
+				"names": tuple(row.name for row in rows),
+				"lease": add_to_date(now, minutes=STALE_UPDATE_MINUTES),
+				"now": now,
+			},
+		)
+		for row in rows:
+			row.attempts = (row.attempts or 0) + 1
+	frappe.db.commit()
+	return rows
+
+
+def process_pending_updates(max_batches=50):
+	"""Worker/scheduler entry point: drain the Knowledge Update Queue"""
+	embedder = get_embedder()
+	processed = 0
+
+	for _ in range(max_batches):
+		rows = claim_pending_updates()
+		if not rows:
+			break
+
+		for row in rows:
+			try:
+				if row.knowledge_document:
+					index_knowledge_document(row.knowledge_document, embedder=embedder)
+				frappe.db.set_value(
+					"Knowledge Update Queue", row.name, {"status": "Completed", "error": None}
+				)
+				frappe.db.commit()
+			except Exception as e:
+				frappe.db.rollback()
+				frappe.log_error(f"Knowledge update failed for {row.knowledge_document}: {e!s}")
+				record_failure(row.name, row.attempts, str(e))
+			processed += 1
+
+	return processed
+
+
+def record_failure(queue_name, attempts, error):
+	"""Mark the row Failed and schedule the next retry with exponential backoff"""
+	next_retry = None
+	if attempts < MAX_UPDATE_ATTEMPTS:
+		delay = min(BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX_SECONDS)
+		next_retry = add_to_date(now_datetime(), seconds=delay)
+
+	frappe.db.set_value(
+		"Knowledge Update Queue",
+		queue_name,
+		{"status": "Failed", "not_before": next_retry, "error": (error or "Unknown error")[:1000]},
+	)
+	frappe.db.commit()
+
+
+def run_queue_task(task):
+	"""Queue Task handler for task_type "Embedding": payload {"knowledge_document": name}"""
+	index_knowledge_document(task.payload["knowledge_document"])
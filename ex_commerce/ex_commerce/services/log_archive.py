@@ -0,0 +1,175 @@
+"""
+Retention and archival for chat logs
+
+Rows of AI Message Log and AI Feedback Log older than the retention window
+are moved into compressed monthly JSONL archives under
+`<site>/private/log_archive/<doctype>/<YYYY-MM>.jsonl.gz` and deleted from the
+database in batches. `query_logs` reads the live table and any archived
+months that overlap the requested range, so old conversations stay
+reachable.
+
+The retention window defaults to DEFAULT_RETENTION_DAYS and can be set per
+site with `ex_commerce_log_retention_days` in site_config.
+"""
+
+import gzip
+import json
+import os
+import time
+
+import frappe
+from frappe.utils import add_days, add_months, get_datetime, getdate, now_datetime
+
+ARCHIVED_DOCTYPES = ("AI Message Log", "AI Feedback Log")
+ARCHIVE_DIR = "log_archive"
+DEFAULT_RETENTION_DAYS = 180
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_TIME_BUDGET_SECONDS = 600
+
+
+def get_retention_days():
+	return int(frappe.conf.get("ex_commerce_log_retention_days") or DEFAULT_RETENTION_DAYS)
+
+
+def get_cutoff():
+	return add_days(now_datetime(), -get_retention_days())
+
+
+def get_archive_dir(doctype):
+	path = frappe.get_site_path("private", ARCHIVE_DIR, frappe.scrub(doctype))
+	os.makedirs(path, exist_ok=True)
+	return path
+
+
+def get_archive_path(doctype, month):
+	return os.path.join(get_archive_dir(doctype), f"{month}.jsonl.gz")
+
+
+def _write_month(doctype, month, rows):
+	# Each append adds a new gzip member; readers see one continuous stream
+	with gzip.open(get_archive_path(doctype, month), "at", encoding="utf-8") as f:
+		for row in rows:
+			f.write(json.dumps(row, default=str))
+			f.write("\n")
+		f.flush()
+		os.fsync(f.fileno())
+
+
+def archive_doctype(doctype, cutoff=None, batch_size=ARCHIVE_BATCH_SIZE, deadline=None):
+	"""Move rows created before `cutoff` into monthly archives; returns rows archived"""
+	cutoff = cutoff or get_cutoff()
+	archived = 0
+
+	while deadline is None or time.monotonic() < deadline:
+		rows = frappe.db.sql(
+			f"""
+			select *
+			from `tab{doctype}`
+			where created_at < %(cutoff)s
+			order by created_at
+			limit %(limit)s
+			""",
+			{"cutoff": cutoff, "limit": batch_size},
+			as_dict=True,
+		)
+		if not rows:
+			break
+
+		by_month = {}
+		for row in rows:
+			by_month.setdefault(get_datetime(row.created_at).strftime("%Y-%m"), []).append(row)
+
+		# Write before delete: a crash in between only duplicates rows in the
+		# archive (query_logs de-duplicates by name), it never loses them
+		for month, month_rows in by_month.items():
+			_write_month(doctype, month, month_rows)
+
+		frappe.db.sql(
+			f"delete from `tab{doctype}` where name in %(names)s",
+			{"names": tuple(row.name for row in rows)},
+		)
+		frappe.db.commit()
+		archived += len(rows)
+
+	return archived
+
+
+def archive_old_logs():
+	"""Scheduler job: archive every log doctype past the retention window"""
+	cutoff = get_cutoff()
+	deadline = time.monotonic() + ARCHIVE_TIME_BUDGET_SECONDS
+	for doctype in ARCHIVED_DOCTYPES:
+		archived = archive_doctype(doctype, cutoff=cutoff, deadline=deadline)
+		if archived:
+			frappe.logger().info(f"Archived {archived} {doctype} rows created before {cutoff}")
+
+
+def _months_between(from_date, to_date):
+	month = getdate(from_date).replace(day=1)
+	last = getdate(to_date).replace(day=1)
+	while month <= last:
+		yield month.strftime("%Y-%m")
+		month = add_months(month, 1)
+
+
+def read_archive(doctype, month, customer=None, from_date=None, to_date=None):
+	path = get_archive_path(doctype, month)
+	if not os.path.exists(path):
+		return
+
+	with gzip.open(path, "rt", encoding="utf-8") as f:
+		for line in f:
+			row = frappe._dict(json.loads(line))
+			if customer and row.customer != customer:
+				continue
+			created_at = get_datetime(row.created_at)
+			if from_date and created_at < from_date:
+				continue
+			if to_date and created_at > to_date:
+				continue
+			yield row
+
+
+def query_logs(doctype, customer=None, from_date=None, to_date=None, limit=100):
+	"""
+	Rows from the live table and the archives, newest first.
+
+	Archives are only opened for months that overlap [from_date, to_date]
+	and fall before the retention cutoff.
+	"""
+	if doctype not in ARCHIVED_DOCTYPES:
+		frappe.throw(f"{doctype} is not archived")
+
+	from_date = get_datetime(from_date) if from_date else None
+	to_date = get_datetime(to_date) if to_date else now_datetime()
+
+	filters = {}
+	if customer:
+		filters["customer"] = customer
+	if from_date:
+		filters["created_at"] = ["between", [from_date, to_date]]
+	else:
+		filters["created_at"] = ["<=", to_date]
+
+	rows = frappe.get_all(doctype, filters=filters, fields=["*"], order_by="created_at desc", limit=limit)
+
+	cutoff = get_cutoff()
+	if len(rows) < limit and (from_date is None or from_date < cutoff):
+		archive_dir = get_archive_dir(doctype)
+		months = sorted(f[: -len(".jsonl.gz")] for f in os.listdir(archive_dir) if f.endswith(".jsonl.gz"))
+		if from_date:
+			wanted = set(_months_between(from_date, min(to_date, cutoff)))
+			months = [m for m in months if m in wanted]
+
+		# Archived months are all older than the live rows, newest month first
+		seen = {row.name for row in rows}
+		for month in reversed(months):
+			for row in read_archive(doctype, month, customer, from_date, to_date):
+				if row.name not in seen:
+					seen.add(row.name)
+					rows.append(row)
+			if len(rows) >= limit:
+				break
+
+	rows.sort(key=lambda r: get_datetime(r.created_at), reverse=True)
+	return rows[:limit]
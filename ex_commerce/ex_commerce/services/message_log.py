@@ -0,0 +1,182 @@
+"""
+Buffered writer for AI Message Log
+
+Chat traffic is too hot for one `Document.insert()` per message. Messages
+are staged in a Redis list shared by all workers and written with multi-row
+INSERTs by a deduplicated flush job, enqueued when the first message of a
+batch arrives and again whenever FLUSH_BATCH_SIZE more are waiting. A
+minutely scheduler flush is the safety net. Callers never flush inline: the
+flush commits (and on error rolls back) its own transaction.
+
+Pass `durable=True` to write the row in the current transaction instead,
+for messages that must not be lost if Redis is flushed.
+"""
+
+import json
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+
+from ex_commerce.ex_commerce.services.context_cache import record_message
+from ex_commerce.ex_commerce.services.webhook_dispatcher import dispatch_event
+
+DOCTYPE = "AI Message Log"
+BUFFER_KEY = "ex_commerce:message_log_buffer"
+FLUSH_BATCH_SIZE = 200
+FLUSH_JOB_ID = "ai_message_log_flush"
+MAX_FLUSH_BATCHES = 50
+# AI Webhook Event name that subscribes endpoints to logged chat messages
+CHAT_MESSAGE_WEBHOOK = "chat_message"
+
+FIELDS = (
+	"name",
+	"creation",
+	"modified",
+	"modified_by",
+	"owner",
+	"docstatus",
+	"message_id",
+	"customer",
+	"direction",
+	"content",
+	"channel",
+	"response_to",
+	"created_at",
+)
+
+
+def _buffer_key():
+	return frappe.cache().make_key(BUFFER_KEY)
+
+
+def build_row(message_id, content, customer=None, direction="Incoming", channel="WhatsApp", response_to=None):
+	now = str(now_datetime())
+	user = frappe.session.user if getattr(frappe.local, "session", None) else "Administrator"
+	return {
+		"name": frappe.generate_hash(length=10),
+		"creation": now,
+		"modified": now,
+		"modified_by": user,
+		"owner": user,
+		"docstatus": 0,
+		"message_id": message_id,
+		"customer": customer,
+		"direction": direction,
+		"content": content,
+		"channel": channel,
+		"response_to": response_to,
+		"created_at": now,
+	}
+
+
+def log_message(
+	message_id,
+	content,
+	customer=None,
+	direction="Incoming",
+	channel="WhatsApp",
+	response_to=None,
+	durable=False,
+):
+	"""
+	Record a chat message. Returns the AI Message Log name, which is assigned
+	up front so replies can reference it via `response_to` before the flush.
+	"""
+	row = build_row(message_id, content, customer, direction, channel, response_to)
+	record_message(row)
+	dispatch_event(CHAT_MESSAGE_WEBHOOK, row, DOCTYPE, row["name"])
+
+	if durable:
+		_insert_rows([row])
+		return row["name"]
+
+	pipe = frappe.cache().pipeline()
+	pipe.rpush(_buffer_key(), json.dumps(row))
+	(pending,) = pipe.execute()
+
+	# First message of a new batch (flush soon even if traffic stays low), or a
+	# full batch waiting; a flush job that is already queued takes them all
+	if pending == 1 or pending % FLUSH_BATCH_SIZE == 0:
+		frappe.enqueue(
+			"ex_commerce.ex_commerce.services.message_log.flush",
+			queue="short",
+			job_id=FLUSH_JOB_ID,
+			deduplicate=True,
+		)
+
+	return row["name"]
+
+
+def _pop_batch(size=FLUSH_BATCH_SIZE):
+	"""Atomically take up to `size` staged rows off the buffer"""
+	pipe = frappe.cache().pipeline()
+	pipe.lrange(_buffer_key(), 0, size - 1)
+	pipe.ltrim(_buffer_key(), size, -1)
+	raw_rows, _ = pipe.execute()
+	return [json.loads(raw) for raw in raw_rows]
+
+
+def _requeue(rows):
+	"""Put rows back at the head of the buffer after a failed flush"""
+	if rows:
+		frappe.cache().pipeline().lpush(_buffer_key(), *[json.dumps(r) for r in reversed(rows)]).execute()
+
+
+def _insert_rows(rows):
+	frappe.db.bulk_insert(
+		DOCTYPE,
+		fields=list(FIELDS),
+		values=[tuple(row.get(field) for field in FIELDS) for row in rows],
+		ignore_duplicates=True,
+	)
+
+
+def flush(max_batches=MAX_FLUSH_BATCHES):
+	"""Write staged messages with multi-row INSERTs; returns the number written"""
+	written = 0
+	for _ in range(max_batches):
+		rows = _pop_batch()
+		if not rows:
+			break
+		try:
+			_insert_rows(rows)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			_requeue(rows)
+			raise
+		written += len(rows)
+	return written
+
+
+def get_customer_messages(customer, before=None, before_name=None, limit=50):
+	"""
+	Messages for a customer, newest first, paginated by (created_at, name).
+
+	Pass the last row's `created_at` and `name` as `before`/`before_name` to
+	get the next page. Served by the (customer, created_at) index.
+	"""
+	conditions = ["customer = %(customer)s"]
+	params = {"customer": customer, "limit": limit}
+
+	if before:
+		params["before"] = get_datetime(before)
+		if before_name:
+			conditions.append(
+				"(created_at < %(before)s or (created_at = %(before)s and name < %(before_name)s))"
+			)
+			params["before_name"] = before_name
+		else:
+			conditions.append("created_at < %(before)s")
+
+	return frappe.db.sql(
+		f"""
+		select name, message_id, customer, direction, content, channel, response_to, created_at
+		from `tabAI Message Log`
+		where {" and ".join(conditions)}
+		order by created_at desc, name desc
+		limit %(limit)s
+		""",
+		params,
+		as_dict=True,
+	)
@@ -0,0 +1,122 @@
+"""
+Local mock AI provider
+
+An OpenAI-compatible HTTP server for offline development and CI: point AI
+Provider Settings at it and AIClient works without network access.
+
+- POST /embeddings: HashingEmbedder vectors (deterministic)
+- POST /chat/completions: echoes the last user message, as server-sent
+  events when `stream` is set
+- models whose name starts with "fail-" answer 503, to exercise fallback
+
+Run it with `bench execute ex_commerce.ex_commerce.services.mock_provider.serve`
+or start one in-process with `start_mock_provider()`.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ex_commerce.ex_commerce.services.embeddings import HashingEmbedder
+
+DEFAULT_PORT = 8765
+EMBEDDING_DIMENSIONS = 64
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_POST(self):
+		payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+		model = payload.get("model") or ""
+		self.server.requests.append((self.path, payload))
+
+		if model.startswith("fail-"):
+			return self._respond(503, {"error": {"message": f"{model} is unavailable"}})
+		if self.path.endswith("/embeddings"):
+			return self._respond(200, self._embeddings(payload))
+		if self.path.endswith("/chat/completions") and payload.get("stream"):
+			return self._stream(self._completion(payload))
+		if self.path.endswith("/chat/completions"):
+			return self._respond(200, self._completion(payload))
+		return self._respond(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+	def _embeddings(self, payload):
+		texts = payload.get("input") or []
+		if isinstance(texts, str):
+			texts = [texts]
+		vectors = self.server.embedder.embed(texts)
+		return {
+			"object": "list",
+			"model": payload.get("model"),
+			"data": [
+				{"object": "embedding", "index": i, "embedding": vector.tolist()}
+				for i, vector in enumerate(vectors)
+			],
+			"usage": {"prompt_tokens": sum(len(t.split()) for t in texts)},
+		}
+
+	def _completion(self, payload):
+		user_messages = [
+			m.get("content") or "" for m in payload.get("messages") or [] if m.get("role") == "user"
+		]
+		content = f"Echo: {user_messages[-1]}" if user_messages else "Hello"
+		return {
+			"object": "chat.completion",
+			"model": payload.get("model"),
+			"choices": [
+				{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+			],
+			"usage": {"completion_tokens": len(content.split())},
+		}
+
+	def _stream(self, completion):
+		"""Send the completion word by word as server-sent events, then close"""
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.send_header("Connection", "close")
+		self.end_headers()
+		self.close_connection = True
+
+		content = completion["choices"][0]["message"]["content"]
+		for i, word in enumerate(content.split(" ")):
+			chunk = {
+				"object": "chat.completion.chunk",
+				"model": completion["model"],
+				"choices": [{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}}],
+			}
+			self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+			self.wfile.flush()
+		self.wfile.write(b"data: [DONE]\n\n")
+
+	def _respond(self, status, body):
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, *args):
+		pass
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT):
+	server = ThreadingHTTPServer((host, port), MockProviderHandler)
+	server.daemon_threads = True
+	server.embedder = HashingEmbedder(dim=EMBEDDING_DIMENSIONS)
+	server.requests = []
+	return server
+
+
+def start_mock_provider(host="127.0.0.1", port=0):
+	"""Start a mock provider in a daemon thread; returns (server, base_url)"""
+	server = make_server(host, port)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, f"http://{host}:{server.server_port}"
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT):
+	server = make_server(host, int(port))
+	print(f"Mock AI provider listening on http://{host}:{server.server_port}")
+	server.serve_forever()
@@ -0,0 +1,215 @@
+"""
+AI model resolution
+
+AI Model Registry describes one primary model in its own fields plus any
+number of further models in its `models` table. Everything that needs a
+model goes through `get_models(capability)`, which returns the active
+models for a capability with the default first and the rest in priority
+order - the order fallback walks them in.
+
+Resolutions are cached per process and site. Saving the registry bumps a
+version in Redis; workers compare against it at most every
+VERSION_CHECK_SECONDS, so a lookup is normally a dict hit.
+
+Local models ("Lightweight LLM" with a model_path) are loaded once per
+process and shared by all its threads. `.npy` weights are memory-mapped and
+other files are mapped read-only as raw bytes, so the OS page cache also
+shares them between worker processes; `.npz` archives cannot be mapped and
+are read into memory. Apps can add loaders per file extension with the
+`local_model_loaders` hook. `ensure_warm` (a before_request hook) loads
+them in a background thread the first time a web process serves a site, so
+the first reply after a deploy does not pay for it. It is not run before
+jobs: workers fork a child per job, which would load and drop the models
+every time.
+"""
+
+import mmap
+import os
+import threading
+import time
+
+import frappe
+import numpy as np
+
+DOCTYPE = "AI Model Registry"
+CAPABILITIES = ("Chat", "Embedding")
+LOCAL_MODEL_TYPES = ("Lightweight LLM",)
+DEFAULT_EMBEDDING_BATCH_SIZE = 64
+VERSION_KEY = "ex_commerce:model_registry_version"
+VERSION_CHECK_SECONDS = 5
+
+MODEL_FIELDS = (
+	"model_name",
+	"model_type",
+	"capability",
+	"model_path",
+	"default_model",
+	"active",
+	"priority",
+	"requests_per_minute",
+	"batch_size",
+)
+
+# site -> {"version", "checked_at", "models": {(capability, model_type): [model]}}
+_resolved = {}
+# (site, model_name) -> LocalModel
+_local_models = {}
+_load_lock = threading.Lock()
+_warm_sites = set()
+
+
+def _as_model(row, priority=None):
+	model = frappe._dict({field: row.get(field) for field in MODEL_FIELDS})
+	model.capability = model.capability or "Chat"
+	model.priority = model.priority if priority is None else priority
+	model.batch_size = model.batch_size or DEFAULT_EMBEDDING_BATCH_SIZE
+	return model
+
+
+def get_registered_models():
+	"""All models in the registry, primary first"""
+	registry = frappe.get_cached_doc(DOCTYPE)
+	models = []
+	if registry.model_name:
+		# The primary model sorts ahead of table rows with the same flags
+		models.append(_as_model(registry, priority=-1))
+	models.extend(_as_model(row) for row in registry.get("models") or [])
+	return models
+
+
+def _site_cache():
+	site = frappe.local.site
+	entry = _resolved.get(site)
+	now = time.monotonic()
+	if entry is None or now - entry["checked_at"] > VERSION_CHECK_SECONDS:
+		version = frappe.cache().get_value(VERSION_KEY)
+		if entry is None or entry["version"] != version:
+			entry = _resolved[site] = {"version": version, "models": {}}
+		entry["checked_at"] = now
+	return entry["models"]
+
+
+def get_models(capability, model_type=None):
+	"""Active models for `capability`, default first, then by priority. Do not mutate."""
+	cache = _site_cache()
+	key = (capability, model_type)
+	models = cache.get(key)
+	if models is None:
+		models = [
+			model
+			for model in get_registered_models()
+			if model.active
+			and model.capability == capability
+			and (model_type is None or model.model_type == model_type)
+		]
+		models.sort(key=lambda m: (not m.default_model, m.priority or 0))
+		cache[key] = models
+	return models
+
+
+def get_model(capability, model_name=None, model_type=None):
+	"""The named model, or the default for `capability`; None when there is none"""
+	for model in get_models(capability, model_type):
+		if model_name is None or model.model_name == model_name:
+			return model
+	return None
+
+
+def invalidate():
+	"""Drop cached resolutions in every worker (called when the registry is saved)"""
+	frappe.cache().set_value(VERSION_KEY, frappe.generate_hash(length=10))
+	invalidate_local()
+
+
+def invalidate_local():
+	"""Drop this process's cached resolutions for the current site"""
+	_resolved.pop(frappe.local.site, None)
+
+
+class LocalModel:
+	def __init__(self, name, path, weights):
+		self.name = name
+		self.path = path
+		self.mtime = os.path.getmtime(path)
+		self.weights = weights
+		self.loaded_at = time.time()
+
+
+def resolve_model_path(model_path):
+	"""Absolute path for a registry model_path; relative paths are under the site folder"""
+	return model_path if os.path.isabs(model_path) else os.path.abspath(frappe.get_site_path(model_path))
+
+
+def load_npy(path):
+	return np.load(path, mmap_mode="r")
+
+
+def load_npz(path):
+	with np.load(path) as archive:
+		return {name: archive[name] for name in archive.files}
+
+
+def map_file(path):
+	with open(path, "rb") as f:
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+DEFAULT_LOADERS = {".npy": load_npy, ".npz": load_npz}
+
+
+def load_weights(path):
+	loaders = dict(DEFAULT_LOADERS)
+	for extension, loaders_for_ext in (frappe.get_hooks("local_model_loaders") or {}).items():
+		loaders[extension.lower()] = frappe.get_attr(loaders_for_ext[-1])
+	return loaders.get(os.path.splitext(path)[1].lower(), map_file)(path)
+
+
+def get_local_model(model):
+	"""Loaded weights for a local registry model, shared by every thread of this process"""
+	if isinstance(model, str):
+		model = get_model("Chat", model) or get_model("Embedding", model)
+	if not (model and model.model_path):
+		return None
+
+	path = resolve_model_path(model.model_path)
+	key = (frappe.local.site, model.model_name)
+	loaded = _local_models.get(key)
+	if loaded is not None and loaded.path == path and loaded.mtime == os.path.getmtime(path):
+		return loaded
+
+	with _load_lock:
+		loaded = _local_models.get(key)
+		if loaded is None or loaded.path != path or loaded.mtime != os.path.getmtime(path):
+			loaded = _local_models[key] = LocalModel(model.model_name, path, load_weights(path))
+	return loaded
+
+
+def warm_up():
+	"""Load every active local model for the current site"""
+	for capability in CAPABILITIES:
+		for model in get_models(capability):
+			if model.model_type not in LOCAL_MODEL_TYPES or not model.model_path:
+				continue
+			try:
+				get_local_model(model)
+			except Exception:
+				frappe.log_error(title=f"Could not load local model {model.model_name}")
+
+
+def ensure_warm():
+	"""before_request hook: start loading local models once per process and site"""
+	site = getattr(frappe.local, "site", None)
+	if not site or site in _warm_sites:
+		return
+	_warm_sites.add(site)
+	threading.Thread(target=_warm_site, args=(site, frappe.local.sites_path), daemon=True).start()
+
+
+def _warm_site(site, sites_path):
+	frappe.init(site=site, sites_path=sites_path)
+	try:
+		frappe.connect()
+		warm_up()
+		frappe.db.commit()
+	finally:
+		frappe.destroy()
@@ -0,0 +1,105 @@
+"""
+Order status change feed
+
+Sales Order status changes are published to the document's realtime room
+(`doc:Sales Order/<name>`) through Frappe's socket.io integration and to
+webhook subscribers of ORDER_STATUS_WEBHOOK, and the latest status per
+order is kept in Redis so the long-poll fallback in
+api/orders.py can wait for a change without touching the database.
+
+Only document events publish and dispatch webhooks. The long-poll may
+refresh the snapshot from the database, but that never counts as a
+published status, so the next document event is still sent.
+"""
+
+import frappe
+from frappe.utils import now_datetime
+
+from ex_commerce.ex_commerce.services.webhook_dispatcher import dispatch_event
+
+ORDER_STATUS_EVENT = "ex_commerce_order_status"
+# AI Webhook Event name that subscribes endpoints to order status changes
+ORDER_STATUS_WEBHOOK = "order_status_changed"
+STATUS_CACHE_PREFIX = "ex_commerce:order_status:"
+STATUS_CACHE_TTL = 24 * 60 * 60
+
+
+def get_cache_key(doctype, name):
+	return f"{STATUS_CACHE_PREFIX}{doctype}:{name}"
+
+
+def get_status_snapshot(doctype, name):
+	"""Return the cached {status, seq, ...} snapshot for an order, or None"""
+	return frappe.cache().get_value(get_cache_key(doctype, name))
+
+
+def refresh_status_snapshot(doctype, name, status):
+	"""
+	Bring the cached snapshot in line with a status read from the database,
+	without publishing anything. For read-only callers (the long-poll), which
+	may see the first status of an order or one set without document events.
+	"""
+	key = get_cache_key(doctype, name)
+	previous = frappe.cache().get_value(key) or {}
+	if previous.get("status") == status:
+		return previous
+
+	snapshot = {
+		**previous,
+		"doctype": doctype,
+		"name": name,
+		"status": status,
+		"seq": (previous.get("seq") or 0) + 1,
+		"changed_at": str(now_datetime()),
+	}
+	frappe.cache().set_value(key, snapshot, expires_in_sec=STATUS_CACHE_TTL)
+	return snapshot
+
+
+def publish_order_status(doctype, name, status, **extra):
+	"""
+	Publish a status change for an order to its realtime room, after commit.
+	Returns the new snapshot, or None if the status is the same as the last
+	published one.
+	"""
+	key = get_cache_key(doctype, name)
+	previous = frappe.cache().get_value(key) or {}
+	if previous.get("published_status") == status and all(previous.get(k) == v for k, v in extra.items()):
+		return None
+
+	snapshot = {
+		"doctype": doctype,
+		"name": name,
+		"status": status,
+		"seq": (previous.get("seq") or 0) + 1,
+		"changed_at": str(now_datetime()),
+		**extra,
+	}
+	frappe.cache().set_value(key, {**snapshot, "published_status": status}, expires_in_sec=STATUS_CACHE_TTL)
+
+	frappe.publish_realtime(ORDER_STATUS_EVENT, snapshot, doctype=doctype, docname=name, after_commit=True)
+	return snapshot
+
+
+def on_sales_order_change(doc, method=None):
+	"""doc_events handler for ERPNext Sales Order: realtime feed and webhooks"""
+	snapshot = publish_order_status("Sales Order", doc.name, doc.status)
+	if not snapshot:
+		return
+	dispatch_event(ORDER_STATUS_WEBHOOK, snapshot, "Sales Order", doc.name)
+
+	# Fan out to the Ex Commerce orders this Sales Order was created from
+	linked_orders = frappe.get_all(
+		"Ex Commerce Sales Order",
+		filters={"erpnext_sales_order": doc.name},
+		pluck="name",
+	)
+	for order_name in linked_orders:
+		snapshot = publish_order_status(
+			"Ex Commerce Sales Order",
+			order_name,
+			doc.status,
+			erpnext_sales_order=doc.name,
+		)
+		if snapshot:
+			dispatch_event(ORDER_STATUS_WEBHOOK, snapshot, "Ex Commerce Sales Order", order_name)
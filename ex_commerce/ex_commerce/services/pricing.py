@@ -0,0 +1,41 @@
+"""
+Item price resolution
+
+One place that decides an item's selling price, shared by the product
+listing, cart and product Q&A APIs: the most recently created selling Item
+Price wins.
+"""
+
+import frappe
+
+
+def get_item_prices(item_codes):
+	"""{item_code: price} for items with a selling price, in one query"""
+	item_codes = tuple({code for code in item_codes if code})
+	if not item_codes:
+		return {}
+
+	rows = frappe.db.sql(
+		"""
+		select item_code, price_list_rate as price
+		from `tabItem Price`
+		where item_code in %(codes)s and selling = 1
+		order by creation desc
+		""",
+		{"codes": item_codes},
+		as_dict=True,
+	)
+	prices = {}
+	for row in rows:
+		# keep first seen (latest by creation due to order)
+		prices.setdefault(row.item_code, float(row.price or 0))
+	return prices
+
+
+def get_item_price(item_code):
+	"""Selling price of one item, 0.0 when it has none"""
+	return get_item_prices([item_code]).get(item_code, 0.0)
+
+
+def format_price(price):
+	return f"{price:,.2f}" if price and price > 0 else None
@@ -0,0 +1,356 @@
+"""
+Product question answering
+
+`prepare_answer` turns a shopper's question into a prompt in timed
+stages:
+
+- retrieve: catalog items and Product Knowledge Base chunks from
+  services/hybrid_search.py, or, when the question is about one item, a
+  vector search over that item's documents (embed + retrieve); results are
+  cached per normalized question and item
+- catalog: live item names and prices for the items retrieved,
+  via services/pricing.py (never cached, so answers quote current prices)
+- generate: a completion from the configured AI provider, streamed or
+  whole; without a provider a short extractive answer is built instead
+
+Before retrieval the question is looked up in services/answer_cache.py:
+a cached answer to a question close enough in meaning and about the same
+item (the one asked about, or else the best lexical catalog match), whose
+items, prices and excerpts have not changed since, is returned without
+retrieval or generation. Answers are cached unless generation failed over to the
+extractive fallback.
+
+Questions that differ only in case, spacing or trailing punctuation share
+cache entries. Each stage has a budget in LATENCY_BUDGET_MS; overruns are
+logged to the `ex_commerce.product_qa` logger and returned with the timings.
+"""
+
+import hashlib
+import re
+import time
+import unicodedata
+from contextlib import contextmanager
+
+import frappe
+
+from ex_commerce.ex_commerce.services import ann_index, answer_cache, hybrid_search
+from ex_commerce.ex_commerce.services.ai_client import ProviderError, get_client
+from ex_commerce.ex_commerce.services.embeddings import embed_query, get_embedder
+from ex_commerce.ex_commerce.services.pricing import format_price, get_item_prices
+
+KNOWLEDGE_DOCTYPE = "Product Knowledge Base"
+TOP_K = 5
+# Retrieved before narrowing down to a single item's documents
+ITEM_CANDIDATE_K = 50
+MAX_QUESTION_LENGTH = 500
+RESULT_CACHE_PREFIX = "ex_commerce:qa_result:"
+RESULT_CACHE_TTL = 10 * 60
+
+LATENCY_BUDGET_MS = {
+	"cache": 10,
+	"answer_cache": 20,
+	"embed": 150,
+	"retrieve": 150,
+	"catalog": 50,
+	"generate": 4000,
+	"first_token": 800,
+}
+
+SYSTEM_PROMPT = (
+	"You are a shop assistant. Answer the customer's question using only the product "
+	"facts and knowledge excerpts provided. Quote prices exactly as given. If the answer "
+	"is not in the material, say so and suggest contacting support. Keep it short."
+)
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question):
+	text = unicodedata.normalize("NFKC", question or "").lower()
+	text = _SPACE_RE.sub(" ", text).strip().rstrip("?!. ")
+	return text[:MAX_QUESTION_LENGTH]
+
+
+def _digest(*parts):
+	return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+
+class StageTimer:
+	def __init__(self):
+		self.started = time.monotonic()
+		self.timings = {}
+
+	@contextmanager
+	def stage(self, name):
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			self.record(name, start)
+
+	def record(self, name, start):
+		self.timings[name] = round((time.monotonic() - start) * 1000, 1)
+
+	def over_budget(self):
+		return {
+			stage: ms for stage, ms in self.timings.items() if ms > LATENCY_BUDGET_MS.get(stage, float("inf"))
+		}
+
+	def summary(self):
+		return {
+			"stages": dict(self.timings),
+			"total": round((time.monotonic() - self.started) * 1000, 1),
+			"over_budget": self.over_budget(),
+		}
+
+
+def retrieve_chunks(normalized, item_code=None, k=TOP_K, timer=None):
+	"""
+	Top-k knowledge chunks for a normalized question, plus the items they
+	(or the lexical catalog match) point to: {"chunks", "items"}.
+
+	Without an item this is hybrid_search (lexical + vector, fused); with one
+	it is a vector search limited to that item's documents (cached here).
+	"""
+	timer = timer or StageTimer()
+	if not item_code:
+		with timer.stage("retrieve"):
+			results = hybrid_search.search(normalized, k)
+		chunks = [chunk for result in results for chunk in result["chunks"][:1]]
+		return {"chunks": chunks[:k], "items": [result["item_code"] for result in results]}
+
+	embedder = get_embedder()
+	key = f"{RESULT_CACHE_PREFIX}{_digest(embedder.model_name, normalized, item_code, k)}"
+	with timer.stage("cache"):
+		cached = frappe.cache().get_value(key)
+	if cached is not None:
+		return cached
+
+	with timer.stage("embed"):
+		vector = embed_query(embedder, normalized)
+
+	with timer.stage("retrieve"):
+		allowed = set(frappe.get_all(KNOWLEDGE_DOCTYPE, filters={"item": item_code}, pluck="name"))
+		hits = []
+		if allowed:
+			hits = ann_index.search(embedder.model_name, vector, ITEM_CANDIDATE_K)
+			hits = [hit for hit in hits if hit["source_document"] in allowed][:k]
+
+		documents = {}
+		if hits:
+			documents = {
+				row.name: row
+				for row in frappe.get_all(
+					KNOWLEDGE_DOCTYPE,
+					filters={"name": ("in", list({hit["source_document"] for hit in hits}))},
+					fields=["name", "product_name", "item"],
+				)
+			}
+
+		chunks = []
+		for hit in hits:
+			document = documents.get(hit["source_document"])
+			if document:
+				chunks.append(
+					{
+						"source_document": hit["source_document"],
+						"product_name": document.product_name,
+						"item": document.item,
+						"chunk_text": hit["chunk_text"],
+						"score": round(hit["score"], 4),
+					}
+				)
+
+	retrieved = {"chunks": chunks, "items": [item_code]}
+	frappe.cache().set_value(key, retrieved, expires_in_sec=RESULT_CACHE_TTL)
+	return retrieved
+
+
+def get_catalog(item_codes):
+	"""Live name and price for sellable items, in the order given"""
+	item_codes = list(dict.fromkeys(code for code in item_codes if code))
+	if not item_codes:
+		return []
+
+	items = {
+		row.item_code: row
+		for row in frappe.get_all(
+			"Item",
+			filters={"item_code": ("in", item_codes), "disabled": 0, "is_sales_item": 1},
+			fields=["item_code", "item_name"],
+		)
+	}
+	prices = get_item_prices(list(items))
+	products = []
+	for code in item_codes:
+		if code in items:
+			price = prices.get(code) or 0.0
+			products.append(
+				{
+					"item_code": code,
+					"item_name": items[code].item_name,
+					"price": price if price > 0 else None,
+					"formatted_price": format_price(price),
+				}
+			)
+	return products
+
+
+def build_messages(question, chunks, products):
+	facts = "\n".join(
+		f"- {p['item_name']} ({p['item_code']}): "
+		+ (f"price {p['formatted_price']}" if p["formatted_price"] else "price on request")
+		for p in products
+	)
+	excerpts = "\n\n".join(f"[{c['product_name']}] {c['chunk_text']}" for c in chunks)
+	return [
+		{"role": "system", "content": SYSTEM_PROMPT},
+		{
+			"role": "user",
+			"content": f"Product facts:\n{facts or '- none'}\n\nKnowledge:\n{excerpts or 'none'}"
+			f"\n\nQuestion: {question}",
+		},
+	]
+
+
+def extractive_answer(chunks, products):
+	"""Answer without a provider: best excerpt plus current prices"""
+	if not chunks and not products:
+		return "Sorry, I could not find information about that product. Please contact support."
+	parts = []
+	if chunks:
+		parts.append(chunks[0]["chunk_text"].strip())
+	for product in products:
+		if product["formatted_price"]:
+			parts.append(f"{product['item_name']} currently costs {product['formatted_price']}.")
+	return "\n\n".join(parts)
+
+
+def prepare_answer(question, item_code=None, k=TOP_K):
+	"""
+	Everything up to generation: retrieval, live prices and the prompt, or
+	a still-current cached answer (`context.cached`) to a similar question.
+	"""
+	timer = StageTimer()
+	normalized = normalize_question(question)
+	question = (question or "").strip()[:MAX_QUESTION_LENGTH]
+	context = frappe._dict(
+		question=question,
+		normalized=normalized,
+		cached=None,
+		timer=timer,
+		logger=frappe.logger("ex_commerce.product_qa"),
+	)
+
+	embedder = get_embedder()
+	with timer.stage("embed"):
+		vector = embed_query(embedder, normalized)
+	with timer.stage("answer_cache"):
+		lexical_item = None if item_code else hybrid_search.top_lexical_item(normalized)
+		context.slot = answer_cache.open_slot(
+			embedder.model_name, vector, item_code=item_code, lexical_item=lexical_item
+		)
+		context.cached = answer_cache.lookup(context.slot)
+	if context.cached:
+		context.chunks = context.cached["sources"]
+		context.products = context.cached["products"]
+		return context
+
+	retrieved = retrieve_chunks(normalized, item_code=item_code, k=k, timer=timer)
+	chunks = retrieved["chunks"]
+
+	with timer.stage("catalog"):
+		products = get_catalog([*retrieved["items"], *(chunk["item"] for chunk in chunks)][:k])
+		# Versions are read before generating, so a change made meanwhile makes the entry stale
+		answer_cache.snapshot(context.slot, chunks, products)
+
+	context.update(chunks=chunks, products=products, messages=build_messages(question, chunks, products))
+	return context
+
+
+def _store_answer(context, text):
+	answer_cache.store(context.slot, context.question, text, context.chunks, context.products)
+
+
+def _log_budget(context):
+	over = context.timer.over_budget()
+	if over:
+		context.logger.warning(f"Product Q&A over latency budget: {over} for {context.normalized!r}")
+
+
+def answer(context):
+	"""Generate the whole answer for a prepared context"""
+	if context.cached:
+		text = context.cached["answer"]
+	else:
+		client = get_client()
+		failed = False
+		with context.timer.stage("generate"):
+			text = None
+			if client:
+				try:
+					text = client.complete(context.messages, temperature=0)["content"]
+				except ProviderError:
+					context.logger.exception("Product Q&A generation failed")
+					failed = True
+			if text is None:
+				text = extractive_answer(context.chunks, context.products)
+		if not failed:
+			_store_answer(context, text)
+
+	_log_budget(context)
+	return {
+		"answer": text,
+		"sources": context.chunks,
+		"products": context.products,
+		"cached": bool(context.cached),
+		"timings": context.timer.summary(),
+	}
+
+
+def stream_answer(context):
+	"""
+	(event, data) pairs for an SSE response: `context`, then `token`s, then
+	`done` with timings. The provider request is opened here, in the request
+	context; the returned generator needs no Frappe context.
+	"""
+	client = get_client()
+	deltas = None
+	failed = False
+	generate_started = time.monotonic()
+	if context.cached:
+		deltas = iter([context.cached["answer"]])
+	elif client:
+		try:
+			deltas = client.stream_complete(context.messages, temperature=0)
+		except ProviderError:
+			context.logger.exception("Product Q&A generation failed")
+			failed = True
+	if deltas is None:
+		deltas = iter([extractive_answer(context.chunks, context.products)])
+
+	def events():
+		yield (
+			"context",
+			{
+				"sources": context.chunks,
+				"products": context.products,
+				"cached": bool(context.cached),
+			},
+		)
+		first = True
+		parts = []
+		for delta in deltas:
+			if first:
+				context.timer.record("first_token", generate_started)
+				first = False
+			parts.append(delta)
+			yield "token", {"text": delta}
+		context.timer.record("generate", generate_started)
+		# Only a stream that ran to the end is cached; the slot needs no Frappe context
+		if not (context.cached or failed):
+			_store_answer(context, "".join(parts))
+		_log_budget(context)
+		yield "done", {"timings": context.timer.summary()}
+
+	return events()
@@ -0,0 +1,68 @@
+"""
+Redis token buckets
+
+A bucket refills at `rate` tokens per second up to `capacity` and is shared
+by every worker on the site. Refill and take happen in one Lua script using
+Redis server time, so concurrent callers can neither overdraw a bucket nor
+disagree about the clock.
+"""
+
+import time
+
+import frappe
+
+BUCKET_PREFIX = "ex_commerce:token_bucket:"
+
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+	tokens = tokens - cost
+	allowed = 1
+else
+	wait = (cost - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class TokenBucket:
+	def __init__(self, name, rate, capacity=None):
+		self.key = frappe.cache().make_key(f"{BUCKET_PREFIX}{name}")
+		self.rate = float(rate)
+		self.capacity = float(capacity or max(rate, 1))
+
+	@classmethod
+	def per_minute(cls, name, requests_per_minute, burst=None):
+		return cls(name, requests_per_minute / 60, burst or max(requests_per_minute / 10, 1))
+
+	def try_take(self, cost=1):
+		"""(allowed, seconds until `cost` tokens would be available)"""
+		script = frappe.cache().register_script(TAKE_SCRIPT)
+		allowed, wait = script(keys=[self.key], args=[self.rate, self.capacity, cost])
+		return bool(allowed), float(wait)
+
+	def take(self, cost=1, max_wait=0):
+		"""Take `cost` tokens, sleeping up to `max_wait` seconds for them"""
+		deadline = time.monotonic() + max_wait
+		while True:
+			allowed, wait = self.try_take(cost)
+			if allowed:
+				return True
+			if time.monotonic() + wait > deadline:
+				return False
+			time.sleep(wait)
@@ -0,0 +1,113 @@
+"""
+Ex Commerce Sales Order -> ERPNext Sales Order mapping
+
+Single implementation shared by the sales_order API, the doctype button and
+the background sync worker.
+"""
+
+import frappe
+from frappe.utils.caching import request_cache
+
+HEADER_FIELDS = (
+	"customer",
+	"customer_name",
+	"transaction_date",
+	"delivery_date",
+	"company",
+	"currency",
+	"selling_price_list",
+	"order_type",
+	"po_no",
+	"po_date",
+)
+
+
+@request_cache
+def get_customer_address_map(customer):
+	"""Return {address_type: address name} for a Customer, resolved in one query per request"""
+	if not customer:
+		return {}
+
+	addresses = frappe.get_all(
+		"Address",
+		filters={
+			"link_doctype": "Customer",
+			"link_name": customer,
+			"address_type": ["in", ["Billing", "Shipping"]],
+		},
+		fields=["name", "address_type"],
+		order_by="is_primary_address desc, creation asc",
+	)
+
+	address_map = {}
+	for address in addresses:
+		address_map.setdefault(address.address_type, address.name)
+	return address_map
+
+
+def get_customer_address(customer, address_type):
+	"""Get customer address by type"""
+	return get_customer_address_map(customer).get(address_type)
+
+
+def build_erpnext_sales_order(ex_order):
+	"""Build (but do not insert) an ERPNext Sales Order from an Ex Commerce Sales Order"""
+	so = frappe.new_doc("Sales Order")
+	for fieldname in HEADER_FIELDS:
+		so.set(fieldname, ex_order.get(fieldname))
+
+	# Set addresses
+	if ex_order.guest_billing_address or ex_order.guest_shipping_address:
+		address_map = get_customer_address_map(ex_order.customer)
+		if ex_order.guest_billing_address:
+			so.customer_address = address_map.get("Billing")
+		if ex_order.guest_shipping_address:
+			so.shipping_address_name = address_map.get("Shipping")
+
+	# Copy items
+	for item in ex_order.items:
+		so.append(
+			"items",
+			{
+				"item_code": item.item_code,
+				"item_name": item.item_name,
+				"qty": item.qty,
+				"rate": item.rate,
+				"amount": item.amount,
+				"warehouse": item.warehouse or ex_order.set_warehouse,
+			},
+		)
+
+	# Copy taxes
+	for tax in ex_order.taxes or []:
+		so.append(
+			"taxes",
+			{
+				"charge_type": tax.charge_type,
+				"account_head": tax.account_head,
+				"description": tax.description,
+				"rate": tax.rate,
+				"tax_amount": tax.tax_amount,
+			},
+		)
+
+	return so
+
+
+def create_erpnext_sales_order(ex_order):
+	"""
+	Insert and submit the ERPNext Sales Order for an Ex Commerce Sales Order
+	and link it back. Raises on failure; callers decide how to report it.
+	"""
+	if not ex_order.customer:
+		frappe.throw("Customer must be assigned before creating ERPNext Sales Order")
+
+	so = build_erpnext_sales_order(ex_order)
+	so.insert()
+	so.submit()
+
+	# Link back to Ex Commerce Sales Order
+	frappe.db.set_value("Ex Commerce Sales Order", ex_order.name, "erpnext_sales_order", so.name)
+	ex_order.erpnext_sales_order = so.name
+
+	return so
@@ -0,0 +1,177 @@
+"""
+Background ERPNext Sales Order sync for Ex Commerce Sales Orders
+
+Orders are marked "Queued" and handed to a background worker, which builds and
+submits the ERPNext Sales Order outside the web request. Failures are retried
+with exponential backoff until MAX_SYNC_ATTEMPTS, after which the order stays
+"Failed" until someone re-queues it.
+
+Sync state is written with `update_modified=False`, so a form that was just
+submitted can still be cancelled or amended without a timestamp mismatch;
+`erpnext_sync_updated_at` records when the sync state last changed instead.
+"""
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from ex_commerce.ex_commerce.services.sales_order_mapping import create_erpnext_sales_order
+
+DOCTYPE = "Ex Commerce Sales Order"
+
+SYNC_QUEUE = "long"
+MAX_SYNC_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+# Orders stuck in "Syncing" longer than this are assumed to have lost their worker
+STALE_SYNC_MINUTES = 30
+PENDING_BATCH_SIZE = 200
+
+
+def enqueue_sync(order_name, reset_attempts=False):
+	"""Mark an order as Queued and enqueue its sync job (one job per order)"""
+	values = {"erpnext_sync_status": "Queued", "erpnext_sync_next_retry": None}
+	if reset_attempts:
+		values.update({"erpnext_sync_attempts": 0, "erpnext_sync_error": None})
+
+	set_sync_state(order_name, values)
+
+	frappe.enqueue(
+		"ex_commerce.ex_commerce.services.sales_order_sync.sync_order",
+		queue=SYNC_QUEUE,
+		job_id=get_job_id(order_name),
+		deduplicate=True,
+		enqueue_after_commit=True,
+		order_name=order_name,
+	)
+
+
+def get_job_id(order_name):
+	return f"erpnext_sales_order_sync::{order_name}"
+
+
+def set_sync_state(order_name, values):
+	"""Write sync fields without touching `modified`, stamping erpnext_sync_updated_at"""
+	frappe.db.set_value(
+		DOCTYPE,
+		order_name,
+		{**values, "erpnext_sync_updated_at": now_datetime()},
+		update_modified=False,
+	)
+
+
+def sync_order(order_name):
+	"""Background job: create and submit the ERPNext Sales Order for one order"""
+	# Lock the row so a scheduler sweep and a queued job never sync the same order twice
+	order = frappe.db.get_value(
+		DOCTYPE,
+		order_name,
+		["name", "erpnext_sync_status", "erpnext_sync_attempts", "erpnext_sync_next_retry"],
+		as_dict=True,
+		for_update=True,
+	)
+	if not order or order.erpnext_sync_status == "Synced":
+		return
+
+	# Another worker holds a live lease on this order
+	if (
+		order.erpnext_sync_status == "Syncing"
+		and order.erpnext_sync_next_retry
+		and order.erpnext_sync_next_retry > now_datetime()
+	):
+		return
+
+	attempts = (order.erpnext_sync_attempts or 0) + 1
+	set_sync_state(
+		order_name,
+		{
+			"erpnext_sync_status": "Syncing",
+			"erpnext_sync_attempts": attempts,
+			# Lease: if the worker dies, the scheduler sweep picks the order up again after this
+			"erpnext_sync_next_retry": add_to_date(now_datetime(), minutes=STALE_SYNC_MINUTES),
+		},
+	)
+	frappe.db.commit()
+
+	error = None
+	try:
+		ex_order = frappe.get_doc(DOCTYPE, order_name)
+		if not ex_order.erpnext_sales_order:
+			create_erpnext_sales_order(ex_order)
+	except Exception as e:
+		error = str(e)
+
+	if not error:
+		set_sync_state(
+			order_name,
+			{
+				"erpnext_sync_status": "Synced",
+				"erpnext_sync_next_retry": None,
+				"erpnext_sync_error": None,
+			},
+		)
+		frappe.db.commit()
+		return
+
+	# Drop any half-created Sales Order before recording the failure
+	frappe.db.rollback()
+	frappe.log_error(f"Error creating ERPNext Sales Order for {order_name}: {error}")
+	record_failure(order_name, attempts, error)
+
+
+def record_failure(order_name, attempts, error):
+	"""Mark the order Failed and schedule the next retry with exponential backoff"""
+	next_retry = None
+	if attempts < MAX_SYNC_ATTEMPTS:
+		delay = min(BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX_SECONDS)
+		next_retry = add_to_date(now_datetime(), seconds=delay)
+
+	set_sync_state(
+		order_name,
+		{
+			"erpnext_sync_status": "Failed",
+			"erpnext_sync_next_retry": next_retry,
+			"erpnext_sync_error": (error or "Unknown error")[:1000],
+		},
+	)
+	frappe.db.commit()
+
+	frappe.logger().warning(
+		f"ERPNext Sales Order sync failed for {order_name} (attempt {attempts}/{MAX_SYNC_ATTEMPTS}): {error}"
+	)
+
+
+def sync_all_pending():
+	"""Scheduler job: enqueue every order that is due for (re)sync"""
+	now = now_datetime()
+
+	pending = frappe.db.sql(
+		"""
+		select name
+		from `tabEx Commerce Sales Order`
+		where docstatus = 1
+			and ifnull(customer, '') != ''
+			and ifnull(erpnext_sales_order, '') = ''
+			and (
+				erpnext_sync_status = 'Queued'
+				or (
+					erpnext_sync_status = 'Failed'
+					and erpnext_sync_attempts < %(max_attempts)s
+					and (erpnext_sync_next_retry is null or erpnext_sync_next_retry <= %(now)s)
+				)
+				or (erpnext_sync_status = 'Syncing' and erpnext_sync_next_retry <= %(now)s)
+			)
+		order by transaction_date asc, creation asc
+		limit %(limit)s
+		""",
+		{
+			"max_attempts": MAX_SYNC_ATTEMPTS,
+			"now": now,
+			"limit": PENDING_BATCH_SIZE,
+		},
+		pluck="name",
+	)
+
+	for order_name in pending:
+		enqueue_sync(order_name)
+
+	return pending
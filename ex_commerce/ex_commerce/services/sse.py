@@ -0,0 +1,44 @@
+"""
+Streaming responses
+
+Whitelisted methods can return `sse_response(events)` (server-sent events)
+or `text_stream_response(chunks)` (plain chunked text) to stream to the
+portal. The generator runs after Frappe has finished the request (no
+`frappe.local`, no database), so it must only use values captured before
+returning.
+"""
+
+import json
+
+from werkzeug.wrappers import Response
+
+
+def format_event(event, data):
+	return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+STREAM_HEADERS = {
+	"Cache-Control": "no-cache",
+	# Tell nginx not to buffer the stream
+	"X-Accel-Buffering": "no",
+}
+
+
+def sse_response(events):
+	"""Stream (event, data) pairs as text/event-stream"""
+	return Response(
+		(format_event(event, data) for event, data in events),
+		mimetype="text/event-stream",
+		headers=STREAM_HEADERS,
+		direct_passthrough=True,
+	)
+
+
+def text_stream_response(chunks):
+	"""Stream text chunks as they are produced (chunked transfer encoding)"""
+	return Response(
+		(chunk.encode() for chunk in chunks),
+		mimetype="text/plain",
+		headers=STREAM_HEADERS,
+		direct_passthrough=True,
+	)
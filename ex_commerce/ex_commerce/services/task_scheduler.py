@@ -0,0 +1,345 @@
+"""
+Queue Task scheduler
+
+Queue Tasks are claimed atomically (SELECT ... FOR UPDATE SKIP LOCKED) and
+run on per-task_type thread pools, so several bench workers can drain the
+same table without double-processing. Each task_type has a concurrency limit
+that holds across workers: claiming holds a per-type Redis lock while it
+counts the running tasks and marks new ones Processing. Failed tasks are
+retried with exponential backoff and moved to "Dead Letter" after
+max_attempts.
+
+The dispatcher always runs as one deduplicated job on the long queue; the
+scheduler only enqueues it, so its time budget never meets the default
+queue's job timeout.
+
+Handlers are registered per task_type through the `queue_task_handlers` hook:
+
+	queue_task_handlers = {"Embedding": "my_app.tasks.embed"}
+
+A handler receives the Queue Task row (payload already parsed) and its
+return value is ignored; raising marks the attempt as failed.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import add_to_date, now_datetime, time_diff_in_seconds
+
+DOCTYPE = "Queue Task"
+
+# Max tasks of each type running at once across all workers;
+# override per site with `ex_commerce_queue_task_concurrency` in site_config
+DEFAULT_CONCURRENCY = {"Embedding": 2, "Indexing": 1, "Processing": 4, "Other": 2}
+DEFAULT_MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 60 * 60
+# Processing tasks older than this are assumed to have lost their worker
+TASK_TIMEOUT_MINUTES = 30
+DISPATCH_TIME_BUDGET_SECONDS = 240
+DISPATCH_POLL_SECONDS = 1
+DISPATCH_JOB_ID = "queue_task_dispatch"
+DISPATCH_QUEUE = "long"
+CLAIM_LOCK_PREFIX = "ex_commerce:queue_task_claim:"
+CLAIM_LOCK_SECONDS = 30
+
+
+def enqueue_task(
+	task_type,
+	task_name,
+	payload=None,
+	priority="Medium",
+	reference_doctype=None,
+	reference_name=None,
+	max_attempts=DEFAULT_MAX_ATTEMPTS,
+):
+	"""Create a Pending Queue Task and make sure a dispatcher is running"""
+	task = frappe.get_doc(
+		{
+			"doctype": DOCTYPE,
+			"task_name": task_name,
+			"task_type": task_type,
+			"priority": priority,
+			"status": "Pending",
+			"payload": frappe.as_json(payload) if payload is not None else None,
+			"reference_doctype": reference_doctype,
+			"reference_name": reference_name,
+			"max_attempts": max_attempts,
+		}
+	)
+	task.flags.ignore_permissions = True
+	task.insert()
+
+	enqueue_dispatch(enqueue_after_commit=True)
+	return task.name
+
+
+def enqueue_dispatch(enqueue_after_commit=False):
+	"""Start the dispatcher job unless one is already queued or running (also the cron entry point)"""
+	frappe.enqueue(
+		"ex_commerce.ex_commerce.services.task_scheduler.dispatch",
+		queue=DISPATCH_QUEUE,
+		job_id=DISPATCH_JOB_ID,
+		deduplicate=True,
+		enqueue_after_commit=enqueue_after_commit,
+	)
+
+
+def get_concurrency_limits():
+	limits = dict(DEFAULT_CONCURRENCY)
+	limits.update(frappe.conf.get("ex_commerce_queue_task_concurrency") or {})
+	return limits
+
+
+def get_handler(task_type):
+	handlers = frappe.get_hooks("queue_task_handlers") or {}
+	paths = handlers.get(task_type)
+	if not paths:
+		return None
+	path = paths[-1] if isinstance(paths, list) else paths
+	return frappe.get_attr(path)
+
+
+def claim_tasks(task_type, concurrency, limit=None):
+	"""
+	Atomically move due Pending tasks of a type to Processing, so that at
+	most `concurrency` of the type are Processing across all workers (and at
+	most `limit` are claimed by this call). Returns the claimed names.
+	"""
+	limit = concurrency if limit is None else min(limit, concurrency)
+	if limit <= 0:
+		return []
+
+	cache = frappe.cache()
+	lock = cache.lock(
+		cache.make_key(f"{CLAIM_LOCK_PREFIX}{task_type}"),
+		timeout=CLAIM_LOCK_SECONDS,
+		blocking_timeout=CLAIM_LOCK_SECONDS,
+	)
+	if not lock.acquire():
+		return []
+
+	# Count and claim under the lock: another dispatcher cannot claim in between
+	try:
+		free = min(limit, concurrency - get_running_count(task_type))
+		if free <= 0:
+			return []
+
+		now = now_datetime()
+		names = frappe.db.sql(
+			"""
+			select name
+			from `tabQueue Task`
+			where status = 'Pending'
+				and docstatus < 2
+				and task_type = %(task_type)s
+				and (next_attempt_at is null or next_attempt_at <= %(now)s)
+			order by field(priority, 'High', 'Medium', 'Low'), creation
+			limit %(limit)s
+			for update skip locked
+			""",
+			{"task_type": task_type, "now": now, "limit": free},
+			pluck="name",
+		)
+		if names:
+			frappe.db.sql(
+				"""
+				update `tabQueue Task`
+				set status = 'Processing', started_at = %(now)s, finished_at = null,
+					attempts = ifnull(attempts, 0) + 1, modified = %(now)s
+				where name in %(names)s
+				""",
+				{"names": tuple(names), "now": now},
+			)
+		frappe.db.commit()
+		return names
+	finally:
+		try:
+			lock.release()
+		except Exception:
+			# Lock expired while we were still claiming - nothing left to release
+			pass
+
+
+def get_running_count(task_type):
+	return frappe.db.sql(
+		"""select count(*) from `tabQueue Task` where status = 'Processing' and task_type = %s""",
+		task_type,
+	)[0][0]
+
+
+def run_task(site, user, task_name):
+	"""Thread entry point: runs one claimed task with its own site connection"""
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		frappe.set_user(user)
+		execute_task(task_name)
+	finally:
+		frappe.destroy()
+
+
+def execute_task(task_name):
+	task = frappe.db.get_value(
+		DOCTYPE,
+		task_name,
+		["name", "task_type", "payload", "reference_doctype", "reference_name", "attempts", "max_attempts"],
+		as_dict=True,
+	)
+	if not task:
+		return
+
+	task.payload = frappe.parse_json(task.payload) if task.payload else {}
+
+	handler = get_handler(task.task_type)
+	if not handler:
+		_finish(task, "Dead Letter", error=f"No queue_task_handlers entry for task type {task.task_type}")
+		return
+
+	try:
+		handler(task)
+		frappe.db.commit()
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.log_error(f"Queue Task {task.name} failed: {e!s}", "Queue Task Error")
+		_record_failure(task, str(e))
+		return
+
+	_finish(task, "Completed")
+
+
+def _finish(task, status, error=None):
+	frappe.db.set_value(
+		DOCTYPE,
+		task.name,
+		{"status": status, "finished_at": now_datetime(), "error": error, "next_attempt_at": None},
+	)
+	frappe.db.commit()
+
+
+def _record_failure(task, error):
+	attempts = task.attempts or 1
+	max_attempts = task.max_attempts or DEFAULT_MAX_ATTEMPTS
+	if attempts >= max_attempts:
+		_finish(task, "Dead Letter", error=error[:1000])
+		return
+
+	delay = min(BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX_SECONDS)
+	frappe.db.set_value(
+		DOCTYPE,
+		task.name,
+		{
+			"status": "Pending",
+			"finished_at": now_datetime(),
+			"next_attempt_at": add_to_date(now_datetime(), seconds=delay),
+			"error": error[:1000],
+		},
+	)
+	frappe.db.commit()
+
+
+def requeue_stale_tasks():
+	"""Return tasks whose worker died mid-run to Pending (counts as an attempt)"""
+	stale_before = add_to_date(now_datetime(), minutes=-TASK_TIMEOUT_MINUTES)
+	frappe.db.sql(
+		"""
+		update `tabQueue Task`
+		set status = if(attempts >= ifnull(nullif(max_attempts, 0), %(default_max)s), 'Dead Letter', 'Pending'),
+			error = 'Worker timed out', modified = %(now)s
+		where status = 'Processing' and started_at < %(stale_before)s
+		""",
+		{"stale_before": stale_before, "now": now_datetime(), "default_max": DEFAULT_MAX_ATTEMPTS},
+	)
+	frappe.db.commit()
+
+
+def dispatch(time_budget=DISPATCH_TIME_BUDGET_SECONDS):
+	"""
+	Dispatcher job (see enqueue_dispatch): keep claiming and running tasks until the
+	queue is empty or the time budget is spent. Backpressure comes from the
+	per-type limits: a type at its limit is simply not claimed this round.
+	"""
+	requeue_stale_tasks()
+
+	site = frappe.local.site
+	user = frappe.session.user
+	limits = get_concurrency_limits()
+	pools = {
+		task_type: ThreadPoolExecutor(max_workers=limit) for task_type, limit in limits.items() if limit > 0
+	}
+	in_flight = {task_type: set() for task_type in pools}
+	deadline = time.monotonic() + time_budget
+	processed = 0
+
+	try:
+		while time.monotonic() < deadline:
+			for futures in in_flight.values():
+				done = {f for f in futures if f.done()}
+				processed += len(done)
+				futures -= done
+
+			claimed_any = False
+			for task_type, pool in pools.items():
+				free = limits[task_type] - len(in_flight[task_type])
+				for task_name in claim_tasks(task_type, limits[task_type], limit=free):
+					in_flight[task_type].add(pool.submit(run_task, site, user, task_name))
+					claimed_any = True
+
+			if not claimed_any and not any(in_flight.values()):
+				break
+			time.sleep(DISPATCH_POLL_SECONDS)
+	finally:
+		for pool in pools.values():
+			pool.shutdown(wait=True)
+
+	return processed
+
+
+@frappe.whitelist()
+def get_queue_metrics(window_minutes=60):
+	"""Queue depth per type/status and wait/run latency for recently finished tasks"""
+	frappe.only_for("System Manager")
+
+	depth = {}
+	for task_type, status, count in frappe.db.sql(
+		"""select task_type, status, count(*) from `tabQueue Task`
+		where status in ('Pending', 'Processing', 'Failed', 'Dead Letter')
+		group by task_type, status"""
+	):
+		depth.setdefault(task_type, {})[status] = count
+
+	since = add_to_date(now_datetime(), minutes=-int(window_minutes))
+	latency = {}
+	for row in frappe.db.sql(
+		"""
+		select task_type, count(*) as finished,
+			avg(timestampdiff(microsecond, creation, started_at)) / 1e6 as avg_wait_seconds,
+			avg(timestampdiff(microsecond, started_at, finished_at)) / 1e6 as avg_run_seconds,
+			max(timestampdiff(microsecond, started_at, finished_at)) / 1e6 as max_run_seconds
+		from `tabQueue Task`
+		where status in ('Completed', 'Dead Letter') and finished_at >= %(since)s
+		group by task_type
+		""",
+		{"since": since},
+		as_dict=True,
+	):
+		latency[row.task_type] = {
+			"finished": row.finished,
+			"avg_wait_seconds": float(row.avg_wait_seconds or 0),
+			"avg_run_seconds": float(row.avg_run_seconds or 0),
+			"max_run_seconds": float(row.max_run_seconds or 0),
+		}
+
+	oldest_pending = frappe.db.sql("""select min(creation) from `tabQueue Task` where status = 'Pending'""")[
+		0
+	][0]
+
+	return {
+		"depth": depth,
+		"latency": latency,
+		"oldest_pending_age_seconds": time_diff_in_seconds(now_datetime(), oldest_pending)
+		if oldest_pending
+		else 0,
+		"concurrency_limits": get_concurrency_limits(),
+	}
@@ -0,0 +1,176 @@
+"""
+Response Variant selection
+
+Variants are loaded per context reference once and turned into an alias
+table (Vose's method), so each pick is O(1) and needs no database or Redis
+round trip. Table weights come from Thompson sampling over each variant's
+Beta(successes + 1, failures + 1) posterior: the weight of a variant is the
+share of posterior draws in which it comes out best, with an exploration
+floor so no variant is starved.
+
+Feedback does not touch Response Variant inline. Submitted AI Feedback Log
+rows with a variant and rating are counted in a Redis hash, and the minutely
+`flush_feedback` job applies the totals with one UPDATE per variant. Tables
+are rebuilt TABLE_TTL_SECONDS after loading, which bounds how long new
+statistics (or edited variants) take to reach every worker.
+"""
+
+import random
+import time
+
+import frappe
+import numpy as np
+
+DOCTYPE = "Response Variant"
+FEEDBACK_KEY = "ex_commerce:variant_feedback"
+TABLE_TTL_SECONDS = 60
+POSTERIOR_SAMPLES = 2000
+EXPLORATION_FLOOR = 0.05
+
+_tables = {}
+
+
+def build_alias_table(weights):
+	"""(prob, alias) lists for O(1) sampling from `weights`"""
+	n = len(weights)
+	total = float(sum(weights))
+	scaled = [w * n / total for w in weights]
+	prob, alias = [0.0] * n, [0] * n
+	small = [i for i, w in enumerate(scaled) if w < 1.0]
+	large = [i for i, w in enumerate(scaled) if w >= 1.0]
+
+	while small and large:
+		s, g = small.pop(), large.pop()
+		prob[s], alias[s] = scaled[s], g
+		scaled[g] -= 1.0 - scaled[s]
+		(small if scaled[g] < 1.0 else large).append(g)
+
+	# Leftovers are 1.0 up to rounding error
+	for i in small + large:
+		prob[i], alias[i] = 1.0, i
+	return prob, alias
+
+
+def thompson_weights(successes, failures, samples=POSTERIOR_SAMPLES, rng=None):
+	"""Probability of each arm being best under its Beta posterior, with an exploration floor"""
+	rng = rng or np.random.default_rng()
+	successes = np.asarray(successes, dtype=np.float64)
+	failures = np.asarray(failures, dtype=np.float64)
+	if not len(successes):
+		return []
+	draws = rng.beta(successes + 1, failures + 1, size=(samples, len(successes)))
+	wins = np.bincount(draws.argmax(axis=1), minlength=len(successes)) / samples
+	return ((1 - EXPLORATION_FLOOR) * wins + EXPLORATION_FLOOR / len(successes)).tolist()
+
+
+class VariantTable:
+	def __init__(self, variants):
+		self.variants = variants
+		self.weights = thompson_weights(
+			[v.success_count or 0 for v in variants], [v.failure_count or 0 for v in variants]
+		)
+		self.prob, self.alias = build_alias_table(self.weights)
+		self.loaded_at = time.monotonic()
+
+	def is_expired(self):
+		return time.monotonic() - self.loaded_at > TABLE_TTL_SECONDS
+
+	def pick(self, rng=random):
+		if not self.variants:
+			return None
+		i = rng.randrange(len(self.variants))
+		return self.variants[i if rng.random() < self.prob[i] else self.alias[i]]
+
+
+def load_table(context_reference):
+	variants = frappe.get_all(
+		DOCTYPE,
+		filters={"context_reference": context_reference, "active": 1},
+		fields=["name", "response_text", "success_count", "failure_count"],
+		order_by="name asc",
+	)
+	# Cached even when empty, so contexts without variants are not queried on every pick
+	return VariantTable(variants)
+
+
+def get_table(context_reference):
+	table = _tables.get(context_reference)
+	if table is None or table.is_expired():
+		table = _tables[context_reference] = load_table(context_reference)
+	return table
+
+
+def pick_variant(context_reference):
+	"""Response Variant (name, response_text, counts) to use for a context, or None"""
+	return get_table(context_reference).pick()
+
+
+def clear_tables(context_reference=None):
+	if context_reference:
+		_tables.pop(context_reference, None)
+	else:
+		_tables.clear()
+
+
+def record_feedback(variant, positive):
+	"""Count one feedback event for `variant`; applied by `flush_feedback`"""
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	pipe.hincrby(cache.make_key(FEEDBACK_KEY), f"{variant}|{'s' if positive else 'f'}", 1)
+	pipe.execute()
+
+
+def _pop_feedback():
+	cache = frappe.cache()
+	key = cache.make_key(FEEDBACK_KEY)
+	pipe = cache.pipeline()
+	pipe.hgetall(key)
+	pipe.delete(key)
+	counts, _ = pipe.execute()
+
+	totals = {}
+	for field, count in counts.items():
+		variant, outcome = frappe.safe_decode(field).rsplit("|", 1)
+		successes, failures = totals.get(variant, (0, 0))
+		if outcome == "s":
+			successes += int(count)
+		else:
+			failures += int(count)
+		totals[variant] = (successes, failures)
+	return totals
+
+
+def _restore_feedback(totals):
+	cache = frappe.cache()
+	key = cache.make_key(FEEDBACK_KEY)
+	pipe = cache.pipeline()
+	for variant, (successes, failures) in totals.items():
+		if successes:
+			pipe.hincrby(key, f"{variant}|s", successes)
+		if failures:
+			pipe.hincrby(key, f"{variant}|f", failures)
+	pipe.execute()
+
+
+def flush_feedback():
+	"""Apply counted feedback to Response Variant statistics"""
+	totals = _pop_feedback()
+	if not totals:
+		return 0
+
+	try:
+		for variant, (successes, failures) in totals.items():
+			frappe.db.sql(
+				"""
+				update `tabResponse Variant`
+				set success_count = success_count + %s, failure_count = failure_count + %s
+				where name = %s
+				""",
+				(successes, failures, variant),
+			)
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		_restore_feedback(totals)
+		raise
+	return len(totals)
@@ -0,0 +1,466 @@
+"""
+Binary vector storage for Embedding Index
+
+Embeddings are kept outside the database as one contiguous, row-major matrix
+per (model, dtype) under `<site>/private/vector_store/`:
+
+	<model>.<dtype>.vec   raw float32/float16 rows, unit-normalized
+	<model>.<dtype>.del   one byte per row, 1 = deleted (tombstone)
+	<model>.<dtype>.i8    int8 codes of the same rows
+	<model>.<dtype>.scale one float32 scale per row for the int8 codes
+	<model>.<dtype>.untracked.json
+	                      {offset: first seen} for rows compaction found
+	                      without an Embedding Index row
+	<model>.json          {"model", "dim", "dtype"}
+
+`Embedding Index` rows only hold metadata and the row offset into the matrix.
+Matrices are opened with `numpy.memmap`, so loading is zero-copy and shared
+through the page cache across workers; cosine scores are a single matmul
+because rows are normalized on write.
+
+Searches scan the int8 codes (symmetric scalar quantization, one scale per
+row: dim + 4 bytes per row instead of 4 * dim for float32) and only read
+full-precision rows to rerank the best RERANK_FACTOR * k candidates, so the
+float matrix stays on disk and out of the hot working set. Stores written
+before quantization get their codes on first search. `compact` rewrites a
+store without its tombstoned rows.
+
+Vectors are written before their Embedding Index rows commit, so
+`add_embeddings` tombstones them again if the transaction rolls back.
+Deleting an Embedding Index row tombstones its vector only after the delete
+commits. Tombstones are written under the store lock, so none can land in a
+file that `compact` is replacing.
+"""
+
+import json
+import os
+import re
+from contextlib import contextmanager
+
+import frappe
+import numpy as np
+from frappe.utils.synchronization import filelock
+
+STORE_DIR = "vector_store"
+SUPPORTED_DTYPES = ("float32", "float16")
+DEFAULT_DTYPE = "float32"
+# float16 and int8 rows are upcast in blocks of this many rows while scoring
+SEARCH_BLOCK_ROWS = 65536
+# Quantized candidates per requested result that are reranked at full precision
+RERANK_FACTOR = 4
+
+# path -> (file size, mtime, memmap); reopened when the file grows
+_matrix_cache = {}
+
+
+def normalize(vectors):
+	"""L2-normalize rows; zero vectors are left as zeros"""
+	vectors = np.asarray(vectors, dtype=np.float32)
+	if vectors.ndim == 1:
+		vectors = vectors[np.newaxis, :]
+	norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+	norms[norms == 0] = 1.0
+	return vectors / norms
+
+
+def cosine_top_k(matrix, query, k, deleted=None):
+	"""
+	Cosine top-k by a full-precision scan of unit-normalized rows (used by
+	`exact_search`; `search` scans the int8 codes and reranks instead).
+
+	Returns (row offsets, scores), best first. Rows flagged in `deleted`
+	(uint8/bool mask of the same length) are never returned.
+	"""
+	n = matrix.shape[0]
+	if not n or k <= 0:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+	scores = block_scores(matrix, normalize(query)[0])
+	return _top_k(scores, k, deleted)
+
+
+def block_scores(matrix, query):
+	"""`matrix @ query`, upcasting non-float32 rows block by block"""
+	if matrix.dtype == np.float32:
+		return matrix @ query
+	scores = np.empty(matrix.shape[0], dtype=np.float32)
+	for start in range(0, matrix.shape[0], SEARCH_BLOCK_ROWS):
+		block = np.asarray(matrix[start : start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+		scores[start : start + len(block)] = block @ query
+	return scores
+
+
+def _top_k(scores, k, deleted=None):
+	n = len(scores)
+	if deleted is not None and len(deleted):
+		scores[np.asarray(deleted[:n], dtype=bool)] = -np.inf
+
+	k = min(k, n)
+	top = np.argpartition(-scores, k - 1)[:k]
+	top = top[np.argsort(-scores[top])]
+	top = top[np.isfinite(scores[top])]
+	return top.astype(np.int64), scores[top]
+
+
+def quantize_int8(vectors):
+	"""Symmetric per-row int8 quantization: vectors ~= codes * scales[:, None]"""
+	vectors = np.asarray(vectors, dtype=np.float32)
+	scales = np.abs(vectors).max(axis=1) / 127.0
+	scales[scales == 0] = 1.0
+	codes = np.clip(np.rint(vectors / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+	return codes, scales.astype(np.float32)
+
+
+def quantized_top_k(codes, scales, query, k, deleted=None):
+	"""Approximate cosine top-k over int8 codes; returns (row offsets, scores)"""
+	n = codes.shape[0]
+	if not n or k <= 0:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+	scores = block_scores(codes, normalize(query)[0]) * scales
+	return _top_k(scores, k, deleted)
+
+
+class VectorStore:
+	"""Append-only memory-mapped vector matrix for one embedding model"""
+
+	def __init__(self, model_name, dim=None, dtype=None):
+		if not model_name:
+			frappe.throw("Embedding model name is required")
+
+		self.model_name = model_name
+		self._locked = False
+		self.base_path = os.path.join(get_store_dir(), get_model_slug(model_name))
+		meta = self._read_meta()
+
+		# One storage dtype per model, fixed by the first write
+		if meta and dtype and dtype != meta["dtype"]:
+			frappe.throw(f"Embedding model {model_name} is stored as {meta['dtype']}, not {dtype}")
+		self.dtype = (meta or {}).get("dtype") or dtype or DEFAULT_DTYPE
+		if self.dtype not in SUPPORTED_DTYPES:
+			frappe.throw(f"Unsupported vector dtype {self.dtype}")
+
+		self.dim = int(dim or (meta or {}).get("dim") or 0) or None
+		if meta and self.dim and int(meta["dim"]) != self.dim:
+			frappe.throw(
+				f"Embedding model {model_name} stores {meta['dim']}-dimensional vectors, got {self.dim}"
+			)
+
+	@property
+	def vector_path(self):
+		return f"{self.base_path}.{self.dtype}.vec"
+
+	@property
+	def deleted_path(self):
+		return f"{self.base_path}.{self.dtype}.del"
+
+	@property
+	def codes_path(self):
+		return f"{self.base_path}.{self.dtype}.i8"
+
+	@property
+	def scales_path(self):
+		return f"{self.base_path}.{self.dtype}.scale"
+
+	@property
+	def untracked_path(self):
+		return f"{self.base_path}.{self.dtype}.untracked.json"
+
+	@property
+	def meta_path(self):
+		return f"{self.base_path}.json"
+
+	@property
+	def row_bytes(self):
+		return self.dim * np.dtype(self.dtype).itemsize
+
+	@contextmanager
+	def lock(self, timeout=30):
+		"""Cross-process lock serializing writes to this store; re-entrant per instance"""
+		if self._locked:
+			yield
+			return
+		with filelock(f"vector_store_{get_model_slug(self.model_name)}", timeout=timeout):
+			self._locked = True
+			try:
+				yield
+			finally:
+				self._locked = False
+
+	def __len__(self):
+		if not self.dim or not os.path.exists(self.vector_path):
+			return 0
+		return os.path.getsize(self.vector_path) // self.row_bytes
+
+	def _read_meta(self):
+		if not os.path.exists(self.meta_path):
+			return None
+		with open(self.meta_path) as f:
+			return json.load(f)
+
+	def read_untracked(self):
+		"""{offset: unix time first seen} of rows last found without an Embedding Index row"""
+		if not os.path.exists(self.untracked_path):
+			return {}
+		with open(self.untracked_path) as f:
+			return {int(offset): seen for offset, seen in json.load(f).items()}
+
+	def write_untracked(self, untracked):
+		if not untracked:
+			if os.path.exists(self.untracked_path):
+				os.remove(self.untracked_path)
+			return
+		with open(self.untracked_path, "w") as f:
+			json.dump({str(offset): seen for offset, seen in untracked.items()}, f)
+
+	def _write_meta(self):
+		with open(self.meta_path, "w") as f:
+			json.dump({"model": self.model_name, "dim": self.dim, "dtype": self.dtype}, f)
+
+	def append(self, vectors):
+		"""Append vectors and return their row offsets"""
+		vectors = normalize(vectors)
+		if not len(vectors):
+			return []
+
+		if self.dim is None:
+			self.dim = vectors.shape[1]
+		if vectors.shape[1] != self.dim:
+			frappe.throw(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+		with self.lock():
+			if not os.path.exists(self.meta_path):
+				self._write_meta()
+
+			self._sync_codes()
+			start = len(self)
+			codes, scales = quantize_int8(vectors)
+			with open(self.vector_path, "ab") as f:
+				f.write(vectors.astype(self.dtype).tobytes())
+			with open(self.deleted_path, "ab") as f:
+				f.write(bytes(len(vectors)))
+			with open(self.codes_path, "ab") as f:
+				f.write(codes.tobytes())
+			with open(self.scales_path, "ab") as f:
+				f.write(scales.tobytes())
+
+		return list(range(start, start + len(vectors)))
+
+	def _coded_rows(self):
+		if not self.dim or not os.path.exists(self.codes_path) or not os.path.exists(self.scales_path):
+			return 0
+		return min(os.path.getsize(self.codes_path) // self.dim, os.path.getsize(self.scales_path) // 4)
+
+	def _sync_codes(self):
+		"""Quantize rows that have no codes yet (stores written before quantization). Call under the store lock."""
+		coded, n = self._coded_rows(), len(self)
+		if coded >= n:
+			return
+		# Drop any partial row left by an interrupted write
+		for path, width in ((self.codes_path, self.dim), (self.scales_path, 4)):
+			with open(path, "ab") as f:
+				f.truncate(coded * width)
+		matrix = self.matrix()
+		with open(self.codes_path, "ab") as codes_file, open(self.scales_path, "ab") as scales_file:
+			for start in range(coded, n, SEARCH_BLOCK_ROWS):
+				codes, scales = quantize_int8(matrix[start : min(start + SEARCH_BLOCK_ROWS, n)])
+				codes_file.write(codes.tobytes())
+				scales_file.write(scales.tobytes())
+
+	def quantized(self):
+		"""Zero-copy (codes, scales) views covering every stored row"""
+		n = len(self)
+		if self._coded_rows() < n:
+			with self.lock():
+				self._sync_codes()
+		return (
+			_open_memmap(self.codes_path, "int8", self.dim, n),
+			_open_memmap(self.scales_path, "float32", None, n),
+		)
+
+	def delete(self, offsets):
+		"""Tombstone rows; their space is reclaimed by compaction"""
+		offsets = [int(o) for o in offsets if o is not None and 0 <= int(o) < len(self)]
+		if not offsets:
+			return
+		with self.lock(), open(self.deleted_path, "r+b") as f:
+			for offset in offsets:
+				f.seek(offset)
+				f.write(b"\x01")
+
+	def matrix(self):
+		"""Zero-copy (rows, dim) view of the stored vectors"""
+		return _open_memmap(self.vector_path, self.dtype, self.dim, len(self))
+
+	def deleted_mask(self):
+		return _open_memmap(self.deleted_path, "uint8", None, len(self))
+
+	def get(self, offsets):
+		"""Return the stored (normalized) vectors for row offsets as float32"""
+		return np.asarray(self.matrix()[np.asarray(offsets, dtype=np.int64)], dtype=np.float32)
+
+	def search(self, query, k=10, rerank_factor=RERANK_FACTOR):
+		"""Cosine top-k: int8 scan, then full-precision rerank; returns (offsets, scores)"""
+		if not len(self):
+			return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+		codes, scales = self.quantized()
+		candidates, _ = quantized_top_k(codes, scales, query, k * rerank_factor, deleted=self.deleted_mask())
+		return self.rerank(candidates, query, k)
+
+	def exact_search(self, query, k=10):
+		"""Cosine top-k over the full-precision rows; returns (offsets, scores)"""
+		if not len(self):
+			return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+		return cosine_top_k(self.matrix(), query, k, deleted=self.deleted_mask())
+
+	def rerank(self, candidates, query, k):
+		"""Exact top-k among candidate row offsets"""
+		if not len(candidates):
+			return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+		candidates = np.sort(np.asarray(candidates, dtype=np.int64))  # sequential reads from the memmap
+		top, scores = _top_k(self.get(candidates) @ normalize(query)[0], k)
+		return candidates[top], scores
+
+	def compact(self, keep):
+		"""
+		Rewrite the store with only the rows in `keep` (ascending offsets).
+		Row `keep[i]` moves to offset i; the caller updates Embedding Index.
+		Must be called while holding `lock()`. Returns the new row count.
+		"""
+		keep = np.asarray(keep, dtype=np.int64)
+		self._sync_codes()
+		n = len(self)
+		sources = (
+			(self.vector_path, self.matrix()),
+			(self.codes_path, _open_memmap(self.codes_path, "int8", self.dim, n)),
+			(self.scales_path, _open_memmap(self.scales_path, "float32", None, n)),
+		)
+		for path, array in sources:
+			with open(f"{path}.tmp", "wb") as f:
+				for start in range(0, len(keep), SEARCH_BLOCK_ROWS):
+					f.write(np.ascontiguousarray(array[keep[start : start + SEARCH_BLOCK_ROWS]]).tobytes())
+		with open(f"{self.deleted_path}.tmp", "wb") as f:
+			f.write(bytes(len(keep)))
+
+		for path in (self.vector_path, self.codes_path, self.scales_path, self.deleted_path):
+			os.replace(f"{path}.tmp", path)
+		return len(keep)
+
+	def memory_usage(self):
+		"""Bytes per row scanned by search (int8 codes + scale) vs the full-precision rows"""
+		if not self.dim:
+			return {"rows": 0}
+		quantized = self.dim + 4
+		return {
+			"rows": len(self),
+			"full_bytes_per_row": self.row_bytes,
+			"quantized_bytes_per_row": quantized,
+			"reduction": round(self.row_bytes / quantized, 2),
+		}
+
+
+def _open_memmap(path, dtype, dim, rows):
+	if not rows or not os.path.exists(path):
+		shape = (0, dim) if dim else (0,)
+		return np.empty(shape, dtype=dtype)
+
+	stat = os.stat(path)
+	cached = _matrix_cache.get(path)
+	if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+		return cached[2]
+
+	shape = (rows, dim) if dim else (rows,)
+	matrix = np.memmap(path, dtype=dtype, mode="r", shape=shape)
+	_matrix_cache[path] = (stat.st_size, stat.st_mtime, matrix)
+	return matrix
+
+
+def get_store_dir():
+	path = frappe.get_site_path("private", STORE_DIR)
+	os.makedirs(path, exist_ok=True)
+	return path
+
+
+def get_model_slug(model_name):
+	return re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name).strip("_") or "default"
+
+
+def get_store(model_name, dim=None, dtype=None):
+	return VectorStore(model_name, dim=dim, dtype=dtype)
+
+
+def add_embeddings(model_name, vectors, source_documents=None, dtype=None, extra_fields=None):
+	"""
+	Store vectors and create their `Embedding Index` rows.
+
+	`extra_fields` is an optional list of per-row field dicts (e.g. chunk
+	metadata). Returns the list of Embedding Index names, in input order.
+	"""
+	vectors = np.asarray(vectors, dtype=np.float32)
+	if vectors.ndim == 1:
+		vectors = vectors[np.newaxis, :]
+	if not len(vectors):
+		return []
+
+	store = get_store(model_name, dim=vectors.shape[1], dtype=dtype)
+	offsets = store.append(vectors)
+	# The rows below may never commit; rolled-back vectors must not stay searchable
+	frappe.db.after_rollback.add(lambda: store.delete(offsets))
+	source_documents = source_documents or [None] * len(offsets)
+	extra_fields = extra_fields or [{}] * len(offsets)
+
+	names = []
+	for offset, source_document, extra in zip(offsets, source_documents, extra_fields, strict=True):
+		doc = frappe.get_doc(
+			{
+				**extra,
+				"doctype": "Embedding Index",
+				"model_name": model_name,
+				"dimensions": store.dim,
+				"vector_dtype": store.dtype,
+				"vector_offset": offset,
+				"source_document": source_document,
+			}
+		)
+		doc.flags.ignore_permissions = True
+		doc.insert()
+		names.append(doc.name)
+	return names
+
+
+def search(model_name, query_vector, k=10):
+	"""
+	Cosine top-k over a model's vectors: an int8 scan of every row, then a
+	full-precision rerank of the best candidates (see VectorStore.search).
+
+	Returns [{"name", "source_document", "chunk_text", "score"}], best first.
+	"""
+	store = get_store(model_name)
+	offsets, scores = store.search(query_vector, k)
+	return resolve_offsets(model_name, offsets, scores)
+
+
+def resolve_offsets(model_name, offsets, scores):
+	"""Map vector offsets back to Embedding Index rows, keeping score order"""
+	if not len(offsets):
+		return []
+
+	rows = frappe.get_all(
+		"Embedding Index",
+		filters={"model_name": model_name, "vector_offset": ["in", [int(o) for o in offsets]]},
+		fields=["name", "source_document", "chunk_text", "vector_offset"],
+	)
+	by_offset = {row.vector_offset: row for row in rows}
+
+	results = []
+	for offset, score in zip(offsets, scores, strict=True):
+		row = by_offset.get(int(offset))
+		if row:
+			results.append(
+				{
+					"name": row.name,
+					"source_document": row.source_document,
+					"chunk_text": row.chunk_text,
+					"score": float(score),
+				}
+			)
+	return results
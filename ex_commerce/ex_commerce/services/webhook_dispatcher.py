@@ -0,0 +1,354 @@
+"""
+Outbound webhook delivery for AI Webhook Event
+
+Every submitted AI Webhook Event is a subscriber: `dispatch_event(event_name,
+data)` fans `data` out to all subscribers with that event name, and
+`dispatch_events` does the same for many payloads at once. Callers only
+enqueue a job; the job renders each subscriber's payload, records one AI
+Webhook Delivery row per payload, and sends them from an asyncio loop:
+
+- one aiohttp session per run, pooling at most CONNECTIONS_PER_HOST
+  keep-alive connections per host
+- at most MAX_CONCURRENCY requests in flight
+- INLINE_ATTEMPTS tries per request with exponential backoff and full
+  jitter, then later retries from the scheduler (`retry_due_deliveries`)
+  until MAX_ATTEMPTS
+- subscribers with "Supports Batch" receive queued payloads as one JSON
+  array of up to `batch_size` items
+
+Headers and payload templates are compiled once per (event, modified) and
+kept per process. The payload template is Jinja rendering to the request
+body, with the event data available as `data` (and its keys at top level);
+without a template the data is sent as JSON.
+"""
+
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+
+import aiohttp
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+DOCTYPE = "AI Webhook Event"
+DELIVERY_DOCTYPE = "AI Webhook Delivery"
+SUBSCRIBERS_CACHE_KEY = "ex_commerce_webhook_subscribers"
+
+MAX_CONCURRENCY = 50
+CONNECTIONS_PER_HOST = 8
+INLINE_ATTEMPTS = 3
+INLINE_BACKOFF_SECONDS = 0.5
+INLINE_BACKOFF_CAP_SECONDS = 8
+MAX_ATTEMPTS = 8
+RETRY_BACKOFF_MINUTES = 1
+RETRY_BACKOFF_CAP_MINUTES = 6 * 60
+RETRY_LEASE_MINUTES = 15
+RETRY_BATCH_SIZE = 500
+MAX_RESPONSE_BODY = 1000
+
+# Responses worth retrying; any other 4xx fails the delivery straight away
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+BODY_METHODS = frozenset({"POST", "PUT"})
+
+_compiled = {}
+
+
+@dataclass
+class Delivery:
+	"""One HTTP request, covering one or more AI Webhook Delivery rows"""
+
+	url: str
+	method: str
+	headers: dict
+	body: str | None
+	timeout: float
+	names: list = field(default_factory=list)
+	attempts: int = 0
+	response_status: int | None = None
+	response_body: str = ""
+	error: str | None = None
+	duration_ms: float = 0.0
+
+	@property
+	def ok(self):
+		return self.response_status is not None and 200 <= self.response_status < 300
+
+	@property
+	def retryable(self):
+		return self.response_status is None or self.response_status in RETRYABLE_STATUSES
+
+
+def backoff(attempt, base, cap):
+	"""Exponential backoff with full jitter"""
+	return random.uniform(0, min(cap, base * 2**attempt))
+
+
+async def _send(session, delivery):
+	started = time.monotonic()
+	delivery.attempts += 1
+	try:
+		async with session.request(
+			delivery.method,
+			delivery.url,
+			data=delivery.body.encode() if delivery.body is not None else None,
+			headers=delivery.headers,
+			timeout=aiohttp.ClientTimeout(total=delivery.timeout),
+		) as response:
+			delivery.response_status = response.status
+			delivery.response_body = (await response.text(errors="replace"))[:MAX_RESPONSE_BODY]
+			delivery.error = None if delivery.ok else f"HTTP {response.status}"
+	except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+		delivery.response_status = None
+		delivery.error = f"{type(e).__name__}: {e}"[:MAX_RESPONSE_BODY]
+	delivery.duration_ms = (time.monotonic() - started) * 1000
+
+
+async def _deliver(session, semaphore, delivery, attempts):
+	for attempt in range(attempts):
+		# Hold a concurrency slot only while the request is in flight
+		async with semaphore:
+			await _send(session, delivery)
+		if delivery.ok or not delivery.retryable or attempt == attempts - 1:
+			return delivery
+		await asyncio.sleep(backoff(attempt, INLINE_BACKOFF_SECONDS, INLINE_BACKOFF_CAP_SECONDS))
+	return delivery
+
+
+async def deliver_all(
+	deliveries,
+	concurrency=MAX_CONCURRENCY,
+	connections_per_host=CONNECTIONS_PER_HOST,
+	attempts=INLINE_ATTEMPTS,
+):
+	"""Send `deliveries` concurrently; results are recorded on each Delivery"""
+	connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=connections_per_host)
+	semaphore = asyncio.Semaphore(concurrency)
+	async with aiohttp.ClientSession(connector=connector) as session:
+		await asyncio.gather(*(_deliver(session, semaphore, d, attempts) for d in deliveries))
+	return deliveries
+
+
+def run_deliveries(deliveries, **kwargs):
+	"""Blocking wrapper around `deliver_all` for background jobs"""
+	return asyncio.run(deliver_all(deliveries, **kwargs))
+
+
+class CompiledEvent:
+	def __init__(self, doc):
+		self.name = doc.name
+		self.event_name = doc.event_name
+		self.url = doc.endpoint_url
+		self.method = (doc.method or "POST").upper()
+		self.supports_batch = bool(doc.supports_batch) and self.method in BODY_METHODS
+		self.batch_size = max(doc.batch_size or 1, 1)
+		self.timeout = doc.timeout_seconds or 10
+		self.headers = {row.header_key: row.header_value or "" for row in doc.headers if row.header_key}
+		if self.method in BODY_METHODS:
+			self.headers.setdefault("Content-Type", "application/json")
+		self.template = frappe.get_jenv().from_string(doc.payload_template) if doc.payload_template else None
+
+	def render(self, data):
+		if self.template is None:
+			return json.dumps(data, default=str)
+		return self.template.render({**data, "data": data})
+
+	def build_deliveries(self, rows):
+		"""Group AI Webhook Delivery rows (name, payload) into requests"""
+		if not self.supports_batch:
+			return [self._delivery(row.payload, [row.name]) for row in rows]
+		return [
+			self._delivery(
+				"[" + ",".join(row.payload for row in chunk) + "]",
+				[row.name for row in chunk],
+			)
+			for chunk in (rows[i : i + self.batch_size] for i in range(0, len(rows), self.batch_size))
+		]
+
+	def _delivery(self, body, names):
+		return Delivery(
+			url=self.url,
+			method=self.method,
+			headers=self.headers,
+			body=body if self.method in BODY_METHODS else None,
+			timeout=self.timeout,
+			names=names,
+		)
+
+
+def get_compiled_event(name, modified=None):
+	modified = modified or frappe.db.get_value(DOCTYPE, name, "modified")
+	key = (name, str(modified))
+	compiled = _compiled.get(key)
+	if compiled is None:
+		for stale in [k for k in _compiled if k[0] == name]:
+			del _compiled[stale]
+		compiled = _compiled[key] = CompiledEvent(frappe.get_doc(DOCTYPE, name))
+	return compiled
+
+
+def get_subscribers(event_name):
+	"""[(name, modified)] of submitted AI Webhook Events for `event_name`"""
+	return frappe.cache().hget(
+		SUBSCRIBERS_CACHE_KEY,
+		event_name,
+		generator=lambda: [
+			(row.name, str(row.modified))
+			for row in frappe.get_all(
+				DOCTYPE,
+				filters={"event_name": event_name, "docstatus": 1},
+				fields=["name", "modified"],
+			)
+		],
+	)
+
+
+def clear_subscribers_cache(event_name):
+	frappe.cache().hdel(SUBSCRIBERS_CACHE_KEY, event_name)
+
+
+def dispatch_event(event_name, data, reference_doctype=None, reference_name=None, after_commit=True):
+	"""Fan `data` out to every subscriber of `event_name` from a background job"""
+	return dispatch_events(
+		event_name,
+		[{"data": data, "reference_doctype": reference_doctype, "reference_name": reference_name}],
+		after_commit=after_commit,
+	)
+
+
+def dispatch_events(event_name, items, after_commit=True):
+	"""
+	Fan out many payloads at once (e.g. a broadcast). `items` are dicts with
+	`data` and optional `reference_doctype` / `reference_name`.
+	"""
+	if not items or not get_subscribers(event_name):
+		return False
+
+	frappe.enqueue(
+		"ex_commerce.ex_commerce.services.webhook_dispatcher.deliver_events",
+		queue="short" if len(items) == 1 else "long",
+		event_name=event_name,
+		items=items,
+		enqueue_after_commit=after_commit,
+	)
+	return True
+
+
+def deliver_events(event_name, items):
+	"""Background job: log and send payloads to all subscribers of `event_name`"""
+	subscribers = [get_compiled_event(name, modified) for name, modified in get_subscribers(event_name)]
+	if not subscribers:
+		return
+
+	now = now_datetime()
+	rows = [
+		frappe._dict(
+			name=frappe.generate_hash(length=10),
+			webhook_event=event.name,
+			event_name=event_name,
+			endpoint_url=event.url,
+			status="Queued",
+			attempts=0,
+			reference_doctype=item.get("reference_doctype"),
+			reference_name=item.get("reference_name"),
+			payload=event.render(item["data"]),
+			created_at=now,
+		)
+		for event in subscribers
+		for item in items
+	]
+
+	fields = list(rows[0])
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		DELIVERY_DOCTYPE,
+		["creation", "modified", "owner", "modified_by", *fields],
+		[(now, now, user, user, *(row[f] for f in fields)) for row in rows],
+	)
+	frappe.db.commit()
+
+	deliver_rows(rows)
+
+
+def deliver_rows(rows):
+	"""Send AI Webhook Delivery rows (name, webhook_event, payload, attempts) and record the outcome"""
+	previous_attempts = {row.name: row.attempts or 0 for row in rows}
+	by_event = {}
+	for row in rows:
+		by_event.setdefault(row.webhook_event, []).append(row)
+
+	deliveries = []
+	for event_name, event_rows in by_event.items():
+		if not frappe.db.exists(DOCTYPE, event_name):
+			frappe.db.set_value(
+				DELIVERY_DOCTYPE,
+				{"name": ("in", [row.name for row in event_rows])},
+				{"status": "Failed", "next_attempt_at": None, "error": "Webhook event no longer exists"},
+				update_modified=False,
+			)
+			continue
+		deliveries.extend(get_compiled_event(event_name).build_deliveries(event_rows))
+
+	if deliveries:
+		run_deliveries(deliveries)
+
+	for delivery in deliveries:
+		_record_result(delivery, max(previous_attempts[name] for name in delivery.names))
+	frappe.db.commit()
+	return deliveries
+
+
+def _record_result(delivery, previous_attempts):
+	attempts = previous_attempts + delivery.attempts
+	values = {
+		"attempts": attempts,
+		"response_status": delivery.response_status,
+		"response_body": delivery.response_body,
+		"duration_ms": delivery.duration_ms,
+		"error": delivery.error,
+	}
+	if delivery.ok:
+		values.update(status="Delivered", delivered_at=now_datetime(), next_attempt_at=None)
+	elif delivery.retryable and attempts < MAX_ATTEMPTS:
+		minutes = backoff(attempts, RETRY_BACKOFF_MINUTES, RETRY_BACKOFF_CAP_MINUTES)
+		values.update(status="Retrying", next_attempt_at=add_to_date(now_datetime(), minutes=max(minutes, 1)))
+	else:
+		values.update(status="Failed", next_attempt_at=None)
+
+	frappe.db.set_value(DELIVERY_DOCTYPE, {"name": ("in", delivery.names)}, values, update_modified=False)
+
+
+def retry_due_deliveries(limit=RETRY_BATCH_SIZE):
+	"""
+	Scheduler job: resend deliveries whose retry time has passed.
+
+	Claimed rows get a lease on next_attempt_at before anything is sent, so
+	an overlapping run skips them.
+	"""
+	rows = frappe.db.sql(
+		"""
+		select name, webhook_event, payload, attempts
+		from `tabAI Webhook Delivery`
+		where status = 'Retrying' and next_attempt_at <= %(now)s
+		order by next_attempt_at
+		limit %(limit)s
+		for update skip locked
+		""",
+		{"now": now_datetime(), "limit": limit},
+		as_dict=True,
+	)
+	if not rows:
+		return 0
+
+	frappe.db.set_value(
+		DELIVERY_DOCTYPE,
+		{"name": ("in", [row.name for row in rows])},
+		"next_attempt_at",
+		add_to_date(now_datetime(), minutes=RETRY_LEASE_MINUTES),
+		update_modified=False,
+	)
+	frappe.db.commit()
+
+	deliver_rows(rows)
+	return len(rows)
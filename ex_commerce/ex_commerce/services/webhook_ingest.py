@@ -0,0 +1,279 @@
+"""
+Inbound channel webhooks (WhatsApp, web chat)
+
+`api/webhooks.py` verifies the signature, enqueues the raw body and
+acknowledges straight away; `process_inbound` applies the Webhook Mapping
+and the chat ingress guard in a worker. Mapping rules are compiled once per
+(mapping, modified) into extraction functions, so a request only walks
+precomputed path steps.
+
+Rule syntax, one per line (`#` starts a comment):
+
+	@records entry[*].changes[*].value.messages[*]
+	message_id = id
+	content = text.body | ""
+	phone = from
+	business_number = $.entry[0].changes[0].value.metadata.display_phone_number
+
+`@records` (optional) selects the items to map, `[*]` expanding lists; by
+default the whole payload is one record. Field paths are relative to the
+record, or to the payload root when prefixed with `$.`. `| default` is used
+when the path is missing (parsed as JSON when possible).
+"""
+
+import hashlib
+import hmac
+import json
+import re
+
+import frappe
+
+from ex_commerce.ex_commerce.api.customer_creation import find_customer_by_phone
+from ex_commerce.ex_commerce.services import chat_guard
+from ex_commerce.ex_commerce.services.message_log import log_message
+from ex_commerce.ex_commerce.services.webhook_dispatcher import dispatch_event
+
+DOCTYPE = "Webhook Mapping"
+MAPPINGS_CACHE_KEY = "ex_commerce_webhook_mappings"
+
+WILDCARD = object()
+PATH_TOKEN_RE = re.compile(r"\.?([^.\[\]\s=]+)|\[(\d+|\*)\]")
+RULE_RE = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\s*=\s*([^|]+?)\s*(?:\|\s*(.*))?$")
+
+_compiled = {}
+
+
+class MappingRuleError(ValueError):
+	pass
+
+
+def parse_path(path):
+	"""`a.b[0].c` -> ["a", "b", 0, "c"]; `[*]` becomes WILDCARD"""
+	steps, position = [], 0
+	for match in PATH_TOKEN_RE.finditer(path):
+		if match.start() != position:
+			break
+		key, index = match.groups()
+		steps.append(key if key is not None else WILDCARD if index == "*" else int(index))
+		position = match.end()
+	if position != len(path) or not steps:
+		raise MappingRuleError(f"Invalid path: {path}")
+	return steps
+
+
+def compile_getter(steps):
+	steps = tuple(steps)
+
+	def get(value):
+		try:
+			for step in steps:
+				value = value[step]
+		except (KeyError, IndexError, TypeError):
+			return None
+		return value
+
+	return get
+
+
+def compile_selector(steps):
+	"""Function returning every value `steps` reaches, expanding WILDCARD over lists"""
+	steps = tuple(steps)
+
+	def select(value):
+		values = [value]
+		for step in steps:
+			next_values = []
+			for item in values:
+				try:
+					if step is WILDCARD:
+						next_values.extend(item if isinstance(item, list) else ())
+					else:
+						next_values.append(item[step])
+				except (KeyError, IndexError, TypeError):
+					continue
+			values = next_values
+		return values
+
+	return select
+
+
+def _parse_default(raw):
+	if raw is None:
+		return None
+	try:
+		return json.loads(raw)
+	except ValueError:
+		return raw
+
+
+class Mapper:
+	"""Compiled mapping rules: payload -> list of record dicts"""
+
+	def __init__(self, rules):
+		self.select_records = None
+		self.fields = []
+		for number, line in enumerate((rules or "").splitlines(), start=1):
+			line = line.split("#", 1)[0].strip()
+			if not line:
+				continue
+			try:
+				self._add_rule(line)
+			except MappingRuleError as e:
+				raise MappingRuleError(f"Line {number}: {e}") from None
+		if not self.fields:
+			raise MappingRuleError("No field rules defined")
+
+	def _add_rule(self, line):
+		if line.startswith("@records"):
+			path = line[len("@records") :].strip()
+			self.select_records = compile_selector(parse_path(path.removeprefix("$.")))
+			return
+
+		match = RULE_RE.match(line)
+		if not match:
+			raise MappingRuleError(f"Expected `field = path`, got: {line}")
+		target, path, default = match.groups()
+		from_root = path.startswith("$.")
+		steps = parse_path(path[2:] if from_root else path)
+		if WILDCARD in steps:
+			raise MappingRuleError(f"`[*]` is only allowed in @records: {path}")
+		self.fields.append((target, compile_getter(steps), from_root, _parse_default(default)))
+
+	def __call__(self, payload):
+		records = self.select_records(payload) if self.select_records else [payload]
+		mapped = []
+		for record in records:
+			row = {}
+			for target, get, from_root, default in self.fields:
+				value = get(payload if from_root else record)
+				row[target] = default if value is None else value
+			mapped.append(row)
+		return mapped
+
+
+class CompiledMapping:
+	def __init__(self, doc):
+		self.name = doc.name
+		self.webhook_name = doc.webhook_name
+		self.channel = doc.channel or "WhatsApp"
+		self.mapped_event = doc.mapped_event
+		self.event_name = frappe.db.get_value("AI Webhook Event", doc.mapped_event, "event_name")
+		self.signature_header = doc.signature_header or "X-Hub-Signature-256"
+		self.secret = doc.get_password("secret", raise_exception=False) if doc.secret else None
+		self.verify_token = (
+			doc.get_password("verify_token", raise_exception=False) if doc.verify_token else None
+		)
+		self.map = Mapper(doc.mapping_rules)
+
+	def verify_signature(self, body, signature):
+		"""HMAC-SHA256 of the raw body; fails closed when no secret is configured"""
+		if not self.secret or not signature:
+			return False
+		expected = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+		return hmac.compare_digest(expected, signature.removeprefix("sha256="))
+
+
+def get_mapping_key(webhook_name):
+	"""(name, modified) of the active Webhook Mapping called `webhook_name`, or None"""
+
+	def generator():
+		row = frappe.db.get_value(DOCTYPE, {"webhook_name": webhook_name, "active": 1}, ["name", "modified"])
+		return (row[0], str(row[1])) if row else None
+
+	return frappe.cache().hget(MAPPINGS_CACHE_KEY, webhook_name, generator=generator)
+
+
+def clear_mapping_cache(webhook_name=None):
+	if webhook_name:
+		frappe.cache().hdel(MAPPINGS_CACHE_KEY, webhook_name)
+	else:
+		frappe.cache().delete_value(MAPPINGS_CACHE_KEY)
+
+
+def get_compiled_mapping(webhook_name):
+	key = get_mapping_key(webhook_name)
+	if not key:
+		return None
+
+	compiled = _compiled.get(key)
+	if compiled is None:
+		for stale in [k for k in _compiled if k[0] == key[0]]:
+			del _compiled[stale]
+		compiled = _compiled[key] = CompiledMapping(frappe.get_doc(DOCTYPE, key[0]))
+	return compiled
+
+
+def enqueue_inbound(mapping, body):
+	frappe.enqueue(
+		"ex_commerce.ex_commerce.services.webhook_ingest.process_inbound",
+		queue="short",
+		webhook_name=mapping.webhook_name,
+		body=body.decode("utf-8", errors="replace"),
+		enqueue_after_commit=False,
+	)
+
+
+def process_inbound(webhook_name, body):
+	"""
+	Background job: map an inbound payload, then log and forward its messages.
+
+	Chat messages pass the ingress guard (services/chat_guard.py) first:
+	redeliveries are dropped, and a sender's burst of messages becomes one
+	logged, forwarded turn, subject to their turn rate limit. If the job
+	fails, ids of the messages it has not logged are forgotten again, so a
+	redelivery is processed.
+	"""
+	mapping = get_compiled_mapping(webhook_name)
+	if not mapping:
+		return []
+
+	turns = []
+	owned = []
+	# Ids marked seen whose messages this job still has to log
+	unlogged = set()
+	try:
+		for record in mapping.map(json.loads(body)):
+			if not record.get("content"):
+				# Status updates and other non-message records are forwarded as they are
+				turns.append(record)
+				continue
+			message_id = record.get("message_id")
+			if chat_guard.is_duplicate(mapping.channel, message_id):
+				continue
+			unlogged.add(message_id)
+
+			phone = record.get("phone")
+			customer = find_customer_by_phone(phone) if phone else None
+			record["customer"] = customer.name if customer else None
+			sender = record["customer"] or phone or message_id
+			if chat_guard.add_to_burst(sender, record):
+				owned.append(sender)
+			else:
+				# Joined a burst another job owns, or dropped by the rate limit
+				unlogged.discard(message_id)
+
+		for sender in owned:
+			records = chat_guard.collect_burst(sender)
+			# The owner logs the whole burst, whichever job received each message
+			unlogged.update(record.get("message_id") for record in records)
+			turn = chat_guard.coalesce(records)
+			if turn:
+				turn["message_log"] = log_message(
+					turn.get("message_id"),
+					turn["content"],
+					customer=turn["customer"],
+					direction="Incoming",
+					channel=mapping.channel,
+				)
+				turns.append(turn)
+			unlogged.difference_update(record.get("message_id") for record in records)
+	except Exception:
+		chat_guard.forget(mapping.channel, unlogged)
+		raise
+
+	if mapping.event_name:
+		for turn in turns:
+			dispatch_event(mapping.event_name, turn, DOCTYPE, mapping.name)
+
+	frappe.db.commit()
+	return turns
@@ -145,6 +145,31 @@ app_license = "mit"
 # 	}
 # }
 
+doc_events = {
+	"Sales Order": {
+		# on_change runs after every insert, save, submit, update-after-submit and cancel
+		"on_change": "ex_commerce.ex_commerce.services.order_events.on_sales_order_change",
+	},
+	"Item": {
+		"on_update": [
+			"ex_commerce.ex_commerce.services.hybrid_search.invalidate_lexical_index",
+			"ex_commerce.ex_commerce.services.answer_cache.invalidate_item",
+		],
+		"on_trash": [
+			"ex_commerce.ex_commerce.services.hybrid_search.invalidate_lexical_index",
+			"ex_commerce.ex_commerce.services.answer_cache.invalidate_item",
+		],
+		"after_rename": [
+			"ex_commerce.ex_commerce.services.hybrid_search.invalidate_lexical_index",
+			"ex_commerce.ex_commerce.services.answer_cache.invalidate_item",
+		],
+	},
+	"Item Price": {
+		"on_update": "ex_commerce.ex_commerce.services.answer_cache.invalidate_item_price",
+		"on_trash": "ex_commerce.ex_commerce.services.answer_cache.invalidate_item_price",
+	},
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -166,6 +191,39 @@ app_license = "mit"
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"ex_commerce.ex_commerce.services.message_log.flush",
+			"ex_commerce.ex_commerce.services.variant_selector.flush_feedback",
+			"ex_commerce.ex_commerce.services.knowledge_pipeline.process_pending_updates",
+		],
+		"*/5 * * * *": [
+			"ex_commerce.ex_commerce.services.sales_order_sync.sync_all_pending",
+			"ex_commerce.ex_commerce.services.task_scheduler.enqueue_dispatch",
+			"ex_commerce.ex_commerce.services.webhook_dispatcher.retry_due_deliveries",
+		],
+	},
+	"daily": [
+		"ex_commerce.ex_commerce.services.ann_index.rebuild_stale_indexes",
+	],
+	"daily_long": [
+		"ex_commerce.ex_commerce.services.log_archive.archive_old_logs",
+	],
+	"weekly_long": [
+		"ex_commerce.ex_commerce.services.ann_index.compact_stores",
+	],
+}
+
+# Queue Task Handlers
+# -------------------
+# Handlers run by ex_commerce.ex_commerce.services.task_scheduler, keyed by Queue Task task_type
+
+queue_task_handlers = {
+	"Embedding": "ex_commerce.ex_commerce.services.knowledge_pipeline.run_queue_task",
+	"Indexing": "ex_commerce.ex_commerce.services.ann_index.run_queue_task",
+}
+
 # Testing
 # -------
 
@@ -198,6 +256,7 @@ app_license = "mit"
 # ----------------
 # before_request = ["ex_commerce.utils.before_request"]
 # after_request = ["ex_commerce.utils.after_request"]
+before_request = ["ex_commerce.ex_commerce.services.model_registry.ensure_warm"]
 
 # Job Events
 # ----------
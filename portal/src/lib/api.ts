@@ -118,4 +118,6 @@ export const endpoints = {
 	createOrder: '/api/method/ex_commerce.ex_commerce.api.orders.create_order',
 	getOrder: (orderId: string) => `/api/method/ex_commerce.ex_commerce.api.orders.get_order?order_id=${orderId}`,
 	getOrderStatus: (orderId: string) => `/api/method/ex_commerce.ex_commerce.api.orders.get_order_status?order_id=${orderId}`,
+	waitForOrderStatus: (orderId: string, lastStatus?: string) =>
+		`/api/method/ex_commerce.ex_commerce.api.orders.wait_for_order_status?order_id=${encodeURIComponent(orderId)}${lastStatus ? `&last_status=${encodeURIComponent(lastStatus)}` : ''}`,
 };
@@ -56,6 +56,14 @@ export interface OrderStatusResponse {
 	status: string;
 }
 
+export interface OrderStatusChange {
+	order_id: string;
+	status: string;
+	changed: boolean;
+	seq?: number;
+	changed_at?: string;
+}
+
 export const OrdersApi = {
 	async createOrder(customerInfo: CustomerInfo, deliveryInfo: DeliveryInfo): Promise<OrderResponse> {
 		const response = await frappeApi.post<{ message: OrderResponse }>(endpoints.createOrder, {
@@ -76,5 +84,16 @@ export const OrdersApi = {
 		const response = await frappeApi.get<OrderStatusResponse>(endpoints.getOrderStatus(orderId));
 		return response;
 	},
+
+	/**
+	 * Long-poll until the order status differs from `lastStatus` (fallback when
+	 * the realtime `ex_commerce_order_status` event is unavailable, e.g. for guests)
+	 */
+	async waitForOrderStatus(orderId: string, lastStatus?: string): Promise<OrderStatusChange> {
+		const response = await frappeApi.get<{ message: OrderStatusChange }>(
+			endpoints.waitForOrderStatus(orderId, lastStatus)
+		);
+		return response.message;
+	},
 };
 